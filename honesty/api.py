@@ -1,33 +1,44 @@
 import asyncio
 import posixpath
-import shutil
+from datetime import datetime
+from enum import Enum, IntEnum
 from pathlib import Path
-from typing import List, Optional
+from typing import Any, Awaitable, Iterable, List, Optional, TypeVar
 
 import click
+import pkg_resources
 
 from honesty.cache import Cache
+from honesty.link import link_file
 from honesty.releases import FileType, Package
 
+T = TypeVar("T")
+
 
 def download_many(
-    package: Package, versions: List[str], dest: Path, cache: Cache
+    package: Package, versions: List[str], dest: Path, cache: Cache, link: str = "auto"
 ) -> int:
     """
     Intended as a convenience method for the CLI.  If you want async duplicate
     this.  Version parsing happens in the layer above in cmdline.py.
     """
     loop = asyncio.get_event_loop()
-    return loop.run_until_complete(async_download_many(package, versions, dest, cache))
+    return loop.run_until_complete(
+        async_download_many(package, versions, dest, cache, link)
+    )
 
 
 async def async_download_many(
-    package: Package, versions: List[str], dest: Optional[Path], cache: Cache
+    package: Package,
+    versions: List[str],
+    dest: Optional[Path],
+    cache: Cache,
+    link: str = "auto",
 ) -> int:
     # Once aioitertools has a new release, this can use concurency-limited
     # gather
     rc = 0
-    coros = [async_download_one(package, v, dest, cache) for v in versions]
+    coros = [async_download_one(package, v, dest, cache, link) for v in versions]
     for coro in asyncio.as_completed(coros):
         try:
             result = await coro
@@ -38,23 +49,77 @@ async def async_download_many(
     return rc
 
 
+async def bounded_gather(coros: Iterable[Awaitable[T]], limit: int) -> List[T]:
+    """
+    Like asyncio.gather, but with at most `limit` of the awaitables running at
+    once.  Results are in the same order as `coros`.
+    """
+    sem = asyncio.Semaphore(limit)
+
+    async def bounded(coro: Awaitable[T]) -> T:
+        async with sem:
+            return await coro
+
+    return await asyncio.gather(*[bounded(c) for c in coros])
+
+
 async def async_download_one(
-    package: Package, version: str, dest: Optional[Path], cache: Cache
+    package: Package,
+    version: str,
+    dest: Optional[Path],
+    cache: Cache,
+    link: str = "auto",
 ) -> Path:
+    """
+    Fetches the sdist into the cache, and if dest is given, populates it there
+    using the `link` strategy (see honesty.link).
+    """
     sdists = [
         f for f in package.releases[version].files if f.file_type == FileType.SDIST
     ]
     url = sdists[0].url
-    cache_path = await cache.async_fetch(package.name, url)
-    # TODO: check hash
+    cache_path = await cache.async_fetch(package.name, url, checksum=sdists[0].checksum)
     if dest:
         # So that cache can make arbitrary names, we get the basename portion
         # from the url.
         dest_filename = dest / posixpath.basename(url)
-        # In the future, can reflink for additional speedup (pypi:reflink)
-        # try:
-        #     reflink.reflink(cache_path, dest_filename)
-        # except (NotImplementedError, ReflinkImpossibleError) as e:
-        shutil.copyfile(cache_path, dest_filename)
+        link_file(cache_path, dest_filename, link)
         return dest_filename
     return cache_path
+
+
+def select_versions(package: Package, operator: str, selector: str) -> List[str]:
+    """
+    Given operator='==' and selector='*' or '2.0', return a list of the matching
+    versions, in increasing order.
+    """
+    if not package.releases:
+        raise click.ClickException(f"No releases at all for {package.name}")
+
+    if operator not in ("", "=="):
+        raise click.ClickException("Only '==' is supported")
+
+    if selector == "":
+        # latest
+        version = sorted(package.releases, key=pkg_resources.parse_version)[-1]
+        return [version]
+    elif selector == "*":
+        versions: List[str] = sorted(package.releases, key=pkg_resources.parse_version)
+        return versions
+    else:
+        if selector not in package.releases:
+            raise click.ClickException(
+                f"The version {selector} does not exist for {package.name}"
+            )
+        return [selector]
+
+
+def dataclass_default(obj: Any) -> Any:
+    if hasattr(obj, "__dataclass_fields__"):
+        return obj.__dict__
+    elif isinstance(obj, (Enum, IntEnum)):
+        return obj.name
+    elif isinstance(obj, datetime):
+        return str(obj)
+    else:
+        raise TypeError(obj)
@@ -1,13 +1,30 @@
+import contextlib
 import fnmatch
 import hashlib
 import os
 import os.path
+import queue
 import shutil
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
 from pathlib import Path
-from typing import Dict, Iterable, List, Tuple
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from .decompress import is_compressed_tar, open_decompressed
+from .digests import DigestStore, open_store, zip_member_keys
+from .instrument import Event, emit, timed
 
 ZIP_EXTENSIONS = (".zip", ".egg", ".whl")
 
+# archive_hashes: threads hashing members, and how many decompressed members
+# may wait for them.
+HASH_WORKERS = min(4, os.cpu_count() or 1)
+HASH_QUEUE_DEPTH = 16
+MAX_LINK_HOPS = 40
+
 
 def extract_and_get_names(
     archive_filename: Path,
@@ -19,12 +36,11 @@ def extract_and_get_names(
     )
     archive_root = os.path.join(cache_path, archive_filename.name)
     if not os.path.exists(archive_root + ".done"):
-        format = "zip" if str(archive_filename).endswith(ZIP_EXTENSIONS) else None
-        # mypy-fixme: arg 1 expects str, not Path
-        shutil.unpack_archive(archive_filename.as_posix(), archive_root, format)
-
-    with open(archive_root + ".done", "w"):
-        pass
+        os.makedirs(cache_path, exist_ok=True)
+        with _locked(archive_root + ".lock"):
+            # Someone else may have finished it while we waited.
+            if not os.path.exists(archive_root + ".done"):
+                _extract_atomically(archive_filename, archive_root)
 
     # relpath, srcpath
     names: List[Tuple[str, str]] = []
@@ -35,32 +51,269 @@ def extract_and_get_names(
                 continue  # skip for now
 
             relname = os.path.join(dirpath[len(archive_root) + 1 :], name)
+            names.append((relname, _srckey(relname, strip_top_level)))
+
+    return (archive_root, names)
 
-            srckey = relname
-            # To do this right, we need to read setup.py to know how it gets
-            # mapped, but this is an 80% solution.  I'm not 100% sure this does
-            # the right thing on windows.
-            if strip_top_level:
-                srckey = srckey.split(os.sep, 1)[-1]
-            if srckey.startswith("src" + os.sep):
-                srckey = srckey[4:]
 
-            names.append((relname, srckey))
+@contextlib.contextmanager
+def _locked(lock_path: str) -> Iterator[None]:
+    """
+    Holds an exclusive lock on lock_path (created if need be), against other
+    processes and other threads alike.  Without fcntl (windows) there's no
+    lock, and only the rename in _extract_atomically protects readers.
+    """
+    try:
+        import fcntl
+    except ImportError:  # pragma: no cover
+        yield
+        return
+    with open(lock_path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
 
-    return (archive_root, names)
+
+def _extract_atomically(archive_filename: Path, archive_root: str) -> None:
+    """
+    Extracts to a temporary directory next to archive_root, and renames it
+    into place, so archive_root is only ever absent or complete.  The .done
+    marker is written last; a tree without one (left by an older version, or
+    an interrupted one without locks) is replaced.
+    """
+    parent, name = os.path.split(archive_root)
+    tmp = tempfile.mkdtemp(prefix=f".{name}.", dir=parent)
+    try:
+        format = "zip" if str(archive_filename).endswith(ZIP_EXTENSIONS) else None
+        with timed("extract", None, archive_filename.name):
+            if format is None and is_compressed_tar(archive_filename):
+                _extract_tar(archive_filename, tmp)
+            else:
+                # mypy-fixme: arg 1 expects str, not Path
+                shutil.unpack_archive(archive_filename.as_posix(), tmp, format)
+        if os.path.exists(archive_root):
+            stale = tempfile.mkdtemp(prefix=f".{name}.", dir=parent)
+            os.replace(archive_root, os.path.join(stale, name))
+            shutil.rmtree(stale)
+        os.rename(tmp, archive_root)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+    with open(archive_root + ".done", "w"):
+        pass
+
+
+def _srckey(relname: str, strip_top_level: bool) -> str:
+    srckey = relname
+    # To do this right, we need to read setup.py to know how it gets
+    # mapped, but this is an 80% solution.  I'm not 100% sure this does
+    # the right thing on windows.
+    if strip_top_level:
+        srckey = srckey.split(os.sep, 1)[-1]
+    if srckey.startswith("src" + os.sep):
+        srckey = srckey[4:]
+    return srckey
+
+
+def _extract_tar(archive_filename: Path, archive_root: str) -> None:
+    """
+    Like shutil.unpack_archive, but decompressing with the fastest backend
+    available (see decompress.py), which may be a pipe so we read it as a
+    stream.
+    """
+    with open_decompressed(archive_filename) as f:
+        with tarfile.open(fileobj=f, mode="r|") as tf:
+            tf.extractall(archive_root)
+
+
+def _relname(member_name: str) -> Optional[str]:
+    """
+    Where a member would be extracted to, relative to the archive root, or
+    None if that's outside it (which unpack_archive skips or refuses).
+    """
+    relname = os.path.normpath(member_name)
+    if os.path.isabs(relname) or relname.split(os.sep)[0] in ("..", "."):
+        return None
+    return relname
+
+
+class _Member(NamedTuple):
+    relname: str
+    data: Optional[bytes] = None  # to be hashed
+    key: Optional[bytes] = None  # where to remember data's hash, if anywhere
+    sha: Optional[str] = None  # already known, from the digest store
+    link: Optional[str] = None  # relname of the link's target
+
+
+def _iter_members(
+    archive_filename: Path,
+    patterns: Iterable[str],
+    store: Optional[DigestStore] = None,
+) -> Iterator[_Member]:
+    """
+    Yields each regular file or link matching patterns, in archive order,
+    without extracting to disk.  Zip members already in store are yielded
+    with their sha instead of their data.
+    """
+
+    def wanted(name: str) -> bool:
+        return any(fnmatch.fnmatch(os.path.basename(name), p) for p in patterns)
+
+    if archive_filename.name.endswith(ZIP_EXTENSIONS):
+        with zipfile.ZipFile(archive_filename) as zf:
+            members = []
+            for info in zf.infolist():
+                relname = _relname(info.filename)
+                if relname and not info.is_dir() and wanted(relname):
+                    members.append((relname, info))
+            keys: List[Optional[bytes]] = [None] * len(members)
+            known: Dict[bytes, str] = {}
+            if store is not None:
+                with open(archive_filename, "rb") as raw:
+                    keys = zip_member_keys(raw, [info for relname, info in members])
+                known = store.get_many([k for k in keys if k is not None])
+            for (relname, info), key in zip(members, keys):
+                if key is not None and key in known:
+                    yield _Member(relname, sha=known[key])
+                else:
+                    yield _Member(relname, data=zf.read(info), key=key)
+        return
+
+    with contextlib.ExitStack() as stack:
+        if is_compressed_tar(archive_filename):
+            f = stack.enter_context(open_decompressed(archive_filename))
+            tf = tarfile.open(fileobj=f, mode="r|")
+        else:
+            tf = tarfile.open(archive_filename, mode="r|*")
+        stack.enter_context(tf)
+        for member in tf:
+            relname = _relname(member.name)
+            if not relname or not wanted(relname):
+                continue
+            if member.isreg():
+                buf = tf.extractfile(member)
+                assert buf is not None
+                yield _Member(relname, data=buf.read())
+            elif member.issym() and not os.path.isabs(member.linkname):
+                target = _relname(
+                    os.path.join(os.path.dirname(member.name), member.linkname)
+                )
+                if target:
+                    yield _Member(relname, link=target)
+            elif member.islnk():
+                target = _relname(member.linkname)
+                if target:
+                    yield _Member(relname, link=target)
+
+
+# (seq, relname, sha or link target, is_link)
+Hashed = Tuple[int, str, str, bool]
+
+
+def _hash_worker(
+    q: "queue.Queue[Optional[Tuple[int, _Member]]]",
+    hashed: List[Hashed],
+    learned: List[Tuple[bytes, str]],
+    stats: List[Tuple[int, float]],
+    errors: List[Exception],
+) -> None:
+    while True:
+        item = q.get()
+        if item is None:
+            return
+        seq, member = item
+        assert member.data is not None
+        data = member.data
+        t0 = time.monotonic()
+        try:
+            data = data.replace(b"\r\n", b"\n")
+            sha = hashlib.sha1(data).hexdigest()
+            hashed.append((seq, member.relname, sha, False))
+            if member.key is not None:
+                learned.append((member.key, sha))
+        except Exception as e:
+            # Keep draining, so the producer can't block on a full queue.
+            errors.append(e)
+        stats.append((len(data), time.monotonic() - t0))
 
 
 # [path] = sha
 def archive_hashes(
     archive_filename: Path, strip_top_level: bool = False
 ) -> Dict[str, str]:
-    d: Dict[str, str] = {}
-    archive_root, names = extract_and_get_names(archive_filename, strip_top_level)
+    """
+    Hashes the .py files in an archive (with \\r\\n normalized to \\n), keyed
+    by where they'd be imported from.
+
+    This thread decompresses and queues members while HASH_WORKERS threads
+    hash them; memory is bounded by HASH_QUEUE_DEPTH members.  The "extract"
+    and "hash" events it emits overlap, and "hash" is the total over workers.
+
+    Wheel members whose hash is in the digest store (see digests.py) are
+    neither decompressed nor hashed, and new ones are added to it.
+    """
+    q: "queue.Queue[Optional[Tuple[int, _Member]]]" = queue.Queue(HASH_QUEUE_DEPTH)
+    hashed: List[Hashed] = []
+    learned: List[Tuple[bytes, str]] = []
+    stats: List[Tuple[int, float]] = []
+    errors: List[Exception] = []
+    workers = [
+        threading.Thread(target=_hash_worker, args=(q, hashed, learned, stats, errors))
+        for i in range(HASH_WORKERS)
+    ]
+    store = open_store() if archive_filename.name.endswith(ZIP_EXTENSIONS) else None
+    for w in workers:
+        w.start()
+    try:
+        with timed("extract", None, archive_filename.name) as event:
+            for seq, member in enumerate(
+                _iter_members(archive_filename, ("*.py",), store)
+            ):
+                if member.link is not None:
+                    hashed.append((seq, member.relname, member.link, True))
+                elif member.sha is not None:
+                    hashed.append((seq, member.relname, member.sha, False))
+                else:
+                    assert member.data is not None
+                    event.nbytes += len(member.data)
+                    q.put((seq, member))
+    finally:
+        for w in workers:
+            q.put(None)
+        for w in workers:
+            w.join()
+        if store is not None:
+            if learned and not errors:
+                store.put_many(learned)
+            store.close()
+    if errors:
+        raise errors[0]
+    emit(
+        Event(
+            "hash",
+            None,
+            archive_filename.name,
+            sum(t for n, t in stats),
+            sum(n for n, t in stats),
+        )
+    )
 
-    for relname, srcname in names:
-        with open(os.path.join(archive_root, relname), "rb") as buf:
-            data = buf.read().replace(b"\r\n", b"\n")
+    # Later members replace earlier ones, as they would when extracting
+    # (which overwrites in place, so links see the final contents too).
+    shas: Dict[str, str] = {}
+    links: Dict[str, str] = {}
+    for seq, relname, value, is_link in sorted(hashed):
+        (links if is_link else shas)[relname] = value
+        (shas if is_link else links).pop(relname, None)
+    for relname, target in links.items():
+        for i in range(MAX_LINK_HOPS):
+            if target not in links:
+                break
+            target = links[target]
+        if target in shas:
+            shas[relname] = shas[target]
 
-        sha = hashlib.sha1(data).hexdigest()
-        d[srcname] = sha
-    return d
+    return {_srckey(relname, strip_top_level): sha for relname, sha in shas.items()}
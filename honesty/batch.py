@@ -0,0 +1,146 @@
+"""
+Batch mode, for checking many packages (say, a whole lockfile) in one process.
+"""
+
+import asyncio
+import json
+import re
+from concurrent.futures import Executor
+from typing import IO, Any, Dict, Iterable, List, Optional, Tuple
+
+from .api import select_versions
+from .cache import Cache
+from .catalog import Catalog
+from .checker import ERROR_RC, ResultCache, async_run_checker
+from .releases import Package, async_parse_index
+from .wheels import EXHAUSTIVE, WheelSelection
+
+EXTRAS_RE = re.compile(r"\[[^\]]*\]")
+
+
+def parse_specs(lines: Iterable[str]) -> List[Tuple[str, str, str]]:
+    """
+    Given the lines of a requirements-style file, returns (name, operator,
+    version) in the same form as `package_name.partition("==")` in cmdline.py.
+
+    Comments, environment markers, extras and option lines (`-r`, `--hash`,
+    ...) are ignored.  Anything other than a bare name or `name==version` is
+    passed through and will fail in select_versions.
+    """
+    specs: List[Tuple[str, str, str]] = []
+    for line in lines:
+        line = line.split(" #", 1)[0].split(";", 1)[0].strip().rstrip("\\").strip()
+        if not line or line.startswith(("#", "-")):
+            continue
+        line = EXTRAS_RE.sub("", line.replace(" ", ""))
+        specs.append(line.partition("=="))
+    return specs
+
+
+async def async_check_package(
+    spec: Tuple[str, str, str],
+    cache: Cache,
+    use_json: bool = True,
+    executor: Optional[Executor] = None,
+    results: Optional[ResultCache] = None,
+    catalog: Optional[Catalog] = None,
+    selection: WheelSelection = EXHAUSTIVE,
+) -> Dict[str, Any]:
+    """
+    Checks the selected versions of one package, returning a json-friendly
+    dict.  Never raises for ordinary errors; they are reported in the result.
+
+    When `catalog` is given, the index and verdicts are recorded there.
+    """
+    package_name, operator, version = spec
+    result: Dict[str, Any] = {"package": package_name, "rc": 0, "versions": []}
+    try:
+        package = await async_parse_index(package_name, cache, use_json=use_json)
+        if catalog is not None:
+            catalog.record_package(package)
+        selected_versions = select_versions(package, operator, version)
+    except Exception as e:
+        result["rc"] |= ERROR_RC
+        result["error"] = str(e) or repr(e)
+        return result
+
+    return await async_check_versions(
+        package, selected_versions, cache, executor, results, catalog, selection
+    )
+
+
+async def async_check_versions(
+    package: Package,
+    versions: List[str],
+    cache: Cache,
+    executor: Optional[Executor] = None,
+    results: Optional[ResultCache] = None,
+    catalog: Optional[Catalog] = None,
+    selection: WheelSelection = EXHAUSTIVE,
+) -> Dict[str, Any]:
+    """
+    Like async_check_package, for an already-parsed (and recorded) package.
+    """
+    result: Dict[str, Any] = {"package": package.name, "rc": 0, "versions": []}
+    for v in versions:
+        try:
+            check = await async_run_checker(
+                package,
+                v,
+                verbose=False,
+                cache=cache,
+                executor=executor,
+                results=results,
+                selection=selection,
+            )
+        except Exception as e:
+            result["rc"] |= ERROR_RC
+            result["versions"].append(
+                {"version": v, "rc": ERROR_RC, "error": str(e) or repr(e)}
+            )
+            continue
+
+        if catalog is not None:
+            catalog.record_check(check)
+        result["rc"] |= check.rc
+        result["versions"].append(
+            {
+                "version": v,
+                "rc": check.rc,
+                "status": check.status,
+                "messages": {k: sorted(fs) for k, fs in check.messages.items()},
+            }
+        )
+    return result
+
+
+async def async_check_batch(
+    specs: List[Tuple[str, str, str]],
+    cache: Cache,
+    output: IO[str],
+    use_json: bool = True,
+    concurrency: int = 8,
+    executor: Optional[Executor] = None,
+    results: Optional[ResultCache] = None,
+    catalog: Optional[Catalog] = None,
+    selection: WheelSelection = EXHAUSTIVE,
+) -> int:
+    """
+    Checks up to `concurrency` packages at a time, writing one json line per
+    package to `output` as each finishes.  Returns the or'd rc of all of them.
+    """
+    sem = asyncio.Semaphore(concurrency)
+
+    async def bounded(spec: Tuple[str, str, str]) -> Dict[str, Any]:
+        async with sem:
+            return await async_check_package(
+                spec, cache, use_json, executor, results, catalog, selection
+            )
+
+    rc = 0
+    for coro in asyncio.as_completed([bounded(s) for s in specs]):
+        result = await coro
+        rc |= result["rc"]
+        output.write(json.dumps(result, sort_keys=True) + "\n")
+        output.flush()
+    return rc
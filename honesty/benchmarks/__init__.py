@@ -0,0 +1,5 @@
+"""
+Benchmarks for the archive, releases and cache hot paths, on generated
+fixtures (see fixtures.py).  Run with `python -m honesty.benchmarks`, `--save`
+the results, and `--compare` a later run against them to spot regressions.
+"""
@@ -0,0 +1,67 @@
+import json
+import sys
+import tempfile
+from pathlib import Path
+from typing import Optional, Tuple
+
+import click
+
+from .fixtures import generate
+from .suite import BENCHMARKS, compare, load, run, table, to_json
+
+
+@click.command(help="Time the archive, releases and cache hot paths")
+@click.option(
+    "--only", multiple=True, type=click.Choice(sorted(BENCHMARKS)), help="Repeatable"
+)
+@click.option("--scale", default=1.0, show_default=True, help="Fixture size factor")
+@click.option("--repeat", default=3, show_default=True, help="Keep the best of n")
+@click.option(
+    "--fixtures",
+    type=click.Path(file_okay=False),
+    help="Keep generated fixtures here between runs",
+)
+@click.option("--save", type=click.Path(dir_okay=False), help="Write results json")
+@click.option(
+    "--compare",
+    "baseline",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Results json from an earlier --save",
+)
+@click.option(
+    "--threshold",
+    default=0.1,
+    show_default=True,
+    help="Exit 1 if any benchmark is this much slower than --compare",
+)
+def main(
+    only: Tuple[str, ...],
+    scale: float,
+    repeat: int,
+    fixtures: Optional[str],
+    save: Optional[str],
+    baseline: Optional[str],
+    threshold: float,
+) -> None:
+    names = list(only) or list(BENCHMARKS)
+    with tempfile.TemporaryDirectory() as d:
+        root = Path(fixtures or d)
+        click.echo(f"Generating fixtures in {root}", err=True)
+        generate(root, scale)
+        results = run(names, root, repeat)
+
+    click.echo(table(results))
+    if save:
+        with open(save, "w") as f:
+            json.dump(to_json(results), f, indent=2, sort_keys=True)
+    if baseline:
+        text, regressions = compare(load(baseline), results, threshold)
+        click.echo()
+        click.echo(text)
+        if regressions:
+            click.echo(f"Slower than baseline: {', '.join(regressions)}", err=True)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(prog_name="python -m honesty.benchmarks")
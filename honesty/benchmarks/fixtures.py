@@ -0,0 +1,168 @@
+"""
+Synthetic, deterministic inputs for the benchmarks.
+
+Everything is generated from a fixed seed, so two runs at the same scale see
+byte-identical fixtures and their timings are comparable.
+"""
+
+import io
+import json
+import random
+import tarfile
+import zipfile
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Tuple
+
+PACKAGE = "bench"
+# Bump when the fixtures change, so kept --fixtures dirs are regenerated.
+VERSION = 2
+WORDS = (
+    "def class return import self None True False for in if else while try "
+    "except with as yield lambda pass raise assert from global async await"
+).split()
+
+
+def _scaled(n: int, scale: float) -> int:
+    return max(1, int(n * scale))
+
+
+def _members(count: int, seed: int) -> Iterator[Tuple[str, bytes]]:
+    """
+    Yields (relative path, contents) of plausible-looking python source, a
+    couple of KB each, some with \\r\\n line endings.
+    """
+    rng = random.Random(seed)
+    for i in range(count):
+        lines = [
+            " ".join(rng.choice(WORDS) for j in range(rng.randint(4, 12)))
+            for k in range(rng.randint(20, 60))
+        ]
+        newline = "\r\n" if i % 10 == 0 else "\n"
+        path = f"{PACKAGE}/sub{i % 50}/mod{i}.py"
+        yield path, newline.join(lines).encode()
+
+
+def make_sdist(path: Path, count: int) -> None:
+    top = f"{PACKAGE}-1.0"
+    with tarfile.open(path, "w:gz") as tf:
+        for name, data in _members(count, seed=1):
+            info = tarfile.TarInfo(f"{top}/{name}")
+            info.size = len(data)
+            info.mtime = 1577836800
+            tf.addfile(info, io.BytesIO(data))
+
+
+def make_large_sdist(path: Path, megabytes: int) -> None:
+    """
+    Few, big members, where decompression rather than file creation is the
+    cost.  One block repeated, but further apart than gzip's window.
+    """
+    block = b"\n".join(data for name, data in _members(1000, seed=6))[: 2**20]
+    top = f"{PACKAGE}-large-1.0"
+    with tarfile.open(path, "w:gz", compresslevel=6) as tf:
+        for i in range(megabytes):
+            info = tarfile.TarInfo(f"{top}/{PACKAGE}/data{i}.py")
+            info.size = len(block)
+            info.mtime = 1577836800
+            tf.addfile(info, io.BytesIO(block))
+
+
+def make_wheel(path: Path, count: int) -> None:
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, data in _members(count, seed=2):
+            zf.writestr(name, data)
+
+
+def _fake_sha256(rng: random.Random) -> str:
+    return "%064x" % rng.getrandbits(256)
+
+
+def _release_files(version: str) -> List[str]:
+    return [
+        f"{PACKAGE}-{version}.tar.gz",
+        f"{PACKAGE}-{version}-py3-none-any.whl",
+        f"{PACKAGE}-{version}-cp38-cp38-manylinux1_x86_64.whl",
+        f"{PACKAGE}-{version}-cp38-cp38-win_amd64.whl",
+        f"{PACKAGE}-{version}-cp38-cp38-macosx_10_9_x86_64.whl",
+    ]
+
+
+def make_simple_index(path: Path, links: int) -> None:
+    rng = random.Random(3)
+    out = ["<!DOCTYPE html>\n<html><body><h1>Links for bench</h1>\n"]
+    i = 0
+    while i < links:
+        version = f"{i // 5}.0"
+        for basename in _release_files(version)[: links - i]:
+            out.append(
+                f'<a href="https://files.example.com/packages/{basename}'
+                f'#sha256={_fake_sha256(rng)}" data-requires-python="&gt;=3.6">'
+                f"{basename}</a><br/>\n"
+            )
+            i += 1
+    out.append("</body></html>\n")
+    path.write_text("".join(out))
+
+
+def make_json_index(path: Path, releases: int) -> None:
+    rng = random.Random(4)
+    obj: Dict[str, Any] = {"info": {"name": PACKAGE}, "releases": {}}
+    for r in range(releases):
+        version = f"{r}.0"
+        obj["releases"][version] = [
+            {
+                "filename": basename,
+                "url": f"https://files.example.com/packages/{basename}",
+                "digests": {"sha256": _fake_sha256(rng)},
+                "requires_python": ">=3.6",
+                "upload_time_iso_8601": "2020-01-01T00:00:00.123456Z",
+                "size": 12345,
+            }
+            for basename in _release_files(version)
+        ]
+    path.write_text(json.dumps(obj))
+
+
+def make_downloads(directory: Path, count: int, size: int) -> List[str]:
+    """
+    Incompressible files for measuring transfer and write throughput.  (Not
+    .tar.gz, which aiohttp's static handler would serve with Content-Encoding.)
+    """
+    rng = random.Random(5)
+    directory.mkdir(parents=True, exist_ok=True)
+    names = []
+    for i in range(count):
+        name = f"{PACKAGE}-{i}.0-py3-none-any.whl"
+        (directory / name).write_bytes(
+            rng.getrandbits(size * 8).to_bytes(size, "little")
+        )
+        names.append(name)
+    return names
+
+
+def generate(root: Path, scale: float = 1.0) -> None:
+    """
+    Populates root with the fixtures, laid out like a local mirror:
+
+        sdist/bench-1.0.tar.gz
+        sdist/bench-large-1.0.tar.gz
+        wheel/bench-1.0-py3-none-any.whl
+        simple/bench/index.html
+        pypi/bench/json
+        packages/bench-<n>.0-py3-none-any.whl
+
+    Skipped if root already has fixtures at this scale.
+    """
+    stamp = root / "scale"
+    if stamp.exists() and stamp.read_text() == f"{VERSION} {scale}":
+        return
+
+    for d in ("sdist", "wheel", "simple/bench", "pypi/bench"):
+        (root / d).mkdir(parents=True, exist_ok=True)
+    make_sdist(root / "sdist" / f"{PACKAGE}-1.0.tar.gz", _scaled(5000, scale))
+    make_large_sdist(root / "sdist" / f"{PACKAGE}-large-1.0.tar.gz", _scaled(64, scale))
+    make_wheel(root / "wheel" / f"{PACKAGE}-1.0-py3-none-any.whl", _scaled(5000, scale))
+    make_simple_index(root / "simple" / PACKAGE / "index.html", _scaled(50000, scale))
+    make_json_index(root / "pypi" / PACKAGE / "json", _scaled(2000, scale))
+    make_downloads(root / "packages", _scaled(100, scale), 256 * 1024)
+    stamp.write_text(f"{VERSION} {scale}")
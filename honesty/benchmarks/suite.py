@@ -0,0 +1,359 @@
+"""
+The benchmarks themselves, and running them each in a fresh process so that
+peak RSS is attributable to one benchmark.
+"""
+
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Tuple, TypeVar
+
+from aiohttp import web
+
+from ..archive import archive_hashes, extract_and_get_names
+from ..cache import Cache
+from ..decompress import PIPE_BUFFER_SIZE, Backend, available_backends
+from ..releases import LinkGatherer, async_parse_index
+from .fixtures import PACKAGE
+
+T = TypeVar("T")
+
+
+@dataclass
+class Sample:
+    seconds: float
+    items: int  # members, links, files...
+    nbytes: int  # of input
+
+
+@dataclass
+class Result:
+    name: str
+    seconds: float  # best of the repeats
+    items: int
+    nbytes: int
+    peak_rss_mb: Optional[float]
+
+    @property
+    def items_per_sec(self) -> float:
+        return self.items / self.seconds if self.seconds else 0.0
+
+    @property
+    def mb_per_sec(self) -> float:
+        return self.nbytes / self.seconds / 2**20 if self.seconds else 0.0
+
+
+Benchmark = Callable[[Path], Sample]
+BENCHMARKS: Dict[str, Benchmark] = {}
+
+
+def benchmark(name: str) -> Callable[[Benchmark], Benchmark]:
+    def inner(fn: Benchmark) -> Benchmark:
+        BENCHMARKS[name] = fn
+        return fn
+
+    return inner
+
+
+def _sdist(root: Path) -> Path:
+    return root / "sdist" / f"{PACKAGE}-1.0.tar.gz"
+
+
+def _large_sdist(root: Path) -> Path:
+    return root / "sdist" / f"{PACKAGE}-large-1.0.tar.gz"
+
+
+def _wheel(root: Path) -> Path:
+    return root / "wheel" / f"{PACKAGE}-1.0-py3-none-any.whl"
+
+
+def _cold_extract(fn: Callable[[], Any], warmup: bool = False) -> Tuple[float, Any]:
+    # An empty extraction cache and digest store, so every repeat does the
+    # work (after the warmup call, if any, which fills them).
+    with tempfile.TemporaryDirectory() as d:
+        os.environ["HONESTY_EXTDIR"] = d
+        os.environ["HONESTY_DIGESTS"] = os.path.join(d, "digests.sqlite3")
+        if warmup:
+            fn()
+        t0 = time.perf_counter()
+        rv = fn()
+        return time.perf_counter() - t0, rv
+
+
+@benchmark("archive_hashes_sdist")
+def bench_archive_hashes_sdist(root: Path) -> Sample:
+    path = _sdist(root)
+    seconds, hashes = _cold_extract(lambda: archive_hashes(path, True))
+    return Sample(seconds, len(hashes), path.stat().st_size)
+
+
+@benchmark("archive_hashes_sdist_large")
+def bench_archive_hashes_sdist_large(root: Path) -> Sample:
+    path = _large_sdist(root)
+    seconds, hashes = _cold_extract(lambda: archive_hashes(path, True))
+    return Sample(seconds, len(hashes), path.stat().st_size)
+
+
+@benchmark("archive_hashes_wheel")
+def bench_archive_hashes_wheel(root: Path) -> Sample:
+    path = _wheel(root)
+    seconds, hashes = _cold_extract(lambda: archive_hashes(path, False))
+    return Sample(seconds, len(hashes), path.stat().st_size)
+
+
+@benchmark("archive_hashes_warm")
+def bench_archive_hashes_wheel_warm(root: Path) -> Sample:
+    # Every member already in the digest store, as for the next release.
+    path = _wheel(root)
+    seconds, hashes = _cold_extract(lambda: archive_hashes(path, False), True)
+    return Sample(seconds, len(hashes), path.stat().st_size)
+
+
+@benchmark("extract_sdist")
+def bench_extract_sdist(root: Path) -> Sample:
+    path = _sdist(root)
+    seconds, (_, names) = _cold_extract(
+        lambda: extract_and_get_names(path, True, ("*",))
+    )
+    return Sample(seconds, len(names), path.stat().st_size)
+
+
+@benchmark("extract_sdist_large")
+def bench_extract_sdist_large(root: Path) -> Sample:
+    path = _large_sdist(root)
+    seconds, (_, names) = _cold_extract(
+        lambda: extract_and_get_names(path, True, ("*",))
+    )
+    return Sample(seconds, len(names), path.stat().st_size)
+
+
+def _decompress(backend: Backend) -> Benchmark:
+    def bench(root: Path) -> Sample:
+        path = _large_sdist(root)
+        t0 = time.perf_counter()
+        chunks = 0
+        with backend.open(path) as f:
+            while f.read(PIPE_BUFFER_SIZE):
+                chunks += 1
+        return Sample(time.perf_counter() - t0, chunks, path.stat().st_size)
+
+    return bench
+
+
+# One per installed backend, to see what HONESTY_DECOMPRESS would buy.
+for _backend in available_backends(Path("x.tar.gz")):
+    benchmark(f"decompress_{_backend.name}")(_decompress(_backend))
+
+
+@benchmark("extract_wheel")
+def bench_extract_wheel(root: Path) -> Sample:
+    path = _wheel(root)
+    seconds, (_, names) = _cold_extract(
+        lambda: extract_and_get_names(path, False, ("*",))
+    )
+    return Sample(seconds, len(names), path.stat().st_size)
+
+
+@benchmark("link_gatherer")
+def bench_link_gatherer(root: Path) -> Sample:
+    text = (root / "simple" / PACKAGE / "index.html").read_text()
+    t0 = time.perf_counter()
+    gatherer = LinkGatherer()
+    gatherer.feed(text)
+    return Sample(time.perf_counter() - t0, len(gatherer.entries), len(text))
+
+
+def _parse_index(root: Path, use_json: bool) -> Sample:
+    async def inner(cache_dir: str) -> Sample:
+        # A local mirror, so this is reading and parsing only.
+        async with Cache(cache_dir=cache_dir, index_url=str(root / "simple")) as cache:
+            t0 = time.perf_counter()
+            package = await async_parse_index(PACKAGE, cache, use_json=use_json)
+            seconds = time.perf_counter() - t0
+        files = sum(len(r.files) for r in package.releases.values())
+        name = (
+            ("pypi", PACKAGE, "json") if use_json else ("simple", PACKAGE, "index.html")
+        )
+        return Sample(seconds, files, root.joinpath(*name).stat().st_size)
+
+    with tempfile.TemporaryDirectory() as d:
+        return _run(inner(d))
+
+
+@benchmark("parse_index_html")
+def bench_parse_index_html(root: Path) -> Sample:
+    return _parse_index(root, use_json=False)
+
+
+@benchmark("parse_index_json")
+def bench_parse_index_json(root: Path) -> Sample:
+    return _parse_index(root, use_json=True)
+
+
+async def _serve(root: Path) -> Tuple[web.AppRunner, str]:
+    """
+    Serves the fixtures like a (very fast) index and file host.
+    """
+
+    async def simple(request: web.Request) -> web.FileResponse:
+        pkg = request.match_info["pkg"]
+        return web.FileResponse(root / "simple" / pkg / "index.html")
+
+    app = web.Application()
+    app.router.add_get("/simple/{pkg}/", simple)
+    app.router.add_static("/packages/", root / "packages")
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+@benchmark("cache_fetch")
+def bench_cache_fetch(root: Path) -> Sample:
+    names = sorted(p.name for p in (root / "packages").iterdir())
+    nbytes = sum((root / "packages" / n).stat().st_size for n in names)
+
+    async def inner(cache_dir: str) -> Sample:
+        runner, base = await _serve(root)
+        try:
+            async with Cache(cache_dir=cache_dir, index_url=f"{base}/simple/") as cache:
+                t0 = time.perf_counter()
+                await asyncio.gather(
+                    *[cache.async_fetch(PACKAGE, f"{base}/packages/{n}") for n in names]
+                )
+                seconds = time.perf_counter() - t0
+        finally:
+            await runner.cleanup()
+        return Sample(seconds, len(names), nbytes)
+
+    with tempfile.TemporaryDirectory() as d:
+        return _run(inner(d))
+
+
+@benchmark("cache_fetch_index")
+def bench_cache_fetch_index(root: Path) -> Sample:
+    async def inner(cache_dir: str) -> Sample:
+        runner, base = await _serve(root)
+        try:
+            async with Cache(cache_dir=cache_dir, index_url=f"{base}/simple/") as cache:
+                t0 = time.perf_counter()
+                path = await cache.async_fetch(PACKAGE, None)
+                seconds = time.perf_counter() - t0
+        finally:
+            await runner.cleanup()
+        return Sample(seconds, 1, path.stat().st_size)
+
+    with tempfile.TemporaryDirectory() as d:
+        return _run(inner(d))
+
+
+def _run(coro: Coroutine[Any, Any, T]) -> T:
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def _peak_rss_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:  # pragma: no cover
+        return None  # windows
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on mac
+    return rss / 2**20 if sys.platform == "darwin" else rss / 2**10
+
+
+def run_one(name: str, root: str, repeat: int) -> Result:
+    """
+    Runs benchmark `name` `repeat` times (in this process), keeping the
+    fastest.
+    """
+    fn = BENCHMARKS[name]
+    samples = [fn(Path(root)) for i in range(repeat)]
+    best = min(samples, key=lambda s: s.seconds)
+    return Result(name, best.seconds, best.items, best.nbytes, _peak_rss_mb())
+
+
+def run(names: List[str], root: Path, repeat: int) -> List[Result]:
+    """
+    Runs each benchmark in its own fresh process.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    for name in names:
+        with ctx.Pool(1) as pool:
+            results.append(pool.apply(run_one, (name, str(root), repeat)))
+    return results
+
+
+def to_json(results: List[Result]) -> Dict[str, Any]:
+    return {
+        "python": sys.version.split()[0],
+        "platform": sys.platform,
+        "results": {
+            r.name: dict(
+                asdict(r), items_per_sec=r.items_per_sec, mb_per_sec=r.mb_per_sec
+            )
+            for r in results
+        },
+    }
+
+
+def table(results: List[Result]) -> str:
+    lines = [
+        f"{'benchmark':<22} {'seconds':>9} {'items/s':>12} {'MB/s':>9} {'peak MB':>8}"
+    ]
+    for r in results:
+        rss = f"{r.peak_rss_mb:.1f}" if r.peak_rss_mb is not None else "-"
+        lines.append(
+            f"{r.name:<22} {r.seconds:>9.4f} {r.items_per_sec:>12.0f} "
+            f"{r.mb_per_sec:>9.1f} {rss:>8}"
+        )
+    return "\n".join(lines)
+
+
+def compare(
+    baseline: Dict[str, Any], results: List[Result], threshold: float
+) -> Tuple[str, List[str]]:
+    """
+    Returns a table of changes against a previous `to_json`, and the names of
+    benchmarks that got slower by more than `threshold` (0.1 is 10%).
+    """
+    old = baseline["results"]
+    lines = [f"{'benchmark':<22} {'before':>9} {'after':>9} {'change':>8} {'rss':>8}"]
+    regressions = []
+    for r in results:
+        if r.name not in old:
+            lines.append(f"{r.name:<22} {'-':>9} {r.seconds:>9.4f}")
+            continue
+        before = old[r.name]["seconds"]
+        change = (r.seconds - before) / before if before else 0.0
+        rss = "-"
+        if r.peak_rss_mb is not None and old[r.name].get("peak_rss_mb"):
+            rss = f"{r.peak_rss_mb - old[r.name]['peak_rss_mb']:+.1f}"
+        flag = ""
+        if change > threshold:
+            regressions.append(r.name)
+            flag = " !"
+        lines.append(
+            f"{r.name:<22} {before:>9.4f} {r.seconds:>9.4f} {change:>+8.1%} "
+            f"{rss:>8}{flag}"
+        )
+    return "\n".join(lines), regressions
+
+
+def load(path: str) -> Dict[str, Any]:
+    with open(path) as f:
+        obj: Dict[str, Any] = json.load(f)
+    return obj
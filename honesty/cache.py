@@ -3,68 +3,447 @@ Cache-related stuff.
 """
 
 import asyncio
+import functools
+import gzip
+import hashlib
+import itertools
 import os
 import posixpath
+import re
+import threading
+import time
 import urllib.parse
+import urllib.request
+import zlib
+from concurrent.futures import Executor, ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Optional
+from typing import (
+    IO,
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
 import aiohttp
 
+from .instrument import count, timed
+from .mirrors import Mirror, alternatives, find
+from .retry import RETRY_STATUSES, AdaptiveLimiter, RetryPolicy, parse_retry_after
+
+
+def canonical_name(pkg: str) -> str:
+    """
+    The PEP 503 normalized name, so "Django", "django" and "DJANGO" (or
+    "zope.interface" and "Zope_Interface") share one cache entry and url.
+    """
+    return CANONICAL_RE.sub("-", pkg).lower()
+
 
 def cache_dir(pkg: str) -> Path:
+    pkg = canonical_name(pkg)
     a = pkg[:2]
     b = pkg[2:4] or "--"
     return Path(a, b, pkg)
 
 
+CANONICAL_RE = re.compile(r"[-_.]+")
+# Bump (and teach _migrate_layout) when the cache_dir layout changes; 2 is
+# canonical names.
+LAYOUT_VERSION = 2
 DEFAULT_CACHE_DIR = "~/.cache/honesty/pypi"
 DEFAULT_HONESTY_INDEX_URL = "https://pypi.org/simple/"
-BUFFER_SIZE = 4096 * 1024  # 4M
+BUFFER_SIZE = 4096 * 1024  # 4M, per file write
+IO_THREADS = 8
+DEFAULT_NEGATIVE_TTL = 3600.0  # seconds
+DEFAULT_HEDGE_DELAY = 1.0  # seconds
+MISSING_STATUSES = frozenset({404, 410})
+# How index documents may be stored, by suffix; "" is uncompressed.
+INDEX_COMPRESSIONS = {"": "", "gzip": ".gz", "zstd": ".zst"}
+# What we can undo ourselves when the session doesn't (see _Decoder).
+ACCEPT_ENCODING = "gzip, deflate"
+# PyPI (and bandersnatch) also put the serial at the end of simple pages.
+SERIAL_RE = re.compile(rb"<!--SERIAL (\d+)-->")
+
+
+class NotFound(Exception):
+    """
+    The package or file doesn't exist (or didn't, recently enough to still be
+    remembered by the negative cache).
+    """
+
+    def __init__(self, url: str, status: int) -> None:
+        super().__init__(f"{status} {url}")
+        self.url = url
+        self.status = status
+
+
+class ChecksumMismatch(Exception):
+    """
+    A download's digest isn't the one the index listed.
+    """
+
+    def __init__(self, url: str, expected: str, actual: str) -> None:
+        super().__init__(f"{url} has {actual}, expected {expected}")
+        self.url = url
+        self.expected = expected
+        self.actual = actual
+
+
+def _local_dir_to_url(url: str) -> str:
+    """
+    Allows a mirror to be specified as a plain directory (say, the web/simple
+    of a bandersnatch mirror) instead of a file: url.
+    """
+    if "://" not in url and not url.startswith("file:"):
+        return Path(url).expanduser().resolve().as_uri() + "/"
+    return url
+
+
+def _local_path(url: str) -> Path:
+    path = urllib.parse.urlparse(url).path
+    local_path = Path(urllib.request.url2pathname(path))
+    if path.endswith("/"):
+        local_path /= "index.html"
+    return local_path
+
+
+def _url_list(urls: Union[str, Sequence[str]]) -> List[str]:
+    if isinstance(urls, str):
+        urls = urls.split()
+    rv = []
+    for url in urls:
+        url = _local_dir_to_url(url)
+        if not url.endswith("/"):
+            # in a browser, this would be a redirect; we don't know that here.
+            url += "/"
+        rv.append(url)
+    return rv
+
+
+T = TypeVar("T")
+
+
+def _zstandard() -> Any:
+    try:
+        import zstandard
+    except ImportError:  # pragma: no cover
+        raise ValueError("zstd index compression needs 'pip install zstandard'")
+    return zstandard
+
+
+def _compressing_writer(f: IO[bytes], compression: str) -> IO[bytes]:
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=f, mode="wb")  # type: ignore
+    elif compression == "zstd":
+        return _zstandard().ZstdCompressor().stream_writer(f)  # type: ignore
+    raise ValueError(f"Unknown index compression {compression!r}")
+
+
+class _Decoder:
+    """
+    Undoes a gzip or deflate Content-Encoding, for sessions made with
+    auto_decompress=False.
+    """
+
+    def __init__(self, encoding: str) -> None:
+        self._obj: Any = None
+        if encoding in ("gzip", "x-gzip"):
+            self._obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding != "deflate":
+            # Not transient, unlike a bad body.
+            raise ValueError(f"Can't decode Content-Encoding {encoding!r}")
+
+    def decompress(self, chunk: bytes) -> bytes:
+        if self._obj is None:
+            if not chunk:
+                return b""
+            # deflate is meant to be zlib-wrapped, but some servers send it raw.
+            raw = chunk[0] & 0x0F != 8
+            self._obj = zlib.decompressobj(-zlib.MAX_WBITS if raw else zlib.MAX_WBITS)
+        try:
+            return self._obj.decompress(chunk)  # type: ignore
+        except zlib.error as e:
+            raise aiohttp.ClientPayloadError(f"Bad encoded body: {e}")
+
+    def flush(self) -> bytes:
+        if self._obj is None:
+            return b""
+        try:
+            data: bytes = self._obj.flush()
+        except zlib.error as e:
+            raise aiohttp.ClientPayloadError(f"Bad encoded body: {e}")
+        if not self._obj.eof:
+            raise aiohttp.ClientPayloadError("Truncated encoded body")
+        return data
+
+    async def decode(self, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        async for chunk in chunks:
+            yield self.decompress(chunk)
+        yield self.flush()
+
+
+def read_cached(path: Path) -> bytes:
+    """
+    Returns the (decompressed) contents of a path returned by async_fetch,
+    which for index documents may be stored compressed.
+    """
+    # Only index documents are compressed by us; foo.tar.gz is left alone.
+    if path.name in ("index.html.gz", "json.gz"):
+        with gzip.open(path, "rb") as f:
+            return f.read()
+    elif path.name in ("index.html.zst", "json.zst"):
+        with open(path, "rb") as f:
+            return _zstandard().ZstdDecompressor().stream_reader(f).read()  # type: ignore
+    return path.read_bytes()
+
+
+class _BufferedWriter:
+    """
+    Writes a download to disk without blocking the event loop: chunks are
+    collected until there's BUFFER_SIZE of them, then written by `run` (which
+    runs a function in the io executor) while more arrive.  At most one write
+    is in flight, so at most about twice BUFFER_SIZE is held per download.
+    """
+
+    def __init__(self, f: IO[bytes], run: Callable[..., Any]) -> None:
+        self.f = f
+        self.run = run
+        self.chunks: List[bytes] = []
+        self.buffered = 0
+        self.pending: Optional["asyncio.Future[Any]"] = None
+
+    async def write(self, chunk: bytes) -> None:
+        self.chunks.append(chunk)
+        self.buffered += len(chunk)
+        if self.buffered >= BUFFER_SIZE:
+            await self._wait()
+            self.pending = asyncio.ensure_future(self.run(self.f.write, self._take()))
+
+    async def drain(self) -> bytes:
+        """
+        Waits for the in-flight write, and returns what's still buffered (for
+        the caller to write along with closing the file).
+        """
+        await self._wait()
+        return self._take()
+
+    async def _wait(self) -> None:
+        if self.pending is not None:
+            pending, self.pending = self.pending, None
+            await pending
+
+    def _take(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        self.buffered = 0
+        return data
+
+
+class _Racer(NamedTuple):
+    """
+    One mirror's attempt in Cache._race, with files of its own.
+    """
+
+    url: str
+    output_file: Path
+    serial_file: Optional[Path]
+    started: float  # loop.time()
+
+
+@dataclass
+class ConnectionOptions:
+    """
+    Settings for the connection pool shared by every fetch through a Cache.
+    """
+
+    limit: int = 100  # total open connections
+    limit_per_host: int = 0  # 0 is unlimited
+    keepalive_timeout: float = 60.0
+    dns_cache_ttl: Optional[int] = 300  # None caches forever
+    auto_decompress: bool = True
 
 
 class Cache:
     def __init__(
         self,
         cache_dir: Optional[str] = None,
-        index_url: Optional[str] = None,
-        json_index_url: Optional[str] = None,
+        index_url: Union[str, Sequence[str], None] = None,
+        json_index_url: Union[str, Sequence[str], None] = None,
         fresh_index: bool = False,
+        retry: Optional[RetryPolicy] = None,
+        limiter: Optional[AdaptiveLimiter] = None,
+        connection_options: Optional[ConnectionOptions] = None,
+        negative_ttl: Optional[float] = None,
+        compress_index: Optional[str] = None,
+        io_executor: Optional[Executor] = None,
+        hedge_delay: Optional[float] = None,
     ) -> None:
         if not cache_dir:
             cache_dir = os.environ.get("HONESTY_CACHE", DEFAULT_CACHE_DIR)
         assert isinstance(cache_dir, str), cache_dir
         self.cache_path = Path(cache_dir).expanduser()
 
+        # Whitespace-separated, so that HONESTY_INDEX_URL can list mirrors too.
         if not index_url:
             index_url = os.environ.get("HONESTY_INDEX_URL", DEFAULT_HONESTY_INDEX_URL)
-        assert isinstance(index_url, str), index_url
-        if not index_url.endswith("/"):
-            # in a browser, this would be a redirect; we don't know that here.
-            index_url += "/"
-        self.index_url = index_url
+        index_urls = _url_list(index_url)
+        if not index_urls:
+            raise ValueError("No index url")
 
         if not json_index_url:
-            json_index_url = os.environ.get("HONESTY_JSON_INDEX_URL", self.index_url)
-        assert isinstance(json_index_url, str), json_index_url
-        if not json_index_url.endswith("/"):
-            index_url += "/"
-        self.json_index_url = index_url
+            json_index_url = os.environ.get("HONESTY_JSON_INDEX_URL")
+        json_index_urls = _url_list(json_index_url) if json_index_url else index_urls
+        if len(json_index_urls) != len(index_urls):
+            raise ValueError("Expected one json index url per index url")
+
+        # In order of preference before any have been tried; the first is the
+        # one whose urls are returned by json_url and async_parse_index.
+        self.mirrors = [
+            Mirror.from_urls(i, j) for i, j in zip(index_urls, json_index_urls)
+        ]
+        self.index_url = self.mirrors[0].index_url
+        self.json_index_url = self.mirrors[0].json_index_url
+        # Seconds to wait for a mirror to start responding before also asking
+        # the next one.
+        if hedge_delay is None:
+            hedge_delay = float(
+                os.environ.get("HONESTY_HEDGE_DELAY", DEFAULT_HEDGE_DELAY)
+            )
+        self.hedge_delay = hedge_delay
 
         self.fresh_index = fresh_index
-        self.session = aiohttp.ClientSession(trust_env=True, raise_for_status=True)
+        # How long to remember that a package or file didn't exist; 0 disables.
+        if negative_ttl is None:
+            negative_ttl = float(
+                os.environ.get("HONESTY_NEGATIVE_TTL", DEFAULT_NEGATIVE_TTL)
+            )
+        self.negative_ttl = negative_ttl
+        # "gzip" or "zstd" to store newly fetched index documents compressed
+        if compress_index is None:
+            compress_index = os.environ.get("HONESTY_COMPRESS_INDEX", "")
+        if compress_index not in INDEX_COMPRESSIONS:
+            raise ValueError(f"Unknown index compression {compress_index!r}")
+        if compress_index == "zstd":
+            _zstandard()
+        self.compress_index = compress_index
+        self.retry = retry or RetryPolicy.from_env()
+        self.limiter = limiter or AdaptiveLimiter()
+        self.connection_options = connection_options or ConnectionOptions()
+        # The synchronous wrappers all run on this loop, so that the session
+        # (and its keepalive connections) can be reused between calls.
+        self.loop = asyncio.get_event_loop()
+        self._session: Optional[aiohttp.ClientSession] = None
+        # Disk writes and metadata calls run here rather than on the loop, so
+        # a slow filesystem doesn't stall every transfer.  Separate from the
+        # default executor, which hashing may keep busy.
+        self._io_executor = io_executor
+        self._own_io_executor = io_executor is None
+        self._layout_lock = threading.Lock()
+        self._inflight: Dict[Path, "asyncio.Future[Path]"] = {}
+        self._layout_checked = False
 
-    def fetch(self, pkg: str, url: Optional[str]) -> Path:
+    @property
+    def io_executor(self) -> Executor:
+        # Created on first use (and again after close) when not given.
+        if self._io_executor is None:
+            self._io_executor = ThreadPoolExecutor(
+                IO_THREADS, thread_name_prefix="honesty-io"
+            )
+        return self._io_executor
+
+    async def run_io(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """
+        Calls fn in io_executor, for blocking filesystem or database work that
+        would otherwise stall the event loop.
+        """
         loop = asyncio.get_event_loop()
-        return loop.run_until_complete(self.async_fetch(pkg, url))
+        return await loop.run_in_executor(
+            self.io_executor, functools.partial(fn, *args, **kwargs)
+        )
 
-    async def async_fetch(self, pkg: str, url: Optional[str]) -> Path:
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """
+        Created on first use, inside the loop that will use it: the running
+        one, or else self.loop for the synchronous wrappers.
+        """
+        if self._session is None:
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                self._session = self.loop.run_until_complete(self._async_new_session())
+            else:
+                # Maybe not self.loop, say when a server started its own.
+                self._session = self._new_session()
+        return self._session
+
+    async def _async_new_session(self) -> aiohttp.ClientSession:
+        return self._new_session()
+
+    def _new_session(self) -> aiohttp.ClientSession:
+        opts = self.connection_options
+        connector = aiohttp.TCPConnector(
+            limit=opts.limit,
+            limit_per_host=opts.limit_per_host,
+            keepalive_timeout=opts.keepalive_timeout,
+            ttl_dns_cache=opts.dns_cache_ttl,
+        )
+        return aiohttp.ClientSession(
+            connector=connector,
+            trust_env=True,
+            raise_for_status=True,
+            auto_decompress=opts.auto_decompress,
+        )
+
+    def fetch(self, pkg: str, url: Optional[str]) -> Path:
+        return self.loop.run_until_complete(self.async_fetch(pkg, url))
+
+    def json_url(self, pkg: str) -> str:
+        # The canonical name avoids a redirect.
+        return urllib.parse.urljoin(
+            self.json_index_url, f"../pypi/{canonical_name(pkg)}/json"
+        )
+
+    async def async_fetch(
+        self,
+        pkg: str,
+        url: Optional[str],
+        fresh: bool = False,
+        checksum: Optional[str] = None,
+    ) -> Path:
         """
         When url=None, download the index.
         Otherwise, download (presumably) an archive.  url may be relative, and
         is presumably relative to the package index page.
 
         When self.fresh_index, never trust the cache for index (but still save).
+        When fresh, never trust the cache for this url.
+
+        For index documents, the X-PyPI-Last-Serial response header is kept
+        for index_serial.
+
+        A 404 or 410 raises NotFound, and is remembered for self.negative_ttl
+        seconds (except by fresh index fetches) so it isn't requested again.
+
+        file: urls (say, index_url pointing at a local bandersnatch's
+        web/simple/) are never copied; the Path of the original is returned.
+
+        With several self.mirrors, a url on one of them may be fetched from
+        any (see _race).  A checksum like "sha256=<hex>" is verified on
+        download, and one that doesn't match raises ChecksumMismatch.
+
+        With self.compress_index, index documents are saved with a .gz or .zst
+        suffix; use read_cached to get their contents.
 
         Returns a Path for where the cache wanted to save it.  We make effort to
         be concurrent-safe (last one wins).
@@ -75,7 +454,7 @@ class Cache:
         if "&" in pkg or "#" in pkg:
             raise NotImplementedError("parse_index does not handle entities yet")
 
-        pkg_url = urllib.parse.urljoin(self.index_url, f"{pkg}/")
+        pkg_url = urllib.parse.urljoin(self.index_url, f"{canonical_name(pkg)}/")
         if url is None:
             url = pkg_url
         else:
@@ -85,38 +464,549 @@ class Cache:
 
         filename = posixpath.basename(url)
 
-        output_dir = self.cache_path / cache_dir(pkg)
-        output_dir.mkdir(parents=True, exist_ok=True)
+        urls = alternatives(url, self.mirrors)
+        # A local mirror is free to read, whatever its ranking.
+        for u in urls:
+            if u.startswith("file:"):
+                local_path = _local_path(u)
+                if await self.run_io(local_path.exists):
+                    count("cache_hit", pkg, local_path.name)
+                    return local_path
+        urls = [u for u in urls if not u.startswith("file:")]
+        if not urls:
+            raise NotFound(url, 404)
+
+        base_file = self.cache_path / cache_dir(pkg) / (filename or "index.html")
+        missing_file = base_file.with_name(base_file.name + ".missing")
+
+        is_index = self._is_index_filename(filename)
+        fresh = fresh or (self.fresh_index and is_index)
+        existing, missing_status = await self.run_io(
+            self._lookup, base_file, is_index, fresh
+        )
+        if existing is not None:
+            count("cache_hit", pkg, existing.name)
+            return existing
+        if missing_status is not None:
+            count("cache_hit", pkg, missing_file.name)
+            raise NotFound(url, missing_status)
+
+        # Concurrent fetches of the same thing (say Django and django in one
+        # batch) share one download.
+        inflight = self._inflight.get(base_file)
+        if inflight is None:
+            inflight = asyncio.ensure_future(
+                self._fetch_missing(
+                    pkg, urls, base_file, is_index, None if is_index else checksum
+                )
+            )
+            self._inflight[base_file] = inflight
+            inflight.add_done_callback(lambda _: self._inflight.pop(base_file, None))
+        return await asyncio.shield(inflight)
+
+    async def _fetch_missing(
+        self,
+        pkg: str,
+        urls: List[str],
+        base_file: Path,
+        is_index: bool,
+        checksum: Optional[str],
+    ) -> Path:
+        serial_file = base_file.with_name(base_file.name + ".serial")
+        compression = self.compress_index if is_index else ""
+        output_file = base_file.with_name(
+            base_file.name + INDEX_COMPRESSIONS[compression]
+        )
+
+        count("cache_miss", pkg, output_file.name)
+        phase = "index_fetch" if is_index else "download"
+        try:
+            with timed(phase, pkg, output_file.name) as event:
+                event.nbytes = await self._download(
+                    urls,
+                    output_file,
+                    compression,
+                    serial_file if is_index else None,
+                    checksum,
+                )
+        except aiohttp.ClientResponseError as e:
+            if e.status not in MISSING_STATUSES:
+                raise
+            await self.run_io(self._record_missing, base_file, is_index, e.status)
+            raise NotFound(urls[0], e.status) from e
+
+        await self.run_io(self._record_found, base_file, is_index, output_file)
+        return output_file
+
+    # The following are blocking, and are run in self.io_executor.
+
+    def _lookup(
+        self, base_file: Path, is_index: bool, fresh: bool
+    ) -> Tuple[Optional[Path], Optional[int]]:
+        """
+        Returns (cached path, None), or (None, status) if the url is
+        remembered as missing, or (None, None) if it needs fetching.
+        """
+        self._ensure_layout()
+        base_file.parent.mkdir(parents=True, exist_ok=True)
+        if fresh:
+            return None, None
+        existing = self._cached_variant(base_file, is_index)
+        if existing is not None:
+            return existing, None
+        missing_file = base_file.with_name(base_file.name + ".missing")
+        if self._recently_missing(missing_file):
+            return None, int(missing_file.read_text() or 404)
+        return None, None
+
+    def _record_missing(self, base_file: Path, is_index: bool, status: int) -> None:
+        if self.negative_ttl:
+            base_file.with_name(base_file.name + ".missing").write_text(str(status))
+        # Whatever we had is gone upstream now.
+        self._remove_variants(base_file, is_index)
+
+    def _record_found(self, base_file: Path, is_index: bool, output_file: Path) -> None:
+        missing_file = base_file.with_name(base_file.name + ".missing")
+        if missing_file.exists():
+            missing_file.unlink()
+        if is_index:
+            # Don't let a copy stored under another compression setting shadow
+            # this one.
+            self._remove_variants(base_file, is_index, keep=output_file)
+
+    def _cached_variant(self, output_file: Path, is_index: bool) -> Optional[Path]:
+        # Index documents stored under any compression setting are hits.
+        suffixes = INDEX_COMPRESSIONS.values() if is_index else ("",)
+        for suffix in suffixes:
+            existing = output_file.with_name(output_file.name + suffix)
+            if existing.exists():
+                return existing
+        return None
+
+    def _remove_variants(
+        self, base_file: Path, is_index: bool, keep: Optional[Path] = None
+    ) -> None:
+        suffixes = INDEX_COMPRESSIONS.values() if is_index else ("",)
+        for suffix in suffixes:
+            variant = base_file.with_name(base_file.name + suffix)
+            if variant != keep and variant.exists():
+                variant.unlink()
+
+    def _ensure_layout(self) -> None:
+        with self._layout_lock:
+            if not self._layout_checked:
+                self._migrate_layout()
+                self._layout_checked = True
+
+    def _migrate_layout(self) -> None:
+        """
+        Moves entries from directories named by the raw package name (before
+        LAYOUT_VERSION 2) into the canonical one.  Where both have a file, the
+        canonical one's is kept.  Safe to race with other processes doing the
+        same.
+        """
+        marker = self.cache_path / "layout"
+        try:
+            if int(marker.read_text()) >= LAYOUT_VERSION:
+                return
+        except (OSError, ValueError):
+            pass
+
+        for pkg_dir in self.cache_path.glob("*/*/*"):
+            if not pkg_dir.is_dir() or canonical_name(pkg_dir.name) == pkg_dir.name:
+                continue
+            target = self.cache_path / cache_dir(pkg_dir.name)
+            target.mkdir(parents=True, exist_ok=True)
+            if os.path.samefile(target, pkg_dir):
+                continue  # a case-insensitive filesystem
+            for f in pkg_dir.iterdir():
+                try:
+                    if (target / f.name).exists():
+                        f.unlink()
+                    else:
+                        os.replace(f, target / f.name)
+                except FileNotFoundError:
+                    pass  # someone else got there first
+            for d in (pkg_dir, pkg_dir.parent, pkg_dir.parent.parent):
+                try:
+                    d.rmdir()
+                except OSError:
+                    break  # not empty (or gone)
+
+        self.cache_path.mkdir(parents=True, exist_ok=True)
+        marker.write_text(str(LAYOUT_VERSION))
+
+    def _index_file(self, pkg: str, use_json: bool) -> Path:
+        return self.cache_path / cache_dir(pkg) / ("json" if use_json else "index.html")
+
+    def is_index_cached(self, pkg: str, use_json: bool = False) -> bool:
+        self._ensure_layout()
+        index_file = self._index_file(pkg, use_json)
+        return self._cached_variant(index_file, True) is not None
+
+    def index_serial(self, pkg: str, use_json: bool = False) -> Optional[int]:
+        """
+        The serial PyPI reported when the cached index document was fetched,
+        or None if it isn't cached or didn't say.
+        """
+        self._ensure_layout()
+        index_file = self._index_file(pkg, use_json)
+        try:
+            return int(index_file.with_name(index_file.name + ".serial").read_text())
+        except (OSError, ValueError):
+            pass
+        existing = self._cached_variant(index_file, True)
+        if existing is not None and not use_json:
+            m = SERIAL_RE.search(read_cached(existing))
+            if m:
+                return int(m.group(1))
+        return None
+
+    def _recently_missing(self, missing_file: Path) -> bool:
+        if not self.negative_ttl:
+            return False
+        try:
+            age = time.time() - missing_file.stat().st_mtime
+        except OSError:
+            return False
+        return age < self.negative_ttl
 
-        output_file = output_dir / (filename or "index.html")
+    async def _download(
+        self,
+        urls: List[str],
+        output_file: Path,
+        compression: str = "",
+        serial_file: Optional[Path] = None,
+        checksum: Optional[str] = None,
+    ) -> int:
+        """
+        Downloads the same file from one of urls (best first) to output_file,
+        compressed with `compression`, if any.  Returns the number of bytes
+        received.
+
+        When serial_file is given, the X-PyPI-Last-Serial header is saved
+        there (or it's removed, if there was none).
+        """
+        if len(urls) == 1:
+            return await self._download_from(
+                urls[0], output_file, compression, serial_file, checksum
+            )
+        return await self._race(urls, output_file, compression, serial_file, checksum)
+
+    async def _race(
+        self,
+        urls: List[str],
+        output_file: Path,
+        compression: str,
+        serial_file: Optional[Path],
+        checksum: Optional[str],
+    ) -> int:
+        """
+        Hedged requests: starts on urls[0], and adds the next url whenever
+        the latest one hasn't started responding within self.hedge_delay, or
+        one fails.  The first complete (and checksum-valid) download wins, and
+        the rest are cancelled.
+
+        When all fail, raises a 404 or 410 only if every mirror said so, and
+        otherwise the first other error.
+        """
+        loop = asyncio.get_event_loop()
+        hedge = asyncio.Event()
+        remaining = list(urls)
+        racers: Dict["asyncio.Future[int]", _Racer] = {}
+        pending: Set["asyncio.Future[int]"] = set()
+        errors: List[BaseException] = []
+
+        def start() -> None:
+            url = remaining.pop(0)
+            suffix = f".{os.getpid()}-{len(racers)}"
+            out = output_file.with_name(output_file.name + suffix)
+            serial = serial_file and serial_file.with_name(serial_file.name + suffix)
+            task = asyncio.ensure_future(
+                self._download_from(
+                    url, out, compression, serial, checksum, on_slow=hedge.set
+                )
+            )
+            racers[task] = _Racer(url, out, serial, loop.time())
+            pending.add(task)
+            hedge.clear()
+
+        winner: Optional["asyncio.Future[int]"] = None
+        start()
+        try:
+            while pending and winner is None:
+                waiting: Set["asyncio.Future[Any]"] = set(pending)
+                # Once every url has started, there's nothing to hedge onto.
+                waiter: Optional["asyncio.Future[Any]"] = None
+                if remaining:
+                    waiter = asyncio.ensure_future(hedge.wait())
+                    waiting.add(waiter)
+                done, _ = await asyncio.wait(
+                    waiting, return_when=asyncio.FIRST_COMPLETED
+                )
+                if waiter is not None:
+                    waiter.cancel()
+                failed = False
+                for task in done & pending:
+                    pending.discard(task)
+                    exc = task.exception()
+                    if exc is None:
+                        winner = winner or task
+                    else:
+                        errors.append(exc)
+                        failed = True
+                slow = hedge.is_set()
+                hedge.clear()
+                if winner is None and remaining and (failed or slow):
+                    start()
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            # Losers took at least this long.
+            now = loop.time()
+            for task in pending if winner is not None else ():
+                found = find(racers[task].url, self.mirrors)
+                if found is not None:
+                    found[0].record_failure(now - racers[task].started)
+            # Only the winner's files are kept (though a loser may have
+            # finished too).
+            leftovers: List[Path] = []
+            for task, racer in racers.items():
+                if task is not winner:
+                    leftovers.append(racer.output_file)
+                    if racer.serial_file is not None:
+                        leftovers.append(racer.serial_file)
+            await self.run_io(self._discard, leftovers)
 
-        if not output_file.exists() or (
-            self.fresh_index and self._is_index_filename(filename)
-        ):
+        if winner is None:
+            missing = [
+                e
+                for e in errors
+                if isinstance(e, aiohttp.ClientResponseError)
+                and e.status in MISSING_STATUSES
+            ]
+            if len(missing) == len(urls):
+                raise missing[0]
+            raise next(e for e in errors if e not in missing)
+
+        racer = racers[winner]
+        await self.run_io(
+            self._promote,
+            racer.output_file,
+            output_file,
+            racer.serial_file,
+            serial_file,
+        )
+        return winner.result()
+
+    async def _download_from(
+        self,
+        url: str,
+        output_file: Path,
+        compression: str = "",
+        serial_file: Optional[Path] = None,
+        checksum: Optional[str] = None,
+        on_slow: Optional[Callable[[], Any]] = None,
+    ) -> int:
+        """
+        Downloads url, retrying transient errors according to self.retry.
+        """
+        found = find(url, self.mirrors)
+        for attempt in itertools.count():
+            retry_after: Optional[float] = None
+            try:
+                async with self.limiter:
+                    nbytes = await self._download_once(
+                        url, output_file, compression, serial_file, checksum, on_slow
+                    )
+                self.limiter.success()
+                return nbytes
+            except aiohttp.ClientResponseError as e:
+                if e.status in MISSING_STATUSES:
+                    raise
+                if found is not None:
+                    found[0].record_failure()
+                if e.status not in RETRY_STATUSES or attempt >= self.retry.retries:
+                    raise
+                if e.headers:
+                    retry_after = parse_retry_after(e.headers.get("Retry-After"))
+            except (
+                aiohttp.ClientConnectionError,
+                # The connection dropped partway through the body.
+                aiohttp.ClientPayloadError,
+                asyncio.TimeoutError,
+            ):
+                if found is not None:
+                    found[0].record_failure()
+                if attempt >= self.retry.retries:
+                    raise
+            except ChecksumMismatch:
+                # Not transient, but another mirror may have it right.
+                if found is not None:
+                    found[0].record_failure()
+                raise
+            self.limiter.failure()
+            await asyncio.sleep(self.retry.delay(attempt, retry_after))
+        raise AssertionError("unreachable")  # pragma: no cover
+
+    async def _download_once(
+        self,
+        url: str,
+        output_file: Path,
+        compression: str = "",
+        serial_file: Optional[Path] = None,
+        checksum: Optional[str] = None,
+        on_slow: Optional[Callable[[], Any]] = None,
+    ) -> int:
+        timeout = aiohttp.ClientTimeout(
+            total=None,
+            sock_connect=self.retry.connect_timeout,
+            sock_read=self.retry.read_timeout,
+        )
+        algorithm, _, expected = (checksum or "").partition("=")
+        digest = hashlib.new(algorithm) if checksum else None
+        nbytes = 0
+        loop = asyncio.get_event_loop()
+        t0 = loop.time()
+        # Asks for a hedge if there are no headers in time.
+        slow = loop.call_later(self.hedge_delay, on_slow) if on_slow else None
+        auto_decompress = self.connection_options.auto_decompress
+        headers = None if auto_decompress else {"Accept-Encoding": ACCEPT_ENCODING}
+        try:
             async with self.session.get(
-                url, raise_for_status=True, timeout=None
+                url, raise_for_status=True, timeout=timeout, headers=headers
             ) as resp:
+                if slow is not None:
+                    slow.cancel()
+                t1 = loop.time()
+                encoding = resp.headers.get("Content-Encoding", "identity").lower()
+                # When the session isn't decompressing and the server already sent
+                # gzip, keep its bytes rather than decompressing to recompress.
+                passthrough = (
+                    compression == "gzip" and not auto_decompress and encoding == "gzip"
+                )
+                # Otherwise what's saved (and checksummed) must be decoded.
+                decoder = None
+                if not (auto_decompress or passthrough or encoding == "identity"):
+                    decoder = _Decoder(encoding)
                 tmp = f"{output_file}.{os.getpid()}"
-                with open(tmp, "wb") as f:
-                    async for chunk in resp.content.iter_any():
-                        f.write(chunk)
-                # Last-writer-wins semantics
-                os.rename(tmp, output_file)
+                f: IO[bytes] = await self.run_io(open, tmp, "wb")
+                w = f
+                if compression and not passthrough:
+                    w = _compressing_writer(f, compression)
+                writer = _BufferedWriter(w, self.run_io)
+                try:
+                    chunks: AsyncIterator[bytes] = resp.content.iter_any()
+                    if decoder is not None:
+                        chunks = decoder.decode(chunks)
+                    async for chunk in chunks:
+                        await writer.write(chunk)
+                        if digest is not None:
+                            digest.update(chunk)
+                        nbytes += len(chunk)
+                    if digest is not None and digest.hexdigest() != expected:
+                        raise ChecksumMismatch(
+                            url, checksum or "", f"{algorithm}={digest.hexdigest()}"
+                        )
+                except BaseException:
+                    # Never close the file under an in-flight write
+                    await writer.drain()
+                    await self.run_io(self._abandon, f, tmp)
+                    raise
+                await self.run_io(
+                    self._finish,
+                    f,
+                    w,
+                    await writer.drain(),
+                    tmp,
+                    output_file,
+                    serial_file,
+                    resp.headers.get("X-PyPI-Last-Serial"),
+                )
+        finally:
+            if slow is not None:
+                slow.cancel()
+        found = find(url, self.mirrors)
+        if found is not None:
+            found[0].record(t1 - t0, nbytes, loop.time() - t1)
+        return nbytes
 
-        return output_file
+    # Blocking, run in self.io_executor; one call for all the bookkeeping so
+    # a small download costs few round trips.
+
+    def _finish(
+        self,
+        f: IO[bytes],
+        w: IO[bytes],
+        remaining: bytes,
+        tmp: str,
+        output_file: Path,
+        serial_file: Optional[Path],
+        serial: Optional[str],
+    ) -> None:
+        try:
+            w.write(remaining)
+            if w is not f:
+                w.close()
+        except BaseException:
+            self._abandon(f, tmp)
+            raise
+        f.close()
+        # Last-writer-wins semantics
+        os.rename(tmp, output_file)
+        if serial_file is not None:
+            if serial:
+                serial_file.write_text(serial)
+            elif serial_file.exists():
+                serial_file.unlink()
+
+    def _abandon(self, f: IO[bytes], tmp: str) -> None:
+        f.close()
+        os.unlink(tmp)
+
+    def _promote(
+        self,
+        out: Path,
+        output_file: Path,
+        serial: Optional[Path],
+        serial_file: Optional[Path],
+    ) -> None:
+        os.rename(out, output_file)
+        if serial is not None and serial_file is not None:
+            if serial.exists():
+                os.rename(serial, serial_file)
+            elif serial_file.exists():
+                serial_file.unlink()
+
+    def _discard(self, paths: List[Path]) -> None:
+        for p in paths:
+            try:
+                p.unlink()
+            except FileNotFoundError:
+                pass
 
     def _is_index_filename(self, name: Optional[str]) -> bool:
-        return name in (None, "json")
+        # The simple index url ends in a slash, so its basename is ""
+        return not name or name == "json"
 
     def __enter__(self) -> "Cache":
         return self
 
     def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> Any:
-        loop = asyncio.get_event_loop()
-        loop.run_until_complete(self.session.close())
+        self.loop.run_until_complete(self.close())
 
     async def __aenter__(self) -> "Cache":
         return self
 
     async def __aexit__(self, exc_type: Any, exc: Any, tb: Any) -> Any:
-        await self.session.close()
+        await self.close()
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        if self._own_io_executor and self._io_executor is not None:
+            # Nothing is in flight once the fetches have returned.
+            self._io_executor.shutdown(wait=False)
+            self._io_executor = None
@@ -0,0 +1,229 @@
+"""
+A local SQLite catalog of what we've learned about each release, so questions
+across a whole lockfile (or mirror) don't need rerunning native/age/check.
+
+Commands record into it as they go: the index summary (whether there's an
+sdist or wheel, first upload time), and native/pep517/license/check verdicts.
+When a release's files change, its verdicts are forgotten.  Packages are
+keyed by canonical_name, so "Django" and "django" are one package.
+"""
+
+import hashlib
+import os
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Iterable, List, Optional, Tuple
+
+from .cache import canonical_name
+from .checker import CheckResult
+from .releases import FileType, Package
+from .storage import connect
+
+DEFAULT_CATALOG = "~/.cache/honesty/catalog.sqlite3"
+# Kept in PRAGMA user_version; bump (and teach _migrate) when what's stored
+# changes.  2 is canonical package names.
+CATALOG_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS packages (
+    name TEXT PRIMARY KEY,
+    updated TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS releases (
+    package TEXT NOT NULL,
+    version TEXT NOT NULL,
+    checksums TEXT NOT NULL,
+    has_sdist INTEGER NOT NULL,
+    has_wheel INTEGER NOT NULL,
+    first_upload TEXT,
+    native INTEGER,
+    pep517 INTEGER,
+    license TEXT,
+    check_rc INTEGER,
+    check_status TEXT,
+    PRIMARY KEY (package, version)
+);
+CREATE INDEX IF NOT EXISTS releases_has_sdist ON releases (has_sdist);
+CREATE INDEX IF NOT EXISTS releases_first_upload ON releases (first_upload);
+CREATE INDEX IF NOT EXISTS releases_native ON releases (native);
+CREATE INDEX IF NOT EXISTS releases_pep517 ON releases (pep517);
+CREATE INDEX IF NOT EXISTS releases_license ON releases (license);
+CREATE INDEX IF NOT EXISTS releases_check_rc ON releases (check_rc);
+"""
+
+# Verdicts that record() accepts, all reset when a release's files change.
+FACTS = ("native", "pep517", "license", "check_rc", "check_status")
+
+# question -> (extra column, where clause); "?" is the question's argument.
+QUESTIONS = {
+    "native": ("NULL", "r.native = 1"),
+    "pep517": ("NULL", "r.pep517 = 1"),
+    "no-sdist": ("NULL", "r.has_sdist = 0"),
+    "no-wheel": ("NULL", "r.has_wheel = 0"),
+    "license": ("r.license", "r.license LIKE ?"),
+    "older-than": ("r.first_upload", "r.first_upload < ?"),
+    "problems": ("r.check_status", "r.check_rc != 0"),
+    "unchecked": ("NULL", "r.check_rc IS NULL"),
+}
+
+
+def _checksums_key(package: Package, version: str) -> str:
+    checksums = sorted(f.checksum for f in package.releases[version].files)
+    return hashlib.sha256("\n".join(checksums).encode()).hexdigest()
+
+
+class Catalog:
+    def __init__(self, path: Optional[str] = None) -> None:
+        if not path:
+            path = os.environ.get("HONESTY_CATALOG", DEFAULT_CATALOG)
+        assert isinstance(path, str), path
+        self.path = Path(path).expanduser()
+        self.conn = connect(self.path)
+        self.conn.executescript(SCHEMA)
+        self._migrate()
+
+    def _migrate(self) -> None:
+        """
+        Renames packages recorded under their raw names (before
+        CATALOG_VERSION 2) to the canonical ones.  Where both have a release,
+        the canonical one's is kept.
+        """
+        (version,) = self.conn.execute("PRAGMA user_version").fetchone()
+        if version >= CATALOG_VERSION:
+            return
+        self.conn.create_function("canonical_name", 1, canonical_name)
+        with self.conn:
+            for table, key in (("releases", "package"), ("packages", "name")):
+                self.conn.execute(
+                    f"UPDATE OR IGNORE {table} SET {key} = canonical_name({key}) "
+                    f"WHERE {key} != canonical_name({key})"
+                )
+                # The ones left collided with a canonical row.
+                self.conn.execute(
+                    f"DELETE FROM {table} WHERE {key} != canonical_name({key})"
+                )
+            self.conn.execute(f"PRAGMA user_version = {CATALOG_VERSION}")
+
+    def __enter__(self) -> "Catalog":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def record_package(self, package: Package) -> None:
+        """
+        Records the releases from a parsed index, keeping the verdicts of
+        releases whose files are unchanged.  Releases no longer in the index
+        are removed.
+        """
+        now = datetime.now(timezone.utc).isoformat()
+        name = canonical_name(package.name)
+        with self.conn:
+            existing = dict(
+                self.conn.execute(
+                    "SELECT version, checksums FROM releases WHERE package = ?",
+                    (name,),
+                )
+            )
+            for version, rel in package.releases.items():
+                key = _checksums_key(package, version)
+                types = {f.file_type for f in rel.files}
+                times = [f.upload_time for f in rel.files if f.upload_time]
+                first_upload = min(times).isoformat() if times else None
+                if existing.pop(version, None) == key:
+                    # The simple index has no upload times; keep json's.
+                    self.conn.execute(
+                        "UPDATE releases SET first_upload = "
+                        "COALESCE(?, first_upload) WHERE package = ? AND version = ?",
+                        (first_upload, name, version),
+                    )
+                    continue
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO releases (package, version, checksums, "
+                    "has_sdist, has_wheel, first_upload) VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        name,
+                        version,
+                        key,
+                        FileType.SDIST in types,
+                        FileType.BDIST_WHEEL in types,
+                        first_upload,
+                    ),
+                )
+            self.conn.executemany(
+                "DELETE FROM releases WHERE package = ? AND version = ?",
+                [(name, v) for v in existing],
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO packages (name, updated) VALUES (?, ?)",
+                (name, now),
+            )
+
+    def record(self, package_name: str, version: str, **facts: Any) -> None:
+        """
+        Stores verdicts (see FACTS) for a release already recorded with
+        record_package.
+        """
+        for k in facts:
+            if k not in FACTS:
+                raise ValueError(f"Unknown fact {k!r}")
+        assignments = ", ".join(f"{k} = ?" for k in facts)
+        with self.conn:
+            self.conn.execute(
+                f"UPDATE releases SET {assignments} WHERE package = ? AND version = ?",
+                (*facts.values(), canonical_name(package_name), version),
+            )
+
+    def record_check(self, result: CheckResult) -> None:
+        self.record(
+            result.package,
+            result.version,
+            check_rc=result.rc,
+            check_status=result.status,
+        )
+
+    def query(
+        self,
+        question: str,
+        arg: Optional[str] = None,
+        wanted: Optional[Iterable[Tuple[str, Optional[str]]]] = None,
+        now: Optional[datetime] = None,
+    ) -> List[Tuple[str, str, Any]]:
+        """
+        Answers one of QUESTIONS, returning (package, version, extra) sorted by
+        package and version.  `arg` is the license (a LIKE pattern) for
+        "license", or a number of days for "older-than".
+
+        When `wanted` is given, only those (package, version) are considered,
+        where a version of None means every release of the package.  Packages
+        are returned by canonical name.
+        """
+        extra, where = QUESTIONS[question]
+        params: List[Any] = []
+        if "?" in where:
+            if arg is None:
+                raise ValueError(f"{question} needs an argument")
+            if question == "older-than":
+                now = now or datetime.now(timezone.utc)
+                arg = (now - timedelta(days=float(arg))).isoformat()
+            params.append(arg)
+
+        sql = f"SELECT r.package, r.version, {extra} FROM releases r"
+        if wanted is not None:
+            self.conn.execute(
+                "CREATE TEMP TABLE IF NOT EXISTS wanted (package TEXT, version TEXT)"
+            )
+            self.conn.execute("DELETE FROM wanted")
+            self.conn.executemany(
+                "INSERT INTO wanted VALUES (?, ?)",
+                ((canonical_name(name), version) for name, version in wanted),
+            )
+            sql += (
+                " JOIN wanted w ON r.package = w.package"
+                " AND (w.version IS NULL OR r.version = w.version)"
+            )
+        sql += f" WHERE {where} ORDER BY r.package, r.version"
+        return [tuple(row) for row in self.conn.execute(sql, params)]
@@ -1,19 +1,183 @@
+import asyncio
 import difflib
+import functools
+import hashlib
+import json
+import os
 import os.path
 import time
+from concurrent.futures import Executor
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Dict, List, Set, Tuple, Union
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, TypeVar, Union
 
 import click
 from infer_license.api import guess_file
 from infer_license.types import License
 
 from .archive import archive_hashes, extract_and_get_names
-from .cache import Cache
+from .cache import Cache, cache_dir, canonical_name
+from .instrument import call_collecting, emit, timed
+from .metadata import async_release_metadata
 from .releases import FileEntry, FileType, Package
+from .storage import write_atomically
+from .wheels import EXHAUSTIVE, WheelSelection
 
+T = TypeVar("T")
 
-def run_checker(package: Package, version: str, verbose: bool, cache: Cache) -> int:
+# Or'd into an rc when a package's index can't be fetched/parsed, or a version
+# can't be checked at all (including when --wheels selects none of its wheels).
+ERROR_RC = 16
+
+
+@dataclass
+class CheckResult:
+    package: str
+    version: str
+    rc: int
+    status: str  # "OK", "problems", "no sdist", "only sdist" or "none selected"
+    # [message] = set(filenames)
+    messages: Dict[str, Set[str]] = field(default_factory=dict)
+
+
+DEFAULT_RESULTS_DIR = "~/.cache/honesty/results"
+# Bump this when a change to the checker would change existing verdicts.
+RESULTS_FORMAT = 1
+
+
+class ResultCache:
+    """
+    Persistent verdicts from run_checker, keyed by package, version, the
+    checksums of every file in the release, and the WheelSelection used.  If a
+    file is added, removed or replaced, the key changes and the release is
+    checked again.
+
+    When self.fresh, never trust the stored verdicts (but still save).
+    """
+
+    def __init__(self, results_dir: Optional[str] = None, fresh: bool = False):
+        if not results_dir:
+            results_dir = os.environ.get("HONESTY_RESULTS", DEFAULT_RESULTS_DIR)
+        assert isinstance(results_dir, str), results_dir
+        self.results_path = Path(results_dir).expanduser()
+        self.fresh = fresh
+
+    def key(
+        self,
+        package: Package,
+        version: str,
+        selection: WheelSelection = EXHAUSTIVE,
+    ) -> str:
+        checksums = sorted(f.checksum for f in package.releases[version].files)
+        obj = [RESULTS_FORMAT, canonical_name(package.name), version, checksums]
+        if selection != EXHAUSTIVE:
+            # (Keeping keys from before there was a choice valid.)
+            obj.append(str(selection))
+        return hashlib.sha256(json.dumps(obj).encode()).hexdigest()
+
+    def _path(self, package_name: str, version: str) -> Path:
+        return self.results_path / cache_dir(package_name) / f"{version}.json"
+
+    def get(
+        self,
+        package: Package,
+        version: str,
+        selection: WheelSelection = EXHAUSTIVE,
+    ) -> Optional[CheckResult]:
+        if self.fresh:
+            return None
+        try:
+            with open(self._path(package.name, version)) as f:
+                obj = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if obj.get("key") != self.key(package, version, selection):
+            return None
+        return CheckResult(
+            package.name,
+            version,
+            obj["rc"],
+            obj["status"],
+            {k: set(v) for k, v in obj["messages"].items()},
+        )
+
+    def put(
+        self,
+        package: Package,
+        result: CheckResult,
+        selection: WheelSelection = EXHAUSTIVE,
+    ) -> None:
+        path = self._path(package.name, result.version)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        obj = {
+            "key": self.key(package, result.version, selection),
+            "rc": result.rc,
+            "status": result.status,
+            "messages": {k: sorted(v) for k, v in result.messages.items()},
+        }
+        write_atomically(path, json.dumps(obj, sort_keys=True))
+
+
+def run_checker(
+    package: Package,
+    version: str,
+    verbose: bool,
+    cache: Cache,
+    results: Optional[ResultCache] = None,
+    selection: WheelSelection = EXHAUSTIVE,
+) -> int:
+    loop = asyncio.get_event_loop()
+    result: CheckResult = loop.run_until_complete(
+        async_run_checker(
+            package,
+            version,
+            verbose=verbose,
+            cache=cache,
+            results=results,
+            selection=selection,
+        )
+    )
+    report_check(result)
+    return result.rc
+
+
+async def async_run_checker(
+    package: Package,
+    version: str,
+    verbose: bool,
+    cache: Cache,
+    executor: Optional[Executor] = None,
+    results: Optional[ResultCache] = None,
+    selection: WheelSelection = EXHAUSTIVE,
+) -> CheckResult:
+    """
+    Fetches the files of the release concurrently (every one, or for wheels,
+    those chosen by `selection`) and compares the .py files in the bdists
+    against the sdist.
+
+    The hashing is CPU-bound and runs in `executor` (the loop's default thread
+    pool when None); pass a ProcessPoolExecutor to use multiple cores.
+
+    If `results` is given, a stored verdict for the same files is returned
+    without fetching anything, and new verdicts are stored there.
+    """
+    with timed("check", package.name, version) as event:
+        result = await _check_release(
+            package, version, verbose, cache, executor, results, selection
+        )
+        event.rc = result.rc
+    return result
+
+
+async def _check_release(
+    package: Package,
+    version: str,
+    verbose: bool,
+    cache: Cache,
+    executor: Optional[Executor],
+    results: Optional[ResultCache],
+    selection: WheelSelection,
+) -> CheckResult:
     try:
         rel = package.releases[version]
     except KeyError:
@@ -22,24 +186,38 @@ def run_checker(package: Package, version: str, verbose: bool, cache: Cache) ->
     sdists = [f for f in rel.files if f.file_type == FileType.SDIST]
 
     if not sdists:
-        click.secho(f"{package.name} {version} no sdist", fg="red")
-        return 1
+        return CheckResult(package.name, version, 1, "no sdist")
     elif len(sdists) == len(rel.files):
-        click.secho(f"{package.name} {version} only sdist", fg="green")
-        return 0
+        return CheckResult(package.name, version, 0, "only sdist")
 
-    local_paths: List[Tuple[FileEntry, Path]] = []
-    with click.progressbar(rel.files) as bar:
-        for fe in bar:
-            local_paths.append((fe, cache.fetch(pkg=package.name, url=fe.url)))
-            # TODO verify checksum
+    if results is not None:
+        cached = await cache.run_io(results.get, package, version, selection)
+        if cached is not None:
+            if verbose:
+                print(f"{package.name} {version} using stored verdict")
+            return cached
+
+    files = selection.select(rel.files)
+    if len(sdists) == len(files):
+        # Nothing was compared, which mustn't look like a pass.
+        return CheckResult(package.name, version, ERROR_RC, "none selected")
+
+    paths = await asyncio.gather(
+        *[
+            cache.async_fetch(pkg=package.name, url=fe.url, checksum=fe.checksum)
+            for fe in files
+        ]
+    )
+    local_paths: List[Tuple[FileEntry, Path]] = list(zip(files, paths))
 
     sdist_hashes: Dict[str, str] = {}
     for fe, lp in local_paths:
         if fe.file_type == FileType.SDIST:
             # assert not sdist_hashes # multiple sdists?
             t0 = time.time()
-            sdist_hashes = archive_hashes(lp, True)
+            sdist_hashes = await _run_in_executor(
+                executor, package.name, archive_hashes, lp, True
+            )
             t1 = time.time()
             if verbose:
                 print(f"{fe.basename} {t1-t0}")
@@ -54,51 +232,70 @@ def run_checker(package: Package, version: str, verbose: bool, cache: Cache) ->
     for fe, lp in local_paths:
         if fe.file_type in (FileType.BDIST_WHEEL, FileType.BDIST_EGG):
             t0 = time.time()
-            this_hashes = archive_hashes(lp)
+            this_hashes = await _run_in_executor(
+                executor, package.name, archive_hashes, lp
+            )
             t1 = time.time()
             if verbose:
                 print(f"{fe.basename} {t1-t0}")
 
             msg = []
-            for k, h in sorted(this_hashes.items()):
-                if k not in sdist_hashes:
-                    # Intentionally not including has here, because
-                    # scipy/__config__.py has a different hash in each one and
-                    # I want them to coalesce
-                    msg.append(f"    {k} not in sdist")
-                    rc |= 4
-                elif h != sdist_hashes[k]:
-                    msg.append(f"    {k} differs from sdist {h}")
-                    rc |= 8
+            with timed("compare", package.name, fe.basename):
+                for k, h in sorted(this_hashes.items()):
+                    if k not in sdist_hashes:
+                        # Intentionally not including has here, because
+                        # scipy/__config__.py has a different hash in each one
+                        # and I want them to coalesce
+                        msg.append(f"    {k} not in sdist")
+                        rc |= 4
+                    elif h != sdist_hashes[k]:
+                        msg.append(f"    {k} differs from sdist {h}")
+                        rc |= 8
 
             if msg:
                 messages.setdefault("\n".join(msg), set()).add(fe.basename)
 
-    if rc == 0:
-        click.secho(f"{package.name} {version} OK", fg="green")
+    result = CheckResult(
+        package.name, version, rc, "OK" if rc == 0 else "problems", messages
+    )
+    if results is not None:
+        await cache.run_io(results.put, package, result, selection)
+    return result
+
+
+def report_check(result: CheckResult) -> None:
+    if result.status in ("no sdist", "none selected"):
+        click.secho(f"{result.package} {result.version} {result.status}", fg="red")
+    elif result.rc == 0:
+        click.secho(f"{result.package} {result.version} {result.status}", fg="green")
     else:
-        click.secho(f"{package.name} {version} problems", fg="yellow")
-        for k, vm in messages.items():
+        click.secho(f"{result.package} {result.version} problems", fg="yellow")
+        for k, vm in result.messages.items():
             for i in vm:
                 click.secho(f"  {i}", fg="red")
             click.secho(k, fg="yellow")
 
-    return rc
-
 
 def is_pep517(package: Package, version: str, verbose: bool, cache: Cache) -> bool:
-    try:
-        rel = package.releases[version]
-    except KeyError:
-        raise click.ClickException(f"version={version} not available")
+    loop = asyncio.get_event_loop()
+    result: bool = loop.run_until_complete(
+        async_is_pep517(package, version, verbose=verbose, cache=cache)
+    )
+    return result
 
-    # Find *a* sdist
-    sdists = [f for f in rel.files if f.file_type == FileType.SDIST]
-    if not sdists:
-        raise click.ClickException(f"{package.name} no sdists")
 
-    lp = cache.fetch(pkg=package.name, url=sdists[0].url)
+async def async_is_pep517(
+    package: Package,
+    version: str,
+    verbose: bool,
+    cache: Cache,
+    executor: Optional[Executor] = None,
+) -> bool:
+    lp = await _fetch_one(package, version, FileType.SDIST, cache)
+    return await _run_in_executor(executor, package.name, _is_pep517, package.name, lp)
 
+
+def _is_pep517(package_name: str, lp: Path) -> bool:
     archive_root, names = extract_and_get_names(
         lp, strip_top_level=True, patterns=("pyproject.toml",)
     )
@@ -109,28 +306,51 @@ def is_pep517(package: Package, version: str, verbose: bool, cache: Cache) -> bo
             with open(os.path.join(archive_root, relname), "rb") as buf:
                 data = buf.read().replace(b"\r\n", b"\n")
             if b"[build-system]" in data:
-                click.echo(f"{package.name} build-system {relname}")
+                click.echo(f"{package_name} build-system {relname}")
                 return True
             else:
-                click.echo(f"{package.name} has-toml {relname}")
+                click.echo(f"{package_name} has-toml {relname}")
     return False
 
 
 def guess_license(
-    package: Package, version: str, verbose: bool, cache: Cache
+    package: Package,
+    version: str,
+    verbose: bool,
+    cache: Cache,
+    use_metadata: bool = False,
 ) -> Union[License, str, None]:
-    try:
-        rel = package.releases[version]
-    except KeyError:
-        raise click.ClickException(f"version={version} not available")
-
-    # Find *a* sdist
-    sdists = [f for f in rel.files if f.file_type == FileType.SDIST]
-    if not sdists:
-        raise click.ClickException(f"{package.name} no sdists")
+    loop = asyncio.get_event_loop()
+    result: Union[License, str, None] = loop.run_until_complete(
+        async_guess_license(
+            package, version, verbose=verbose, cache=cache, use_metadata=use_metadata
+        )
+    )
+    return result
 
-    lp = cache.fetch(pkg=package.name, url=sdists[0].url)
 
+async def async_guess_license(
+    package: Package,
+    version: str,
+    verbose: bool,
+    cache: Cache,
+    executor: Optional[Executor] = None,
+    use_metadata: bool = False,
+) -> Union[License, str, None]:
+    """
+    With use_metadata, what the release's PEP 658 metadata claims is returned
+    when the index has it, without downloading the sdist.
+    """
+    if use_metadata:
+        md = await async_release_metadata(package, version, cache)
+        hint = md.license_hint() if md else None
+        if hint is not None:
+            return hint
+    lp = await _fetch_one(package, version, FileType.SDIST, cache)
+    return await _run_in_executor(executor, package.name, _guess_license, lp)
+
+
+def _guess_license(lp: Path) -> Union[License, str, None]:
     archive_root, names = extract_and_get_names(
         lp, strip_top_level=True, patterns=("LICENSE*", "COPY*")
     )
@@ -152,21 +372,29 @@ def guess_license(
 def has_nativemodules(
     package: Package, version: str, verbose: bool, cache: Cache
 ) -> bool:
-    try:
-        rel = package.releases[version]
-    except KeyError:
-        raise click.ClickException(f"version={version} not available")
+    loop = asyncio.get_event_loop()
+    result: bool = loop.run_until_complete(
+        async_has_nativemodules(package, version, verbose=verbose, cache=cache)
+    )
+    return result
 
-    # Find *a* sdist
-    bdists = [f for f in rel.files if f.file_type == FileType.BDIST_WHEEL]
-    if not bdists:
-        raise click.ClickException(f"{package.name} no bdists")
 
-    if verbose:
-        click.echo(f"{package.name} {version} {bdists[0].basename}")
+async def async_has_nativemodules(
+    package: Package,
+    version: str,
+    verbose: bool,
+    cache: Cache,
+    executor: Optional[Executor] = None,
+) -> bool:
+    lp = await _fetch_one(
+        package, version, FileType.BDIST_WHEEL, cache, verbose=verbose
+    )
+    return await _run_in_executor(
+        executor, package.name, _has_nativemodules, package.name, lp
+    )
 
-    lp = cache.fetch(pkg=package.name, url=bdists[0].url)
 
+def _has_nativemodules(package_name: str, lp: Path) -> bool:
     archive_root, names = extract_and_get_names(
         lp, strip_top_level=False, patterns=("*.so", "*.dll")
     )
@@ -174,12 +402,62 @@ def has_nativemodules(
         # TODO for a couple of projects this is finding test fixtures, we
         # should only be looking alongside the rootmost setup.py
         if srcname.endswith(".so") or srcname.endswith(".dll"):
-            click.echo(f"{package.name} has {srcname}")
+            click.echo(f"{package_name} has {srcname}")
             return True
 
     return False
 
 
+async def _run_in_executor(
+    executor: Optional[Executor],
+    package_name: str,
+    fn: Callable[..., T],
+    *args: Any,
+) -> T:
+    """
+    Runs fn in the executor, forwarding the instrumentation events it emits
+    (attributed to package_name) even if the executor is a process pool.
+    """
+    loop = asyncio.get_event_loop()
+    result, events = await loop.run_in_executor(
+        executor, functools.partial(call_collecting, fn, *args)
+    )
+    for event in events:
+        if event.package is None:
+            event.package = package_name
+        emit(event)
+    return result
+
+
+async def _fetch_one(
+    package: Package,
+    version: str,
+    file_type: FileType,
+    cache: Cache,
+    verbose: bool = False,
+) -> Path:
+    """
+    Fetches *a* file of the given type from the release, raising a
+    ClickException if there isn't one.
+    """
+    try:
+        rel = package.releases[version]
+    except KeyError:
+        raise click.ClickException(f"version={version} not available")
+
+    files = [f for f in rel.files if f.file_type == file_type]
+    if not files:
+        kind = "sdists" if file_type == FileType.SDIST else "bdists"
+        raise click.ClickException(f"{package.name} no {kind}")
+
+    if verbose:
+        click.echo(f"{package.name} {version} {files[0].basename}")
+
+    return await cache.async_fetch(
+        pkg=package.name, url=files[0].url, checksum=files[0].checksum
+    )
+
+
 def shorten(subj: str, n: int = 50) -> str:
     if len(subj) <= n:
         return subj
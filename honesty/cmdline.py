@@ -2,22 +2,49 @@ import asyncio
 import functools
 import json
 import os.path
-import shutil
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime, timezone
-from enum import Enum, IntEnum
 from pathlib import Path
-from typing import Any, List, Optional
+from typing import IO, Any, AsyncIterator, Iterator, Optional
 
 import click
-import pkg_resources
+from aiohttp import web
 
 from honesty.__version__ import __version__
-from honesty.api import async_download_many
+from honesty.api import (
+    async_download_many,
+    bounded_gather,
+    dataclass_default,
+    select_versions,
+)
 from honesty.archive import extract_and_get_names
+from honesty.batch import async_check_batch, parse_specs
 from honesty.cache import Cache
-from honesty.checker import guess_license, has_nativemodules, is_pep517, run_checker
-from honesty.releases import FileType, Package, async_parse_index, parse_index
+from honesty.catalog import QUESTIONS, Catalog
+from honesty.checker import (
+    ResultCache,
+    async_guess_license,
+    async_has_nativemodules,
+    async_is_pep517,
+    async_run_checker,
+    report_check,
+)
+from honesty.instrument import Profile, subscribe, unsubscribe
+from honesty.link import STRATEGIES, link_tree
+from honesty.metrics import Metrics, dumping
+from honesty.releases import FileType, async_parse_index
+from honesty.scan import (
+    DEFAULT_LEASE,
+    DEFAULT_SHARD_SIZE,
+    WorkQueue,
+    async_work,
+    shard_runner,
+)
+from honesty.server import DEFAULT_INDEX_TTL, Server
+from honesty.sync import async_read_changes, async_sync
+from honesty.wheels import WheelSelection
 
 
 # TODO type
@@ -30,15 +57,92 @@ def wrap_async(coro: Any) -> Any:
     return inner
 
 
-def dataclass_default(obj: Any) -> Any:
-    if hasattr(obj, "__dataclass_fields__"):
-        return obj.__dict__
-    elif isinstance(obj, (Enum, IntEnum)):
-        return obj.name
-    elif isinstance(obj, datetime):
-        return str(obj)
-    else:
-        raise TypeError(obj)
+@contextmanager
+def profiling(fmt: Optional[str]) -> Iterator[None]:
+    """
+    When fmt is given, totals the instrumentation events emitted in the block
+    and prints them to stderr (as a table or json) when it exits.
+    """
+    if not fmt:
+        yield
+        return
+
+    profile = Profile()
+    subscribe(profile)
+    try:
+        yield
+    finally:
+        unsubscribe(profile)
+        if fmt == "json":
+            click.echo(json.dumps(profile.as_json(), sort_keys=True), err=True)
+        else:
+            click.echo(profile.table(), err=True)
+
+
+PROFILE_OPTION = click.option(
+    "--profile",
+    type=click.Choice(["table", "json"]),
+    help="Print time/bytes spent in each phase to stderr",
+)
+
+
+@contextmanager
+def exporting_metrics(path: Optional[str]) -> Iterator[None]:
+    """
+    When path is given, keeps it updated with metrics of the instrumentation
+    events emitted in the block.
+    """
+    if not path:
+        yield
+        return
+
+    metrics = Metrics()
+    subscribe(metrics)
+    try:
+        with dumping(metrics, path):
+            yield
+    finally:
+        unsubscribe(metrics)
+
+
+METRICS_OPTION = click.option(
+    "--metrics-file",
+    envvar="HONESTY_METRICS_FILE",
+    help="Keep this file updated with counters and histograms in the "
+    "Prometheus text format, e.g. for node_exporter's textfile collector",
+)
+
+
+def _wheel_selection(
+    ctx: click.Context, param: click.Parameter, value: str
+) -> WheelSelection:
+    try:
+        return WheelSelection.parse(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
+WHEELS_OPTION = click.option(
+    "--wheels",
+    default="exhaustive",
+    show_default=True,
+    callback=_wheel_selection,
+    help="Which wheels to compare: 'exhaustive', 'representative' (one per "
+    "platform family and distinct pure wheel; faster, but a tampered wheel "
+    "that isn't the representative goes unnoticed), or comma-separated tag "
+    "patterns like 'cp311-*-manylinux*,py3-none-any'",
+)
+
+
+LINK_OPTION = click.option(
+    "--link",
+    type=click.Choice(STRATEGIES),
+    default="auto",
+    show_default=True,
+    help="How to populate --dest from the cache; auto tries reflink, then "
+    "copy.  hardlink and symlink share contents with the cache (or a local "
+    "mirror), so modifying a file in place would modify that too",
+)
 
 
 @click.group()
@@ -56,6 +160,8 @@ def cli() -> None:
 async def list(fresh: bool, nouse_json: bool, as_json: bool, package_name: str) -> None:
     async with Cache(fresh_index=fresh) as cache:
         package = await async_parse_index(package_name, cache, use_json=not nouse_json)
+    with Catalog() as catalog:
+        catalog.record_package(package)
 
     if as_json:
         for k, v in package.releases.items():
@@ -76,93 +182,279 @@ async def list(fresh: bool, nouse_json: bool, as_json: bool, package_name: str)
 @click.option("--verbose", "-v", is_flag=True, type=bool)
 @click.option("--fresh", "-f", is_flag=True, type=bool)
 @click.option("--nouse_json", is_flag=True, type=bool)
-@click.argument("package_name")
-def check(verbose: bool, fresh: bool, nouse_json: bool, package_name: str) -> None:
-    with Cache(fresh_index=fresh) as cache:
-        package_name, operator, version = package_name.partition("==")
-        package = parse_index(package_name, cache, use_json=not nouse_json)
-        selected_versions = select_versions(package, operator, version)
-
-        if verbose:
-            click.echo(f"check {package_name} {selected_versions}")
+@click.option(
+    "--from",
+    "from_file",
+    type=click.File("r"),
+    help="Check every package in a requirements-style file ('-' for stdin), "
+    "printing one json line per package",
+)
+@click.option(
+    "--concurrency",
+    default=8,
+    show_default=True,
+    help="Packages (with --from) or versions to check at once",
+)
+@click.option(
+    "--jobs", "-j", type=int, help="Processes used for hashing (default: cpu count)"
+)
+@click.option(
+    "--recheck",
+    is_flag=True,
+    type=bool,
+    help="Ignore stored verdicts for releases whose files are unchanged",
+)
+@WHEELS_OPTION
+@PROFILE_OPTION
+@METRICS_OPTION
+@click.argument("package_name", required=False)
+@wrap_async
+async def check(
+    verbose: bool,
+    fresh: bool,
+    nouse_json: bool,
+    from_file: Optional[IO[str]],
+    concurrency: int,
+    jobs: Optional[int],
+    recheck: bool,
+    wheels: WheelSelection,
+    profile: Optional[str],
+    metrics_file: Optional[str],
+    package_name: Optional[str],
+) -> None:
+    with profiling(profile), exporting_metrics(metrics_file):
+        results = ResultCache(fresh=recheck)
+        if from_file is not None:
+            if package_name:
+                raise click.UsageError(
+                    "Specify either PACKAGE_NAME or --from, not both"
+                )
+            specs = parse_specs(from_file)
+            async with Cache(fresh_index=fresh) as cache:
+                with ProcessPoolExecutor(jobs) as pool, Catalog() as catalog:
+                    rc = await async_check_batch(
+                        specs,
+                        cache,
+                        sys.stdout,
+                        use_json=not nouse_json,
+                        concurrency=concurrency,
+                        executor=pool,
+                        results=results,
+                        catalog=catalog,
+                        selection=wheels,
+                    )
+            if rc != 0:
+                sys.exit(rc)
+            return
+
+        if not package_name:
+            raise click.UsageError("Missing argument PACKAGE_NAME (or --from)")
+
+        async with Cache(fresh_index=fresh) as cache:
+            package_name, operator, version = package_name.partition("==")
+            package = await async_parse_index(
+                package_name, cache, use_json=not nouse_json
+            )
+            selected_versions = select_versions(package, operator, version)
+
+            if verbose:
+                click.echo(f"check {package_name} {selected_versions}")
+
+            with ProcessPoolExecutor(jobs) as pool:
+                check_results = await bounded_gather(
+                    (
+                        async_run_checker(
+                            package,
+                            v,
+                            verbose=verbose,
+                            cache=cache,
+                            executor=pool,
+                            results=results,
+                            selection=wheels,
+                        )
+                        for v in selected_versions
+                    ),
+                    concurrency,
+                )
+
+        with Catalog() as catalog:
+            catalog.record_package(package)
+            for result in check_results:
+                catalog.record_check(result)
 
         rc = 0
-        for v in selected_versions:
-            rc |= run_checker(package, v, verbose=verbose, cache=cache)
+        for result in check_results:
+            report_check(result)
+            rc |= result.rc
 
-    if rc != 0:
-        sys.exit(rc)
+        if rc != 0:
+            sys.exit(rc)
 
 
 @cli.command(help="Check for presence of pep517 markers")
 @click.option("--verbose", "-v", is_flag=True, type=bool)
 @click.option("--fresh", "-f", is_flag=True, type=bool)
 @click.option("--nouse_json", is_flag=True, type=bool)
+@click.option("--concurrency", default=8, show_default=True)
+@PROFILE_OPTION
+@METRICS_OPTION
 @click.argument("package_name")
-def ispep517(verbose: bool, fresh: bool, nouse_json: bool, package_name: str) -> None:
-    with Cache(fresh_index=fresh) as cache:
-        package_name, operator, version = package_name.partition("==")
-        package = parse_index(package_name, cache, use_json=not nouse_json)
-        selected_versions = select_versions(package, operator, version)
+@wrap_async
+async def ispep517(
+    verbose: bool,
+    fresh: bool,
+    nouse_json: bool,
+    concurrency: int,
+    profile: Optional[str],
+    metrics_file: Optional[str],
+    package_name: str,
+) -> None:
+    with profiling(profile), exporting_metrics(metrics_file):
+        async with Cache(fresh_index=fresh) as cache:
+            package_name, operator, version = package_name.partition("==")
+            package = await async_parse_index(
+                package_name, cache, use_json=not nouse_json
+            )
+            selected_versions = select_versions(package, operator, version)
 
-        if verbose:
-            click.echo(f"check {package_name} {selected_versions}")
+            if verbose:
+                click.echo(f"check {package_name} {selected_versions}")
+
+            results = await bounded_gather(
+                (
+                    async_is_pep517(package, v, verbose=verbose, cache=cache)
+                    for v in selected_versions
+                ),
+                concurrency,
+            )
+
+        with Catalog() as catalog:
+            catalog.record_package(package)
+            for v, result in zip(selected_versions, results):
+                catalog.record(package.name, v, pep517=result)
 
         rc = 0
-        for v in selected_versions:
-            rc |= is_pep517(package, v, verbose=verbose, cache=cache)
+        for result in results:
+            rc |= result
 
-    if rc != 0:
-        sys.exit(rc)
+        if rc != 0:
+            sys.exit(rc)
 
 
 @cli.command(help="Check for native modules in bdist")
 @click.option("--verbose", "-v", is_flag=True, type=bool)
 @click.option("--fresh", "-f", is_flag=True, type=bool)
 @click.option("--nouse_json", is_flag=True, type=bool)
+@click.option("--concurrency", default=8, show_default=True)
+@PROFILE_OPTION
+@METRICS_OPTION
 @click.argument("package_name")
-def native(verbose: bool, fresh: bool, nouse_json: bool, package_name: str) -> None:
-    with Cache(fresh_index=fresh) as cache:
-        package_name, operator, version = package_name.partition("==")
-        package = parse_index(package_name, cache, use_json=not nouse_json)
-        selected_versions = select_versions(package, operator, version)
+@wrap_async
+async def native(
+    verbose: bool,
+    fresh: bool,
+    nouse_json: bool,
+    concurrency: int,
+    profile: Optional[str],
+    metrics_file: Optional[str],
+    package_name: str,
+) -> None:
+    with profiling(profile), exporting_metrics(metrics_file):
+        async with Cache(fresh_index=fresh) as cache:
+            package_name, operator, version = package_name.partition("==")
+            package = await async_parse_index(
+                package_name, cache, use_json=not nouse_json
+            )
+            selected_versions = select_versions(package, operator, version)
 
-        if verbose:
-            click.echo(f"check {package_name} {selected_versions}")
+            if verbose:
+                click.echo(f"check {package_name} {selected_versions}")
+
+            results = await bounded_gather(
+                (
+                    async_has_nativemodules(package, v, verbose=verbose, cache=cache)
+                    for v in selected_versions
+                ),
+                concurrency,
+            )
+
+        with Catalog() as catalog:
+            catalog.record_package(package)
+            for v, result in zip(selected_versions, results):
+                catalog.record(package.name, v, native=result)
 
         rc = 0
-        for v in selected_versions:
-            rc |= has_nativemodules(package, v, verbose=verbose, cache=cache)
+        for result in results:
+            rc |= result
 
-    if rc != 0:
-        sys.exit(rc)
+        if rc != 0:
+            sys.exit(rc)
 
 
 @cli.command(help="Guess license of a package")
 @click.option("--verbose", "-v", is_flag=True, type=bool)
 @click.option("--fresh", "-f", is_flag=True, type=bool)
 @click.option("--nouse_json", is_flag=True, type=bool)
+@click.option("--concurrency", default=8, show_default=True)
+@click.option(
+    "--metadata",
+    is_flag=True,
+    type=bool,
+    help="Trust PEP 658 metadata where the index has it, instead of the sdist",
+)
+@PROFILE_OPTION
+@METRICS_OPTION
 @click.argument("package_name")
-def license(verbose: bool, fresh: bool, nouse_json: bool, package_name: str) -> None:
-    with Cache(fresh_index=fresh) as cache:
-        package_name, operator, version = package_name.partition("==")
-        package = parse_index(package_name, cache, use_json=not nouse_json)
-        selected_versions = select_versions(package, operator, version)
-
-        if verbose:
-            click.echo(f"check {package_name} {selected_versions}")
+@wrap_async
+async def license(
+    verbose: bool,
+    fresh: bool,
+    nouse_json: bool,
+    concurrency: int,
+    metadata: bool,
+    profile: Optional[str],
+    metrics_file: Optional[str],
+    package_name: str,
+) -> None:
+    with profiling(profile), exporting_metrics(metrics_file):
+        async with Cache(fresh_index=fresh) as cache:
+            package_name, operator, version = package_name.partition("==")
+            # Only the simple index advertises .metadata files
+            package = await async_parse_index(
+                package_name, cache, use_json=not (nouse_json or metadata)
+            )
+            selected_versions = select_versions(package, operator, version)
+
+            if verbose:
+                click.echo(f"check {package_name} {selected_versions}")
+
+            licenses = await bounded_gather(
+                (
+                    async_guess_license(
+                        package,
+                        v,
+                        verbose=verbose,
+                        cache=cache,
+                        use_metadata=metadata,
+                    )
+                    for v in selected_versions
+                ),
+                concurrency,
+            )
 
         rc = 0
-        for v in selected_versions:
-            license = guess_license(package, v, verbose=verbose, cache=cache)
-            if license is not None and not isinstance(license, str):
-                license = license.shortname
-            if license is None:
-                rc |= 1
-            print(f"{package_name}=={v}: {license or 'Unknown'}")
+        with Catalog() as catalog:
+            catalog.record_package(package)
+            for v, license in zip(selected_versions, licenses):
+                if license is not None and not isinstance(license, str):
+                    license = license.shortname
+                if license is None:
+                    rc |= 1
+                print(f"{package_name}=={v}: {license or 'Unknown'}")
+                catalog.record(package.name, v, license=license or "Unknown")
 
-    if rc != 0:
-        sys.exit(rc)
+        if rc != 0:
+            sys.exit(rc)
 
 
 @cli.command(help="Download an sdist, print path on stdout")
@@ -173,6 +465,7 @@ def license(verbose: bool, fresh: bool, nouse_json: bool, package_name: str) ->
 @click.option(
     "--index-url", help="Alternate index url (uses HONESTY_INDEX_URL or pypi by default"
 )
+@LINK_OPTION
 @click.argument("package_name")
 @wrap_async
 async def download(
@@ -181,6 +474,7 @@ async def download(
     nouse_json: bool,
     dest: str,
     index_url: Optional[str],
+    link: str,
     package_name: str,
 ) -> None:
     dest_path: Optional[Path]
@@ -199,7 +493,7 @@ async def download(
             click.echo(f"check {package_name} {selected_versions}")
 
         rc = await async_download_many(
-            package, versions=selected_versions, dest=dest_path, cache=cache
+            package, versions=selected_versions, dest=dest_path, cache=cache, link=link
         )
 
     sys.exit(rc)
@@ -213,6 +507,7 @@ async def download(
 @click.option(
     "--index-url", help="Alternate index url (uses HONESTY_INDEX_URL or pypi by default"
 )
+@LINK_OPTION
 @click.argument("package_name")
 @wrap_async
 async def extract(
@@ -221,6 +516,7 @@ async def extract(
     nouse_json: bool,
     dest: str,
     index_url: Optional[str],
+    link: str,
     package_name: str,
 ) -> None:
 
@@ -239,7 +535,9 @@ async def extract(
         if not sdists:
             raise click.ClickException(f"{package.name} no sdists")
 
-        lp = await cache.async_fetch(pkg=package_name, url=sdists[0].url)
+        lp = await cache.async_fetch(
+            pkg=package_name, url=sdists[0].url, checksum=sdists[0].checksum
+        )
 
         archive_root, _ = extract_and_get_names(
             lp, strip_top_level=True, patterns=("*.*",)
@@ -248,7 +546,7 @@ async def extract(
         subdirs = tuple(Path(archive_root).iterdir())
         if dest:
             for subdir in subdirs:
-                shutil.copytree(subdir, Path(dest, subdir.name))
+                link_tree(subdir, Path(dest, subdir.name), link)
         else:
             dest = archive_root
 
@@ -278,6 +576,8 @@ async def age(verbose: bool, fresh: bool, base: str, package_name: str,) -> None
     async with Cache(fresh_index=fresh) as cache:
         package_name, operator, version = package_name.partition("==")
         package = await async_parse_index(package_name, cache, use_json=True)
+        with Catalog() as catalog:
+            catalog.record_package(package)
         selected_versions = select_versions(package, operator, version)
         for v in selected_versions:
             t = min(x.upload_time for x in package.releases[v].files)
@@ -288,30 +588,225 @@ async def age(verbose: bool, fresh: bool, base: str, package_name: str,) -> None
             print(f"{v}\t{t.strftime('%Y-%m-%d')}\t{days:.2f}")
 
 
-def select_versions(package: Package, operator: str, selector: str) -> List[str]:
+@cli.command()
+@click.option(
+    "--from",
+    "from_file",
+    type=click.File("r"),
+    help="Only consider the packages in a requirements-style file ('-' for stdin)",
+)
+@click.argument("question", type=click.Choice(sorted(QUESTIONS)))
+@click.argument("arg", required=False)
+def query(from_file: Optional[IO[str]], question: str, arg: Optional[str]) -> None:
     """
-    Given operator='==' and selector='*' or '2.0', return a list of the matching
-    versions, in increasing order.
+    Answer questions from the catalog of previously run commands.
+
+    QUESTION is one of the choices above; "license" takes a LIKE pattern (say,
+    "%GPL%") and "older-than" a number of days as ARG.  Prints name==version
+    for each matching release, plus the license, upload time or check status
+    where relevant.
+
+    Only releases that list, check, native, ispep517, license or age have
+    seen (since their files last changed) are known.
     """
-    if not package.releases:
-        raise click.ClickException(f"No releases at all for {package.name}")
-
-    if operator not in ("", "=="):
-        raise click.ClickException("Only '==' is supported")
-
-    if selector == "":
-        # latest
-        version = sorted(package.releases, key=pkg_resources.parse_version)[-1]
-        return [version]
-    elif selector == "*":
-        versions: List[str] = sorted(package.releases, key=pkg_resources.parse_version)
-        return versions
-    else:
-        if selector not in package.releases:
-            raise click.ClickException(
-                f"The version {selector} does not exist for {package.name}"
+    wanted = None
+    if from_file is not None:
+        wanted = [
+            (name, version if op == "==" and version != "*" else None)
+            for name, op, version in parse_specs(from_file)
+        ]
+    with Catalog() as catalog:
+        try:
+            rows = catalog.query(question, arg, wanted)
+        except ValueError as e:
+            raise click.UsageError(str(e))
+    for name, version, extra in rows:
+        if extra is None:
+            print(f"{name}=={version}")
+        else:
+            print(f"{name}=={version}\t{extra}")
+
+
+@cli.command()
+@click.option("--concurrency", default=8, show_default=True)
+@click.argument("changes")
+@wrap_async
+async def sync(concurrency: int, changes: str) -> None:
+    """
+    Refresh cached indexes changed since they were fetched.
+
+    Refetches only the cached indexes whose serial is older than their entry
+    in CHANGES, a file or url of `name serial` lines (or changelog entries
+    `name version timestamp action serial`), and prints each one.
+    """
+    change_serials = await async_read_changes(changes)
+    async with Cache() as cache:
+        refreshed = await async_sync(cache, change_serials, concurrency)
+
+    rc = 0
+    for name, use_json, error in refreshed:
+        kind = "json" if use_json else "simple"
+        if error:
+            click.echo(f"{name} ({kind}): {error}", err=True)
+            rc |= 1
+        else:
+            print(f"{name} ({kind})")
+    if rc != 0:
+        sys.exit(rc)
+
+
+@cli.group()
+def scan() -> None:
+    """
+    Divide an audit among many workers.
+
+    `scan add QUEUE --from FILE` splits a package list into shards in QUEUE, a
+    SQLite file that every worker can reach.  Then run `scan work QUEUE` on as
+    many machines as you like; each worker claims shards under a lease that
+    it renews, so a crashed worker's shard is picked up again.
+    """
+
+
+@scan.command("add", help="Queue every package in a requirements-style file")
+@click.option("--from", "from_file", type=click.File("r"), required=True)
+@click.option(
+    "--tasks",
+    default="check",
+    show_default=True,
+    help="Comma-separated, from check, native and license",
+)
+@click.option("--shard-size", default=DEFAULT_SHARD_SIZE, show_default=True)
+@click.argument("queue_path")
+def scan_add(from_file: IO[str], tasks: str, shard_size: int, queue_path: str) -> None:
+    specs = ["".join(spec) for spec in parse_specs(from_file)]
+    with WorkQueue(queue_path) as queue:
+        try:
+            count = queue.add(specs, tasks.split(","), shard_size)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint="--tasks")
+    click.echo(f"{len(specs)} packages in {count} shards")
+
+
+@scan.command("work", help="Claim and run shards until the queue is finished")
+@click.option("--nouse_json", is_flag=True, type=bool)
+@click.option(
+    "--lease",
+    default=DEFAULT_LEASE,
+    show_default=True,
+    help="Seconds a shard is ours without renewal",
+)
+@click.option(
+    "--concurrency", default=8, show_default=True, help="Packages to run at once"
+)
+@click.option(
+    "--jobs", "-j", type=int, help="Processes used for hashing (default: cpu count)"
+)
+@WHEELS_OPTION
+@PROFILE_OPTION
+@METRICS_OPTION
+@click.argument("queue_path")
+@wrap_async
+async def scan_work(
+    nouse_json: bool,
+    lease: float,
+    concurrency: int,
+    jobs: Optional[int],
+    wheels: WheelSelection,
+    profile: Optional[str],
+    metrics_file: Optional[str],
+    queue_path: str,
+) -> None:
+    with profiling(profile), exporting_metrics(metrics_file), WorkQueue(
+        queue_path
+    ) as queue:
+        async with Cache() as cache:
+            with ProcessPoolExecutor(jobs) as pool:
+                runner = shard_runner(
+                    cache,
+                    pool,
+                    ResultCache(),
+                    wheels,
+                    use_json=not nouse_json,
+                    concurrency=concurrency,
+                )
+                completed = await async_work(queue, runner, lease=lease)
+    click.echo(f"{completed} shards completed", err=True)
+
+
+@scan.command("status", help="Count shards by state, and show failed ones")
+@click.argument("queue_path")
+def scan_status(queue_path: str) -> None:
+    with WorkQueue(queue_path) as queue:
+        for state, n in queue.status().items():
+            print(f"{state}\t{n}")
+        for shard, error in queue.failures():
+            click.echo(f"shard {shard.id} ({shard.specs[0]}...): {error}", err=True)
+
+
+@scan.command("results", help="Print the results so far as json lines")
+@click.argument("queue_path")
+def scan_results(queue_path: str) -> None:
+    rc = 0
+    with WorkQueue(queue_path) as queue:
+        for spec, task, result_rc, result in queue.results():
+            rc |= result_rc
+            print(json.dumps({"spec": spec, "task": task, **result}, sort_keys=True))
+    if rc != 0:
+        sys.exit(rc)
+
+
+@cli.command(help="Serve check/list/license/native/age as json over http, and /metrics")
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", default=8080, show_default=True)
+@click.option("--socket", "socket_path", help="Listen on this unix socket instead")
+@click.option(
+    "--index-ttl",
+    default=DEFAULT_INDEX_TTL,
+    show_default=True,
+    help="Seconds to reuse a parsed index before fetching it again",
+)
+@click.option(
+    "--concurrency", default=8, show_default=True, help="Versions to check at once"
+)
+@click.option(
+    "--jobs", "-j", type=int, help="Processes used for hashing (default: cpu count)"
+)
+@WHEELS_OPTION
+def serve(
+    host: str,
+    port: int,
+    socket_path: Optional[str],
+    index_ttl: float,
+    concurrency: int,
+    jobs: Optional[int],
+    wheels: WheelSelection,
+) -> None:
+    metrics = Metrics()
+    subscribe(metrics)
+
+    with ProcessPoolExecutor(jobs) as pool:
+
+        async def make_app() -> web.Application:
+            # Made on run_app's loop, which the cache's session must use.
+            # The in-memory ttl decides when an index is stale, so always
+            # refetch.
+            cache = Cache(fresh_index=True)
+
+            async def closing_cache(app: web.Application) -> AsyncIterator[None]:
+                yield
+                await cache.close()
+
+            server = Server(
+                cache, index_ttl, concurrency, pool, ResultCache(), wheels, metrics
             )
-        return [selector]
+            app = server.app()
+            app.cleanup_ctx.append(closing_cache)
+            return app
+
+        if socket_path:
+            web.run_app(make_app(), path=socket_path)
+        else:
+            web.run_app(make_app(), host=host, port=port)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,173 @@
+"""
+Decompression backends for sdist tarballs.
+
+The stdlib's gzip and bz2 are single-threaded and not the fastest; when a
+faster implementation is installed (python-isal or zlib-ng for gzip, or a
+`pigz`/`lbzip2` binary to pipe through) we use it instead.  Pick one with
+`HONESTY_DECOMPRESS=<name>`, or leave it at "auto" for the first available.
+"""
+
+import abc
+import importlib
+import os
+import shutil
+import subprocess
+from contextlib import contextmanager
+from pathlib import Path
+from typing import IO, Callable, ContextManager, Iterator, List, Optional, Tuple
+
+DEFAULT_BACKEND = os.environ.get("HONESTY_DECOMPRESS", "auto")
+
+PIPE_BUFFER_SIZE = 1024 * 1024
+
+GZIP_EXTENSIONS = (".tar.gz", ".tgz")
+BZ2_EXTENSIONS = (".tar.bz2", ".tbz2")
+
+
+class Backend(abc.ABC):
+    """
+    Something that can turn a compressed file into a stream of its contents.
+    """
+
+    def __init__(self, name: str, extensions: Tuple[str, ...]) -> None:
+        self.name = name
+        self.extensions = extensions
+
+    def __repr__(self) -> str:
+        return f"<{type(self).__name__} {self.name}>"
+
+    @abc.abstractmethod
+    def available(self) -> bool:
+        """
+        Whether it can be used here (the module is installed, or the binary
+        is on $PATH).
+        """
+
+    @abc.abstractmethod
+    def open(self, path: Path) -> ContextManager[IO[bytes]]:
+        """
+        Opens path for reading its decompressed contents.
+        """
+
+
+class ModuleBackend(Backend):
+    """
+    A gzip-module-alike, where `module.open(path, "rb")` works.
+    """
+
+    def __init__(self, name: str, extensions: Tuple[str, ...], module: str) -> None:
+        super().__init__(name, extensions)
+        self.module = module
+
+    def available(self) -> bool:
+        try:
+            importlib.import_module(self.module)
+        except ImportError:
+            return False
+        return True
+
+    @contextmanager
+    def open(self, path: Path) -> Iterator[IO[bytes]]:
+        opener: Callable[..., IO[bytes]] = importlib.import_module(self.module).open
+        with opener(path, "rb") as f:
+            yield f
+
+
+class PipeBackend(Backend):
+    """
+    Decompresses in a subprocess, which also moves the work off this core.
+    """
+
+    def __init__(self, name: str, extensions: Tuple[str, ...], argv: List[str]) -> None:
+        super().__init__(name, extensions)
+        self.argv = argv
+
+    def available(self) -> bool:
+        return shutil.which(self.argv[0]) is not None
+
+    @contextmanager
+    def open(self, path: Path) -> Iterator[IO[bytes]]:
+        proc = subprocess.Popen(
+            [*self.argv, str(path)],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            bufsize=PIPE_BUFFER_SIZE,
+        )
+        assert proc.stdout is not None and proc.stderr is not None
+        try:
+            yield proc.stdout
+            # tarfile stops at the end-of-archive marker; read the padding so
+            # the child doesn't die of SIGPIPE.
+            while proc.stdout.read(PIPE_BUFFER_SIZE):
+                pass
+        except BaseException:
+            proc.kill()
+            raise
+        finally:
+            proc.stdout.close()
+            err = proc.stderr.read()
+            proc.stderr.close()
+            rc = proc.wait()
+        if rc != 0:
+            raise OSError(f"{self.name} exited {rc}: {err.decode(errors='replace')}")
+
+
+STDLIB_GZIP = ModuleBackend("stdlib", GZIP_EXTENSIONS, "gzip")
+STDLIB_BZ2 = ModuleBackend("stdlib", BZ2_EXTENSIONS, "bz2")
+
+# In "auto" preference order; the stdlib ones are always available.
+BACKENDS: List[Backend] = [
+    ModuleBackend("isal", GZIP_EXTENSIONS, "isal.igzip"),
+    ModuleBackend("zlib_ng", GZIP_EXTENSIONS, "zlib_ng.gzip_ng"),
+    PipeBackend("pigz", GZIP_EXTENSIONS, ["pigz", "-dc"]),
+    PipeBackend("lbzip2", BZ2_EXTENSIONS, ["lbzip2", "-dc"]),
+    STDLIB_GZIP,
+    STDLIB_BZ2,
+]
+
+
+def is_compressed_tar(path: Path) -> bool:
+    return path.name.endswith(GZIP_EXTENSIONS + BZ2_EXTENSIONS)
+
+
+def available_backends(path: Path) -> List[Backend]:
+    """
+    The installed backends that can handle path, in preference order.
+    """
+    return [b for b in BACKENDS if path.name.endswith(b.extensions) and b.available()]
+
+
+def choose_backend(path: Path, name: Optional[str] = None) -> Backend:
+    """
+    The backend `name` (default HONESTY_DECOMPRESS), or for "auto" the fastest
+    installed one.  Files that backend doesn't handle (pigz and .tar.bz2, say)
+    get the stdlib.  Raises ValueError for an unknown or uninstalled backend.
+    """
+    name = name or DEFAULT_BACKEND
+    if name != "auto":
+        named = [b for b in BACKENDS if b.name == name]
+        if not named:
+            raise ValueError(f"Unknown decompression backend {name!r}")
+        if not any(b.available() for b in named):
+            raise ValueError(f"Decompression backend {name!r} is not installed")
+
+    candidates = available_backends(path)
+    if not candidates:
+        raise ValueError(f"Not a compressed tarball: {path.name}")
+    if name == "auto":
+        return candidates[0]
+    for b in candidates:
+        if b.name == name:
+            return b
+    return candidates[-1]  # stdlib
+
+
+@contextmanager
+def open_decompressed(path: Path, backend: Optional[str] = None) -> Iterator[IO[bytes]]:
+    """
+    Yields a (not necessarily seekable) stream of the decompressed contents
+    of the .tar.gz or .tar.bz2 at path.
+    """
+    with choose_backend(path, backend).open(path) as f:
+        yield f
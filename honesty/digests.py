@@ -0,0 +1,120 @@
+"""
+A persistent store of the hashes archive_hashes computes, shared by every
+archive of every package.
+
+Consecutive versions of a package share most of their .py files, so most
+members of a wheel have been seen before.  Each zip member is keyed by the
+sha256 of its compressed bytes, which is several times cheaper to compute
+than inflating and hashing it, and members with a known key aren't
+decompressed at all.
+
+The key is a digest of the bytes rather than the CRC and size from the zip's
+directory: those are chosen by whoever built the wheel, and a crafted member
+could otherwise borrow the hash of an honest one from an earlier release.
+Tar members can't be found without decompressing the whole stream, so sdists
+are always hashed in full.
+"""
+
+import hashlib
+import os
+import struct
+import zipfile
+from pathlib import Path
+from typing import IO, Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .storage import connect
+
+DEFAULT_DIGESTS = "~/.cache/honesty/digests.sqlite3"
+
+# Bump when what's stored changes meaning (say, a different normalization in
+# archive_hashes), so old entries are ignored.
+KEY_VERSION = b"1"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS digests (
+    key BLOB PRIMARY KEY,
+    sha1 TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+# SQLite's limit on parameters is 999 in older versions.
+LOOKUP_BATCH = 500
+
+LOCAL_HEADER = struct.Struct("<4s22xHH")
+LOCAL_HEADER_MAGIC = b"PK\x03\x04"
+
+
+class DigestStore:
+    def __init__(self, path: str) -> None:
+        self.path = Path(path).expanduser()
+        self.conn = connect(self.path, wal=True)
+        self.conn.executescript(SCHEMA)
+
+    def __enter__(self) -> "DigestStore":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def get_many(self, keys: Sequence[bytes]) -> Dict[bytes, str]:
+        found: Dict[bytes, str] = {}
+        for i in range(0, len(keys), LOOKUP_BATCH):
+            batch = keys[i : i + LOOKUP_BATCH]
+            marks = ",".join("?" * len(batch))
+            found.update(
+                self.conn.execute(
+                    f"SELECT key, sha1 FROM digests WHERE key IN ({marks})", batch
+                )
+            )
+        return found
+
+    def put_many(self, items: Iterable[Tuple[bytes, str]]) -> None:
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO digests (key, sha1) VALUES (?, ?)", items
+            )
+
+
+def open_store(path: Optional[str] = None) -> Optional[DigestStore]:
+    """
+    The store at path (default HONESTY_DIGESTS, or DEFAULT_DIGESTS), or None
+    when that's empty, which turns it off.
+    """
+    if path is None:
+        path = os.environ.get("HONESTY_DIGESTS", DEFAULT_DIGESTS)
+    if not path:
+        return None
+    return DigestStore(path)
+
+
+def zip_member_keys(
+    f: IO[bytes], infos: List[zipfile.ZipInfo]
+) -> List[Optional[bytes]]:
+    """
+    The store key of each member of the zip open as f, or None for one that
+    can't be read raw (encrypted, or a malformed header).
+    """
+    keys: List[Optional[bytes]] = []
+    for info in infos:
+        if info.flag_bits & 0x1:
+            keys.append(None)
+            continue
+        f.seek(info.header_offset)
+        header = f.read(LOCAL_HEADER.size)
+        if len(header) != LOCAL_HEADER.size:
+            keys.append(None)
+            continue
+        magic, name_len, extra_len = LOCAL_HEADER.unpack(header)
+        if magic != LOCAL_HEADER_MAGIC:
+            keys.append(None)
+            continue
+        f.seek(info.header_offset + LOCAL_HEADER.size + name_len + extra_len)
+        h = hashlib.sha256(KEY_VERSION)
+        # The same bytes mean the same contents only under the same method.
+        h.update(info.compress_type.to_bytes(2, "little"))
+        h.update(f.read(info.compress_size))
+        keys.append(h.digest())
+    return keys
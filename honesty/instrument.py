@@ -0,0 +1,124 @@
+"""
+Timing instrumentation.
+
+Cache, releases, archive and checker emit an Event for each phase of work
+(index fetch/parse, download, extract, hash, compare, and each whole check of a
+release) and for each cache hit or miss.  Library callers can subscribe() to
+see them; the cli aggregates them in a Profile for `--profile`, and in
+honesty.metrics for `--metrics-file` and `serve`'s /metrics.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+PHASES = (
+    "index_fetch",
+    "index_parse",
+    "download",
+    "extract",
+    "hash",
+    "compare",
+    "check",
+)
+COUNTERS = ("cache_hit", "cache_miss")
+
+
+@dataclass
+class Event:
+    name: str  # one of PHASES or COUNTERS
+    package: Optional[str] = None
+    filename: Optional[str] = None
+    seconds: float = 0.0
+    nbytes: int = 0
+    rc: Optional[int] = None  # the result of a "check"
+
+
+Subscriber = Callable[[Event], None]
+
+_subscribers: List[Subscriber] = []
+_local = threading.local()
+
+
+def subscribe(fn: Subscriber) -> None:
+    _subscribers.append(fn)
+
+
+def unsubscribe(fn: Subscriber) -> None:
+    _subscribers.remove(fn)
+
+
+def emit(event: Event) -> None:
+    captured: Optional[List[Event]] = getattr(_local, "captured", None)
+    if captured is not None:
+        captured.append(event)
+        return
+    for fn in _subscribers:
+        fn(event)
+
+
+def count(name: str, package: Optional[str], filename: Optional[str] = None) -> None:
+    emit(Event(name, package, filename))
+
+
+@contextmanager
+def timed(
+    name: str, package: Optional[str], filename: Optional[str] = None
+) -> Iterator[Event]:
+    """
+    Emits an Event with the elapsed time when the block exits normally.  The
+    block may set `nbytes` on the yielded event.
+    """
+    event = Event(name, package, filename)
+    t0 = time.monotonic()
+    yield event
+    event.seconds = time.monotonic() - t0
+    emit(event)
+
+
+def call_collecting(fn: Callable[..., T], *args: Any) -> Tuple[T, List[Event]]:
+    """
+    Calls fn, returning its result and the events it emitted instead of
+    dispatching them.  This is intended to be what runs in an executor (events
+    from another process would otherwise be lost); pass the events to emit()
+    back on the calling side.
+    """
+    _local.captured = []
+    try:
+        return fn(*args), _local.captured
+    finally:
+        _local.captured = None
+
+
+class Profile:
+    """
+    A subscriber that totals events by name.
+    """
+
+    def __init__(self) -> None:
+        # [name] = [count, seconds, nbytes]
+        self.totals: Dict[str, List[float]] = {}
+
+    def __call__(self, event: Event) -> None:
+        t = self.totals.setdefault(event.name, [0, 0.0, 0])
+        t[0] += 1
+        t[1] += event.seconds
+        t[2] += event.nbytes
+
+    def as_json(self) -> Dict[str, Dict[str, float]]:
+        return {
+            k: {"count": int(c), "seconds": s, "bytes": int(b)}
+            for k, (c, s, b) in self.totals.items()
+        }
+
+    def table(self) -> str:
+        lines = [f"{'phase':<12} {'count':>8} {'seconds':>10} {'bytes':>14}"]
+        for name in PHASES + COUNTERS:
+            if name in self.totals:
+                c, s, b = self.totals[name]
+                lines.append(f"{name:<12} {int(c):>8} {s:>10.3f} {int(b):>14}")
+        return "\n".join(lines)
@@ -0,0 +1,81 @@
+"""
+Populating destinations from the cache without copying bytes, where the
+filesystem allows it.
+
+"auto" only uses a reflink, whose copy-on-write keeps the source safe, and
+otherwise copies.  With "hardlink" or "symlink" (which must be asked for) the
+destination shares its contents with the cache, or a local mirror; modifying a
+file in place modifies that too.
+"""
+
+import errno
+import os
+import shutil
+import sys
+from pathlib import Path
+
+STRATEGIES = ("auto", "reflink", "hardlink", "symlink", "copy")
+
+# From linux/fs.h
+FICLONE = 0x40049409
+
+
+def reflink(src: Path, dst: Path) -> None:
+    """
+    Makes dst a copy-on-write clone of src, or raises OSError if the platform
+    or filesystem can't.
+    """
+    if not sys.platform.startswith("linux"):
+        raise OSError(errno.EOPNOTSUPP, "reflink is only implemented on linux")
+
+    import fcntl
+
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        except OSError:
+            d.close()
+            os.unlink(dst)
+            raise
+
+
+def link_file(src: Path, dst: Path, strategy: str = "auto") -> str:
+    """
+    Makes dst have the contents of src using `strategy`, replacing dst if it
+    exists.  For "auto", tries reflink, then copy.  Returns the strategy
+    actually used.
+    """
+    if os.path.lexists(dst):
+        os.unlink(dst)
+
+    if strategy == "auto":
+        try:
+            return link_file(src, dst, "reflink")
+        except OSError:
+            strategy = "copy"
+
+    if strategy == "reflink":
+        reflink(src, dst)
+    elif strategy == "hardlink":
+        os.link(src, dst)
+    elif strategy == "symlink":
+        os.symlink(os.path.abspath(src), dst)
+    elif strategy == "copy":
+        shutil.copy2(src, dst)
+    else:
+        raise ValueError(f"Unknown link strategy {strategy!r}")
+    return strategy
+
+
+def link_tree(src: Path, dst: Path, strategy: str = "auto") -> None:
+    """
+    Like shutil.copytree, but each file is populated with link_file.  For
+    "auto", whatever works for the first file is used for the rest.
+    """
+    chosen = strategy
+
+    def link(s: str, d: str) -> None:
+        nonlocal chosen
+        chosen = link_file(Path(s), Path(d), chosen)
+
+    shutil.copytree(src, dst, copy_function=link)
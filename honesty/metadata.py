@@ -0,0 +1,132 @@
+"""
+Core metadata (PEP 658 .metadata files), for answering questions that don't
+need the whole artifact.
+
+Indexes that support it advertise the file with a `data-dist-info-metadata`
+(or, since PEP 714, `data-core-metadata`) attribute on the link, whose value
+is "true" or a hash of the metadata file.
+"""
+
+import email.parser
+import hashlib
+from dataclasses import dataclass, field
+from typing import List, Optional, Union
+
+from infer_license.api import guess_text
+from infer_license.types import License
+
+from .cache import Cache, ChecksumMismatch, read_cached
+from .releases import FileEntry, FileType, Package, PackageRelease
+
+# Below this, the License field is a name ("MIT"); above, the license text.
+LICENSE_TEXT_LENGTH = 200
+
+
+class MetadataMismatch(Exception):
+    pass
+
+
+@dataclass
+class CoreMetadata:
+    name: str
+    version: str
+    summary: Optional[str] = None
+    license: Optional[str] = None
+    license_expression: Optional[str] = None
+    requires_python: Optional[str] = None
+    requires_dist: List[str] = field(default_factory=list)
+    classifiers: List[str] = field(default_factory=list)
+
+    def license_hint(self) -> Union[License, str, None]:
+        """
+        What the metadata claims the license is, preferring an SPDX
+        License-Expression, then the License field, then a classifier.
+        """
+        if self.license_expression:
+            return self.license_expression
+        text = (self.license or "").strip()
+        if text and text.upper() != "UNKNOWN":
+            if len(text) > LICENSE_TEXT_LENGTH:
+                return guess_text(text) or "Present but unknown"
+            return text
+        for c in self.classifiers:
+            parts = [p.strip() for p in c.split("::")]
+            if parts[0] == "License" and len(parts) > 2:
+                return parts[-1]
+        return None
+
+
+def parse_metadata(data: bytes) -> CoreMetadata:
+    msg = email.parser.BytesParser().parsebytes(data)
+    return CoreMetadata(
+        name=msg.get("Name", ""),
+        version=msg.get("Version", ""),
+        summary=msg.get("Summary"),
+        license=msg.get("License"),
+        license_expression=msg.get("License-Expression"),
+        requires_python=msg.get("Requires-Python"),
+        requires_dist=msg.get_all("Requires-Dist") or [],
+        classifiers=msg.get_all("Classifier") or [],
+    )
+
+
+def _matches(data: bytes, checksum: str) -> bool:
+    algo, _, expected = checksum.partition("=")
+    return hashlib.new(algo, data).hexdigest() == expected
+
+
+async def async_fetch_metadata(
+    pkg: str, fe: FileEntry, cache: Cache
+) -> Optional[CoreMetadata]:
+    """
+    Fetches and parses the .metadata file for fe, if the index advertised one,
+    storing it as fe.core_metadata (and filling in fe.requires_python if the
+    index didn't give it).  Returns None if there isn't one.
+    """
+    if fe.core_metadata is not None:
+        return fe.core_metadata
+    if not fe.metadata:
+        return None
+
+    url = f"{fe.url}.metadata"
+    checksum = fe.metadata if "=" in fe.metadata else None
+    try:
+        # Verified as it downloads, so a bad one is never cached.
+        path = await cache.async_fetch(pkg, url=url, checksum=checksum)
+        data = await cache.run_io(read_cached, path)
+        if checksum is not None and not _matches(data, checksum):
+            # Cached before downloads were verified (or from a local mirror).
+            path = await cache.async_fetch(pkg, url=url, fresh=True, checksum=checksum)
+            data = await cache.run_io(read_cached, path)
+    except ChecksumMismatch as e:
+        raise MetadataMismatch(f"{fe.basename}.metadata {e.actual}")
+    if checksum is not None and not _matches(data, checksum):
+        algo = checksum.partition("=")[0]
+        actual = hashlib.new(algo, data).hexdigest()
+        raise MetadataMismatch(f"{fe.basename}.metadata {algo}={actual}")
+
+    fe.core_metadata = parse_metadata(data)
+    if fe.requires_python is None:
+        fe.requires_python = fe.core_metadata.requires_python
+    return fe.core_metadata
+
+
+async def async_release_metadata(
+    package: Package, version: str, cache: Cache
+) -> Optional[CoreMetadata]:
+    """
+    Metadata for *a* file of the release that has it (wheels first, since
+    sdist metadata is only trustworthy for Metadata-Version 2.2+), or None.
+    """
+    rel: Optional[PackageRelease] = package.releases.get(version)
+    if rel is None:
+        return None
+    files = sorted(
+        (f for f in rel.files if f.metadata),
+        key=lambda f: f.file_type != FileType.BDIST_WHEEL,
+    )
+    for fe in files:
+        md = await async_fetch_metadata(package.name, fe, cache)
+        if md is not None:
+            return md
+    return None
@@ -0,0 +1,179 @@
+"""
+Counters and histograms for monitoring, kept from the instrumentation events.
+
+A Metrics subscribed with honesty.instrument.subscribe() counts cache hits and
+misses, bytes and time per phase (index fetch, download, extract, hash, ...),
+and check results by bit of their exit status.  render() gives them in the
+Prometheus text format, which `honesty serve` answers on GET /metrics and
+batch commands with `--metrics-file` write out periodically (atomically, so
+that something like node_exporter's textfile collector can pick it up).
+"""
+
+import bisect
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence
+
+from .instrument import COUNTERS, PHASES, Event
+from .storage import write_atomically
+
+# Upper bounds of the histogram buckets, in seconds; hashing a small wheel
+# takes milliseconds, fetching a large sdist from a slow mirror minutes.
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0)
+# Bits of a check's rc, as documented in the README (2 is reserved).
+RC_BITS = (1, 4, 8)
+DEFAULT_DUMP_INTERVAL = 15.0  # seconds
+
+
+def _number(x: float) -> str:
+    return repr(float(x))
+
+
+class Metrics:
+    """
+    A subscriber that keeps running totals of events.  Events may arrive from
+    any thread.
+    """
+
+    def __init__(self, buckets: Sequence[float] = BUCKETS) -> None:
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # [phase] = count per bucket, the last being +Inf (not cumulative)
+        self._histograms: Dict[str, List[int]] = {}
+        self._seconds: Dict[str, float] = {}
+        self._bytes: Dict[str, int] = {}
+        # [name] = count, for COUNTERS
+        self._counts: Dict[str, int] = {}
+        self._checks = 0
+        # [bit] = checks whose rc had it set
+        self._rc_bits: Dict[int, int] = {}
+
+    def __call__(self, event: Event) -> None:
+        with self._lock:
+            if event.name in COUNTERS:
+                self._counts[event.name] = self._counts.get(event.name, 0) + 1
+                return
+
+            hist = self._histograms.get(event.name)
+            if hist is None:
+                hist = self._histograms[event.name] = [0] * (len(self.buckets) + 1)
+            hist[bisect.bisect_left(self.buckets, event.seconds)] += 1
+            self._seconds[event.name] = self._seconds.get(event.name, 0.0) + (
+                event.seconds
+            )
+            self._bytes[event.name] = self._bytes.get(event.name, 0) + event.nbytes
+
+            if event.name == "check" and event.rc is not None:
+                self._checks += 1
+                for bit in RC_BITS:
+                    if event.rc & bit:
+                        self._rc_bits[bit] = self._rc_bits.get(bit, 0) + 1
+
+    def hit_ratio(self) -> Optional[float]:
+        """
+        The fraction of Cache.async_fetch calls answered from the cache, or
+        None before there have been any.
+        """
+        hits = self._counts.get("cache_hit", 0)
+        total = hits + self._counts.get("cache_miss", 0)
+        return hits / total if total else None
+
+    def render(self) -> str:
+        """
+        Everything so far, in the Prometheus text exposition format.
+        """
+        with self._lock:
+            lines = [
+                "# HELP honesty_cache_requests_total Cache.async_fetch calls "
+                "by whether the file was already cached.",
+                "# TYPE honesty_cache_requests_total counter",
+            ]
+            for name in COUNTERS:
+                result = name[len("cache_") :]
+                lines.append(
+                    f'honesty_cache_requests_total{{result="{result}"}} '
+                    f"{self._counts.get(name, 0)}"
+                )
+            ratio = self.hit_ratio()
+            if ratio is not None:
+                lines += [
+                    "# HELP honesty_cache_hit_ratio Fraction of "
+                    "Cache.async_fetch calls that were hits.",
+                    "# TYPE honesty_cache_hit_ratio gauge",
+                    f"honesty_cache_hit_ratio {_number(ratio)}",
+                ]
+
+            phases = [p for p in PHASES if p in self._histograms]
+            lines += [
+                "# HELP honesty_phase_seconds Time spent in each phase of work.",
+                "# TYPE honesty_phase_seconds histogram",
+            ]
+            for phase in phases:
+                cumulative = 0
+                for bound, n in zip(self.buckets + (None,), self._histograms[phase]):
+                    cumulative += n
+                    le = "+Inf" if bound is None else _number(bound)
+                    lines.append(
+                        f'honesty_phase_seconds_bucket{{phase="{phase}",le="{le}"}} '
+                        f"{cumulative}"
+                    )
+                lines += [
+                    f'honesty_phase_seconds_sum{{phase="{phase}"}} '
+                    f"{_number(self._seconds[phase])}",
+                    f'honesty_phase_seconds_count{{phase="{phase}"}} {cumulative}',
+                ]
+            lines += [
+                "# HELP honesty_phase_bytes_total Bytes fetched, extracted or "
+                "hashed in each phase.",
+                "# TYPE honesty_phase_bytes_total counter",
+            ]
+            for phase in phases:
+                lines.append(
+                    f'honesty_phase_bytes_total{{phase="{phase}"}} '
+                    f"{self._bytes[phase]}"
+                )
+
+            lines += [
+                "# HELP honesty_checks_total Releases checked.",
+                "# TYPE honesty_checks_total counter",
+                f"honesty_checks_total {self._checks}",
+                "# HELP honesty_check_rc_bits_total Releases checked whose exit "
+                "status had this bit set.",
+                "# TYPE honesty_check_rc_bits_total counter",
+            ]
+            for bit in RC_BITS:
+                lines.append(
+                    f'honesty_check_rc_bits_total{{bit="{bit}"}} '
+                    f"{self._rc_bits.get(bit, 0)}"
+                )
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path: str) -> None:
+        """
+        Writes render() to path, replacing it atomically.
+        """
+        write_atomically(path, self.render())
+
+
+@contextmanager
+def dumping(
+    metrics: Metrics, path: str, interval: float = DEFAULT_DUMP_INTERVAL
+) -> Iterator[None]:
+    """
+    Dumps metrics to path every `interval` seconds while in the block, and
+    once more as it exits.
+    """
+    stop = threading.Event()
+
+    def run() -> None:
+        while not stop.wait(interval):
+            metrics.dump(path)
+
+    thread = threading.Thread(target=run, name="honesty-metrics", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+        metrics.dump(path)
@@ -0,0 +1,121 @@
+"""
+Choosing between index mirrors by how they've been doing.
+
+A Cache can be given several mirrors of the same index (a local bandersnatch
+and PyPI, say, or PyPI through proxies in two regions).  The same path under
+each mirror's simple, json or packages root is assumed to be the same thing,
+so any fetch can go to any of them; it starts on the one with the best recent
+latency and throughput (see Cache._race for the hedging).
+"""
+
+import urllib.parse
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+
+# Where pypi.org's simple pages point; other mirrors are expected to keep
+# archives next to their index, like bandersnatch's web/packages/.
+PYPI_FILES_URL = "https://files.pythonhosted.org/packages/"
+# Weight of the newest sample in the moving averages.
+EWMA_WEIGHT = 0.3
+# Scores are the expected seconds to fetch this much, so that both latency
+# and throughput count.
+TYPICAL_BYTES = 256 * 1024
+# Smaller bodies are mostly latency, and say little about throughput.
+MIN_THROUGHPUT_BYTES = 64 * 1024
+# Counted as the latency of a request that failed outright.
+FAILURE_PENALTY = 30.0  # seconds
+
+
+def _ewma(old: Optional[float], sample: float) -> float:
+    return sample if old is None else old + EWMA_WEIGHT * (sample - old)
+
+
+@dataclass
+class Mirror:
+    index_url: str  # simple index, ending in "/"
+    json_index_url: str  # json urls are ../pypi/<name>/json relative to this
+    files_url: str  # archives, ending in "/"
+    latency: Optional[float] = None  # seconds until response headers
+    throughput: Optional[float] = None  # bytes per second of body
+    fetches: int = 0
+    failures: int = 0
+
+    @classmethod
+    def from_urls(cls, index_url: str, json_index_url: str) -> "Mirror":
+        if urllib.parse.urlparse(index_url).hostname == "pypi.org":
+            files_url = PYPI_FILES_URL
+        else:
+            files_url = urllib.parse.urljoin(index_url, "../packages/")
+        return cls(index_url, json_index_url, files_url)
+
+    @property
+    def roots(self) -> Tuple[str, str, str]:
+        """
+        The simple, json and archive prefixes, in an order shared by every
+        mirror.
+        """
+        return (
+            self.index_url,
+            urllib.parse.urljoin(self.json_index_url, "../pypi/"),
+            self.files_url,
+        )
+
+    def score(self) -> float:
+        """
+        Expected seconds for a typical fetch; lower is better.  An untried
+        mirror is assumed to be perfect, so that each gets a chance.
+        """
+        seconds = self.latency or 0.0
+        if self.throughput:
+            seconds += TYPICAL_BYTES / self.throughput
+        return seconds
+
+    def record(self, latency: float, nbytes: int, seconds: float) -> None:
+        """
+        A successful fetch: `latency` until headers, then `seconds` for the
+        `nbytes` of body.
+        """
+        self.fetches += 1
+        self.latency = _ewma(self.latency, latency)
+        if nbytes >= MIN_THROUGHPUT_BYTES and seconds > 0:
+            self.throughput = _ewma(self.throughput, nbytes / seconds)
+
+    def record_failure(self, seconds: float = FAILURE_PENALTY) -> None:
+        """
+        A fetch that failed, or was still going after `seconds` when another
+        mirror won.
+        """
+        self.failures += 1
+        self.latency = _ewma(self.latency, seconds)
+
+
+def ranked(mirrors: Sequence[Mirror]) -> List[Mirror]:
+    """
+    Best first; ties (like all untried) keep their configured order.
+    """
+    return sorted(mirrors, key=lambda m: m.score())
+
+
+def find(url: str, mirrors: Sequence[Mirror]) -> Optional[Tuple[Mirror, int, str]]:
+    """
+    Returns (mirror, index into its roots, rest of the url) for the mirror
+    that url is on, or None.
+    """
+    for kind in range(3):
+        for m in mirrors:
+            root = m.roots[kind]
+            if url.startswith(root):
+                return m, kind, url[len(root) :]
+    return None
+
+
+def alternatives(url: str, mirrors: Sequence[Mirror]) -> List[str]:
+    """
+    The same url on each mirror, best first.  Urls that aren't on any of them
+    (an archive hosted elsewhere, say) have no alternatives.
+    """
+    found = find(url, mirrors) if len(mirrors) > 1 else None
+    if found is None:
+        return [url]
+    _, kind, rest = found
+    return [m.roots[kind] + rest for m in ranked(mirrors)]
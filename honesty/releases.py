@@ -2,13 +2,16 @@ import asyncio
 import enum
 import json
 import re
-import urllib.parse
 from dataclasses import dataclass
 from datetime import datetime, timezone
 from html.parser import HTMLParser
-from typing import Any, Dict, List, Optional, Tuple
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
 
-from .cache import Cache
+from .cache import Cache, read_cached
+from .instrument import timed
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .metadata import CoreMetadata
 
 # Apologies in advance, "parsing" html via regex
 CHECKSUM_RE = re.compile(
@@ -98,6 +101,9 @@ class FileEntry:
     requires_python: Optional[str] = None  # '>=3.6'
     python_version: Optional[str] = None  # 'py2.py3' or 'source'
     upload_time: Optional[datetime] = None
+    metadata: Optional[str] = None  # PEP 658, 'sha256=<foo>' or 'true'
+    # Filled in by metadata.async_fetch_metadata
+    core_metadata: Optional["CoreMetadata"] = None
     # TODO extract upload date?
 
     @classmethod
@@ -123,6 +129,7 @@ class FileEntry:
             file_type=guess_file_type(basename),
             version=guess_version(basename)[1],
             requires_python=d.get("data-requires-python"),
+            metadata=d.get("data-core-metadata") or d.get("data-dist-info-metadata"),
         )
 
     @classmethod
@@ -236,9 +243,10 @@ async def async_parse_index(
     if not use_json:
         # TODO: This preserves the input order, which is not based on proper
         # version comparisons.
-        with open(await cache.async_fetch(pkg, url=None)) as f:
+        data = read_cached(await cache.async_fetch(pkg, url=None))
+        with timed("index_parse", pkg):
             gatherer = LinkGatherer(strict)
-            gatherer.feed(f.read())
+            gatherer.feed(data.decode("utf-8"))
 
         for fe in gatherer.entries:
             v = fe.version
@@ -246,21 +254,19 @@ async def async_parse_index(
                 package.releases[v] = PackageRelease(version=v, files=[])
             package.releases[v].files.append(fe)
     else:
-        # This will redirect away from canonical name if they differ
-        # TODO: This doesn't obey environment variable, which we could
-        url = urllib.parse.urljoin(cache.json_index_url, f"../pypi/{pkg}/json")
-        with open(await cache.async_fetch(pkg, url=url)) as f:
-            obj = json.loads(f.read())
-
-        for k, release in obj["releases"].items():
-            package.releases[k] = PackageRelease(version=k, files=[])
-            for release_file in release:
-                try:
-                    package.releases[k].files.append(
-                        FileEntry.from_json(k, release_file)
-                    )
-                except UnexpectedFilename:
-                    if strict:
-                        raise
+        data = read_cached(await cache.async_fetch(pkg, url=cache.json_url(pkg)))
+
+        with timed("index_parse", pkg):
+            obj = json.loads(data)
+            for k, release in obj["releases"].items():
+                package.releases[k] = PackageRelease(version=k, files=[])
+                for release_file in release:
+                    try:
+                        package.releases[k].files.append(
+                            FileEntry.from_json(k, release_file)
+                        )
+                    except UnexpectedFilename:
+                        if strict:
+                            raise
 
     return package
@@ -0,0 +1,104 @@
+"""
+Timeouts, retries with backoff, and adaptive concurrency for Cache fetches.
+"""
+
+import asyncio
+import email.utils
+import os
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, Optional
+
+# Statuses that are worth trying again; anything else (404, say) is final.
+RETRY_STATUSES = frozenset({408, 429, 500, 502, 503, 504})
+
+
+@dataclass
+class RetryPolicy:
+    retries: int = 3
+    backoff: float = 0.5  # seconds, doubled each attempt
+    max_backoff: float = 30.0
+    max_retry_after: float = 300.0
+    connect_timeout: Optional[float] = 30.0
+    # Between chunks, not for the whole body, so large downloads are fine.
+    read_timeout: Optional[float] = 60.0
+
+    @classmethod
+    def from_env(cls) -> "RetryPolicy":
+        policy = cls()
+        if "HONESTY_RETRIES" in os.environ:
+            policy.retries = int(os.environ["HONESTY_RETRIES"])
+        if "HONESTY_TIMEOUT" in os.environ:
+            policy.connect_timeout = policy.read_timeout = float(
+                os.environ["HONESTY_TIMEOUT"]
+            )
+        return policy
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """
+        Seconds to wait before retry number `attempt` (0-based): exponential
+        with full jitter, or what the server asked for with Retry-After.
+        """
+        if retry_after is not None:
+            return min(retry_after, self.max_retry_after)
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Retry-After is either a number of seconds or an http-date.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+class AdaptiveLimiter:
+    """
+    Limits concurrent requests, with additive increase when they succeed and
+    multiplicative decrease when they fail or are throttled, so that a batch
+    scan settles near the most a mirror will tolerate.
+    """
+
+    def __init__(self, initial: int = 16, minimum: int = 1, maximum: int = 64) -> None:
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.active = 0
+        self._cond: Optional[asyncio.Condition] = None
+
+    def _condition(self) -> asyncio.Condition:
+        # Created lazily so that it belongs to the running loop.
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    async def __aenter__(self) -> "AdaptiveLimiter":
+        cond = self._condition()
+        async with cond:
+            while self.active >= int(self.limit):
+                await cond.wait()
+            self.active += 1
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        cond = self._condition()
+        async with cond:
+            self.active -= 1
+            cond.notify_all()
+
+    def success(self) -> None:
+        # Roughly +1 per `limit` successes
+        self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+
+    def failure(self) -> None:
+        self.limit = max(self.minimum, self.limit / 2)
@@ -0,0 +1,395 @@
+"""
+Dividing a large audit (say, every package on a mirror) among worker
+processes on many machines.
+
+The work queue is a SQLite database that every worker can reach: a local
+file for several processes on one machine, or one on a shared filesystem
+whose locking works.  `add` splits a package list into shards.  Each worker
+repeatedly claims a pending shard with a lease, renews the lease while it
+runs check/native/license on the shard's packages, and then writes the
+results and marks the shard done in one transaction.  If a worker dies, its
+lease runs out and another worker claims the shard again.  Results are only
+accepted from the lease's current holder, so each shard is recorded once.
+"""
+
+import asyncio
+import functools
+import json
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from concurrent.futures import Executor, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from .api import bounded_gather, select_versions
+from .batch import async_check_versions
+from .cache import Cache
+from .checker import ERROR_RC, ResultCache, async_guess_license, async_has_nativemodules
+from .releases import async_parse_index
+from .storage import connect
+from .wheels import EXHAUSTIVE, WheelSelection
+
+TASKS = ("check", "native", "license")
+DEFAULT_SHARD_SIZE = 20
+DEFAULT_LEASE = 600.0  # seconds
+# A shard whose lease has run out this many times is given up on, rather than
+# taking down worker after worker.
+MAX_ATTEMPTS = 3
+# How often an idle worker looks for expired leases while others still work.
+POLL_INTERVAL = 5.0  # seconds
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS shards (
+    id INTEGER PRIMARY KEY,
+    specs TEXT NOT NULL,
+    tasks TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    owner TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS shards_state ON shards (state, lease_until);
+CREATE TABLE IF NOT EXISTS results (
+    shard INTEGER NOT NULL,
+    spec TEXT NOT NULL,
+    task TEXT NOT NULL,
+    rc INTEGER NOT NULL,
+    result TEXT NOT NULL,
+    PRIMARY KEY (shard, spec, task)
+);
+"""
+
+# (spec, task, rc, json-friendly result)
+ResultRow = Tuple[str, str, int, Dict[str, Any]]
+
+
+@dataclass
+class Shard:
+    id: int
+    specs: List[str]  # "name" or "name==version"
+    tasks: List[str]  # some of TASKS
+
+
+def default_owner() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class WorkQueue:
+    def __init__(self, path: str) -> None:
+        self.path = Path(path).expanduser()
+        # Not WAL, which doesn't work over network filesystems.  Claims are
+        # short, but there may be many workers waiting for them.  async_work
+        # uses the connection from its own thread, one call at a time.
+        self.conn = connect(
+            self.path, timeout=60, isolation_level=None, check_same_thread=False
+        )
+        self.conn.executescript(SCHEMA)
+
+    def __enter__(self) -> "WorkQueue":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def _transaction(self) -> "_Transaction":
+        return _Transaction(self.conn)
+
+    def add(
+        self,
+        specs: Sequence[str],
+        tasks: Sequence[str] = ("check",),
+        shard_size: int = DEFAULT_SHARD_SIZE,
+    ) -> int:
+        """
+        Queues specs in shards of shard_size, returning how many shards.
+        """
+        for t in tasks:
+            if t not in TASKS:
+                raise ValueError(f"Unknown task {t!r}")
+        shards = [
+            (json.dumps(list(specs[i : i + shard_size])), ",".join(tasks))
+            for i in range(0, len(specs), shard_size)
+        ]
+        with self._transaction():
+            self.conn.executemany(
+                "INSERT INTO shards (specs, tasks) VALUES (?, ?)", shards
+            )
+        return len(shards)
+
+    def claim(
+        self, owner: str, lease: float, now: Optional[float] = None
+    ) -> Optional[Shard]:
+        """
+        Takes the first pending shard (or one whose lease ran out) for `lease`
+        seconds, or returns None if there isn't one right now.
+        """
+        now = time.time() if now is None else now
+        with self._transaction():
+            self.conn.execute(
+                "UPDATE shards SET state = 'failed', owner = NULL, "
+                "error = 'lease expired ' || attempts || ' times' "
+                "WHERE state = 'running' AND lease_until < ? AND attempts >= ?",
+                (now, MAX_ATTEMPTS),
+            )
+            row = self.conn.execute(
+                "SELECT id, specs, tasks FROM shards WHERE state = 'pending' "
+                "OR (state = 'running' AND lease_until < ?) ORDER BY id LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                return None
+            self.conn.execute(
+                "UPDATE shards SET state = 'running', owner = ?, lease_until = ?, "
+                "attempts = attempts + 1 WHERE id = ?",
+                (owner, now + lease, row[0]),
+            )
+        return Shard(row[0], json.loads(row[1]), row[2].split(","))
+
+    def renew(self, shard: Shard, owner: str, lease: float) -> bool:
+        """
+        Extends the lease, returning False if it's no longer ours.
+        """
+        with self._transaction():
+            cur = self.conn.execute(
+                "UPDATE shards SET lease_until = ? "
+                "WHERE id = ? AND owner = ? AND state = 'running'",
+                (time.time() + lease, shard.id, owner),
+            )
+        return cur.rowcount == 1
+
+    def complete(self, shard: Shard, owner: str, results: List[ResultRow]) -> bool:
+        """
+        Records the shard's results and marks it done, unless the lease is no
+        longer ours (then they're discarded and False is returned).
+        """
+        with self._transaction():
+            cur = self.conn.execute(
+                "UPDATE shards SET state = 'done', owner = NULL, error = NULL "
+                "WHERE id = ? AND owner = ? AND state = 'running'",
+                (shard.id, owner),
+            )
+            if cur.rowcount != 1:
+                return False
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO results (shard, spec, task, rc, result) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [
+                    (shard.id, spec, task, rc, json.dumps(result, sort_keys=True))
+                    for spec, task, rc, result in results
+                ],
+            )
+        return True
+
+    def release(self, shard: Shard, owner: str, error: str) -> None:
+        """
+        Gives a shard back after an unexpected error, to be tried again
+        unless it's used up its attempts.
+        """
+        with self._transaction():
+            self.conn.execute(
+                "UPDATE shards SET owner = NULL, lease_until = NULL, error = ?, "
+                "state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END "
+                "WHERE id = ? AND owner = ? AND state = 'running'",
+                (error, MAX_ATTEMPTS, shard.id, owner),
+            )
+
+    def status(self) -> Dict[str, int]:
+        counts = {"pending": 0, "running": 0, "done": 0, "failed": 0}
+        counts.update(
+            self.conn.execute("SELECT state, COUNT(*) FROM shards GROUP BY state")
+        )
+        return counts
+
+    def unfinished(self) -> int:
+        row = self.conn.execute(
+            "SELECT COUNT(*) FROM shards WHERE state IN ('pending', 'running')"
+        ).fetchone()
+        return int(row[0])
+
+    def results(self) -> Iterator[Tuple[str, str, int, Dict[str, Any]]]:
+        for spec, task, rc, result in self.conn.execute(
+            "SELECT spec, task, rc, result FROM results ORDER BY shard, spec, task"
+        ):
+            yield spec, task, rc, json.loads(result)
+
+    def failures(self) -> List[Tuple[Shard, str]]:
+        return [
+            (Shard(id, json.loads(specs), tasks.split(",")), error or "")
+            for id, specs, tasks, error in self.conn.execute(
+                "SELECT id, specs, tasks, error FROM shards "
+                "WHERE state = 'failed' ORDER BY id"
+            )
+        ]
+
+
+class _Transaction:
+    """
+    BEGIN IMMEDIATE, so that concurrent claims queue up on the write lock
+    rather than failing to upgrade a read lock.
+    """
+
+    def __init__(self, conn: sqlite3.Connection) -> None:
+        self.conn = conn
+
+    def __enter__(self) -> None:
+        self.conn.execute("BEGIN IMMEDIATE")
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+ShardRunner = Callable[[Shard], Awaitable[List[ResultRow]]]
+
+
+async def async_work(
+    queue: WorkQueue,
+    run_shard: ShardRunner,
+    owner: Optional[str] = None,
+    lease: float = DEFAULT_LEASE,
+    poll_interval: float = POLL_INTERVAL,
+) -> int:
+    """
+    Claims and runs shards until none are pending or running (waiting for
+    other workers' leases in case they die), returning how many this worker
+    completed.
+    """
+    owner = owner or default_owner()
+    completed = 0
+    loop = asyncio.get_event_loop()
+    # Queue calls can wait a long time for the lock, so they're made off the
+    # event loop; one thread keeps them from overlapping on the connection.
+    with ThreadPoolExecutor(1, thread_name_prefix="honesty-queue") as db:
+        while True:
+            shard = await loop.run_in_executor(db, queue.claim, owner, lease)
+            if shard is None:
+                if not await loop.run_in_executor(db, queue.unfinished):
+                    return completed
+                await asyncio.sleep(poll_interval)
+                continue
+
+            work = asyncio.ensure_future(run_shard(shard))
+            renewer = asyncio.ensure_future(_renew(queue, shard, owner, lease, db))
+            renewer.add_done_callback(functools.partial(_stop, work))
+            try:
+                results = await work
+            except asyncio.CancelledError:
+                if not renewer.done():
+                    raise
+                e = renewer.exception()
+                if e is not None:
+                    await loop.run_in_executor(
+                        db, queue.release, shard, owner, f"renewing lease: {e!r}"
+                    )
+                continue  # otherwise lost the lease; someone else has it now
+            except Exception as e:
+                await loop.run_in_executor(
+                    db, queue.release, shard, owner, str(e) or repr(e)
+                )
+                continue
+            finally:
+                renewer.cancel()
+            if await loop.run_in_executor(db, queue.complete, shard, owner, results):
+                completed += 1
+
+
+def _stop(work: "asyncio.Future[Any]", renewer: "asyncio.Future[None]") -> None:
+    # Whether the lease was lost or renewing it failed, stop working.
+    if not renewer.cancelled():
+        work.cancel()
+
+
+async def _renew(
+    queue: WorkQueue, shard: Shard, owner: str, lease: float, db: Executor
+) -> None:
+    """
+    Renews the lease every third of it, returning once it's no longer ours.
+    """
+    loop = asyncio.get_event_loop()
+    while True:
+        await asyncio.sleep(lease / 3)
+        if not await loop.run_in_executor(db, queue.renew, shard, owner, lease):
+            return
+
+
+def shard_runner(
+    cache: Cache,
+    executor: Optional[Executor] = None,
+    results: Optional[ResultCache] = None,
+    selection: WheelSelection = EXHAUSTIVE,
+    use_json: bool = True,
+    concurrency: int = 8,
+) -> ShardRunner:
+    """
+    Runs each task on every version selected by each of a shard's specs,
+    like the check/native/license commands do.  Errors for one package are
+    reported in its results (with ERROR_RC), not raised.
+    """
+
+    async def run_spec(spec: str, tasks: List[str]) -> List[ResultRow]:
+        package_name, operator, version = spec.partition("==")
+        try:
+            package = await async_parse_index(package_name, cache, use_json=use_json)
+            versions = select_versions(package, operator, version)
+        except Exception as e:
+            error = {"package": package_name, "error": str(e) or repr(e)}
+            return [(spec, task, ERROR_RC, error) for task in tasks]
+
+        rows: List[ResultRow] = []
+        for task in tasks:
+            result: Dict[str, Any] = {"package": package.name, "rc": 0}
+            try:
+                if task == "check":
+                    result = await async_check_versions(
+                        package, versions, cache, executor, results, None, selection
+                    )
+                elif task == "native":
+                    natives = {}
+                    for v in versions:
+                        natives[v] = await async_has_nativemodules(
+                            package, v, False, cache, executor
+                        )
+                        result["rc"] |= int(natives[v])
+                    result["versions"] = natives
+                else:
+                    licenses = {}
+                    for v in versions:
+                        lic = await async_guess_license(
+                            package, v, False, cache, executor
+                        )
+                        if lic is not None and not isinstance(lic, str):
+                            lic = lic.shortname
+                        if lic is None:
+                            result["rc"] |= 1
+                        licenses[v] = lic
+                    result["versions"] = licenses
+            except Exception as e:
+                result["rc"] |= ERROR_RC
+                result["error"] = str(e) or repr(e)
+            rows.append((spec, task, result["rc"], result))
+        return rows
+
+    async def run(shard: Shard) -> List[ResultRow]:
+        per_spec = await bounded_gather(
+            (run_spec(spec, shard.tasks) for spec in shard.specs), concurrency
+        )
+        return [row for rows in per_spec for row in rows]
+
+    return run
@@ -0,0 +1,196 @@
+"""
+A long-running server, so that repeated queries share one Cache (and its
+connection pool), parsed indexes, and warm extraction/result caches instead of
+cold-starting the cli each time.
+
+    GET /check/<spec>     same json as one line of `check --from`
+    GET /list/<package>
+    GET /license/<spec>
+    GET /native/<spec>
+    GET /age/<spec>
+
+where spec is `name`, `name==version` or `name==*`.  Concurrent identical
+requests share a single computation.  When given a Metrics, GET /metrics
+answers with it in the Prometheus text format.
+"""
+
+import asyncio
+import json
+import time
+from concurrent.futures import Executor
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+import click
+from aiohttp import web
+
+from .api import bounded_gather, dataclass_default, select_versions
+from .batch import async_check_versions
+from .cache import Cache, NotFound, canonical_name
+from .checker import ResultCache, async_guess_license, async_has_nativemodules
+from .metrics import Metrics
+from .releases import Package, async_parse_index
+from .wheels import EXHAUSTIVE, WheelSelection
+
+DEFAULT_INDEX_TTL = 300.0  # seconds
+
+Handler = Callable[[web.Request], Awaitable[web.Response]]
+
+
+class Server:
+    def __init__(
+        self,
+        cache: Cache,
+        index_ttl: float = DEFAULT_INDEX_TTL,
+        concurrency: int = 8,
+        executor: Optional[Executor] = None,
+        results: Optional[ResultCache] = None,
+        selection: WheelSelection = EXHAUSTIVE,
+        metrics: Optional[Metrics] = None,
+    ) -> None:
+        self.cache = cache
+        self.index_ttl = index_ttl
+        self.concurrency = concurrency
+        self.executor = executor
+        self.results = results
+        self.selection = selection
+        self.metrics = metrics
+        # [(name, use_json)] = (time parsed, package)
+        self._packages: Dict[Tuple[str, bool], Tuple[float, Package]] = {}
+        self._inflight: Dict[Hashable, "asyncio.Future[Any]"] = {}
+
+    async def coalesce(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Runs fn(), unless a call with the same key is already running, in which
+        case this waits for that one's result instead.
+        """
+        fut = self._inflight.get(key)
+        if fut is None:
+            fut = asyncio.ensure_future(fn())
+            self._inflight[key] = fut
+            fut.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # A client disconnecting shouldn't cancel the work for everyone else.
+        return await asyncio.shield(fut)
+
+    async def package(self, name: str, use_json: bool = True) -> Package:
+        key = (canonical_name(name), use_json)
+        entry = self._packages.get(key)
+        if entry is not None and time.monotonic() - entry[0] < self.index_ttl:
+            return entry[1]
+
+        async def parse() -> Package:
+            package = await async_parse_index(name, self.cache, use_json=use_json)
+            self._packages[key] = (time.monotonic(), package)
+            return package
+
+        result: Package = await self.coalesce(("index",) + key, parse)
+        return result
+
+    async def _selected(self, spec: str) -> Tuple[Package, List[str]]:
+        package_name, operator, version = spec.partition("==")
+        package = await self.package(package_name)
+        return package, select_versions(package, operator, version)
+
+    async def check(self, spec: str) -> Dict[str, Any]:
+        package, versions = await self._selected(spec)
+        return await async_check_versions(
+            package,
+            versions,
+            self.cache,
+            self.executor,
+            self.results,
+            selection=self.selection,
+        )
+
+    async def list(self, name: str) -> Dict[str, Any]:
+        package = await self.package(name)
+        return {"package": package.name, "releases": package.releases}
+
+    async def license(self, spec: str) -> Dict[str, Any]:
+        package, versions = await self._selected(spec)
+        licenses = await bounded_gather(
+            (
+                async_guess_license(package, v, False, self.cache, self.executor)
+                for v in versions
+            ),
+            self.concurrency,
+        )
+        return {
+            "package": package.name,
+            "versions": {
+                v: lic if lic is None or isinstance(lic, str) else lic.shortname
+                for v, lic in zip(versions, licenses)
+            },
+        }
+
+    async def native(self, spec: str) -> Dict[str, Any]:
+        package, versions = await self._selected(spec)
+        natives = await bounded_gather(
+            (
+                async_has_nativemodules(package, v, False, self.cache, self.executor)
+                for v in versions
+            ),
+            self.concurrency,
+        )
+        return {"package": package.name, "versions": dict(zip(versions, natives))}
+
+    async def age(self, spec: str) -> Dict[str, Any]:
+        package, versions = await self._selected(spec)
+        now = datetime.now(timezone.utc)
+        ages: Dict[str, Any] = {}
+        for v in versions:
+            times = [x.upload_time for x in package.releases[v].files if x.upload_time]
+            if not times:
+                # PyPI has releases with no files left.
+                ages[v] = None
+                continue
+            t = min(times)
+            diff = now - t
+            ages[v] = {
+                "upload_time": t.strftime("%Y-%m-%d"),
+                "days": diff.days + (diff.seconds / 86400.0),
+            }
+        return {"package": package.name, "versions": ages}
+
+    def _handler(self, name: str, fn: Callable[[str], Awaitable[Any]]) -> Handler:
+        async def handle(request: web.Request) -> web.Response:
+            arg = request.match_info["arg"]
+            try:
+                obj = await self.coalesce((name, arg), lambda: fn(arg))
+            except click.ClickException as e:
+                return web.json_response({"error": e.message}, status=404)
+            except NotFound as e:
+                return web.json_response({"error": str(e)}, status=404)
+            except Exception as e:
+                return web.json_response({"error": str(e) or repr(e)}, status=502)
+            return web.json_response(
+                obj,
+                dumps=lambda o: json.dumps(
+                    o, default=dataclass_default, sort_keys=True
+                ),
+            )
+
+        return handle
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        assert self.metrics is not None
+        return web.Response(
+            text=self.metrics.render(),
+            content_type="text/plain",
+            headers={"X-Prometheus-Format": "0.0.4"},
+        )
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.add_routes(
+            [
+                web.get("/check/{arg}", self._handler("check", self.check)),
+                web.get("/list/{arg}", self._handler("list", self.list)),
+                web.get("/license/{arg}", self._handler("license", self.license)),
+                web.get("/native/{arg}", self._handler("native", self.native)),
+                web.get("/age/{arg}", self._handler("age", self.age)),
+            ]
+        )
+        if self.metrics is not None:
+            app.add_routes([web.get("/metrics", self.handle_metrics)])
+        return app
@@ -0,0 +1,38 @@
+"""
+Files that several honesty processes may use at once: SQLite databases (the
+catalog, digest store and scan queue) and files replaced whole (stored
+verdicts, metrics dumps).
+"""
+
+import os
+import sqlite3
+from pathlib import Path
+from typing import Any, Union
+
+
+def connect(
+    path: Path, timeout: float = 30, wal: bool = False, **kwargs: Any
+) -> sqlite3.Connection:
+    """
+    Opens the database at path, creating its directory.  Other processes may
+    be writing too, so this waits up to `timeout` seconds for their locks
+    rather than failing.  `wal` lets readers carry on during a write, but
+    doesn't work over network filesystems.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn: sqlite3.Connection = sqlite3.connect(str(path), timeout=timeout, **kwargs)
+    if wal:
+        conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+def write_atomically(path: Union[str, Path], data: str) -> None:
+    """
+    Replaces path with data by renaming a temporary file over it, so readers
+    see the old contents or the new, never part.  Concurrent writers are
+    last-writer-wins.
+    """
+    tmp = f"{path}.{os.getpid()}"
+    with open(tmp, "w") as f:
+        f.write(data)
+    os.replace(tmp, path)
@@ -0,0 +1,94 @@
+"""
+Keeping cached indexes current by refreshing only what changed.
+
+Given a changelog (say, from PyPI's `changelog_since_serial`) or any list of
+`name serial` lines, an index is refetched only if it's cached and the serial
+it was fetched at (X-PyPI-Last-Serial) is older than the latest change, so the
+work is proportional to the changes rather than the size of the cache.
+"""
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import aiohttp
+
+from .api import bounded_gather
+from .cache import Cache
+
+
+def parse_changes(lines: Iterable[str]) -> Dict[str, int]:
+    """
+    Returns the highest serial per project name.  Each line is `name serial`,
+    or a changelog entry `name version timestamp action serial` (tab- or
+    space-separated); the first field is the name and the last the serial.
+    Blank lines and # comments are ignored.
+    """
+    changes: Dict[str, int] = {}
+    for line in lines:
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+        if "\t" in line:
+            fields = line.split("\t")
+        else:
+            fields = line.split()
+        name, serial = fields[0].strip(), int(fields[-1])
+        changes[name] = max(serial, changes.get(name, serial))
+    return changes
+
+
+async def async_read_changes(source: str) -> Dict[str, int]:
+    """
+    Reads changes from a local file or an http(s) url serving the same format.
+    """
+    if source.startswith(("http://", "https://")):
+        async with aiohttp.ClientSession(raise_for_status=True) as session:
+            async with session.get(source) as resp:
+                text = await resp.text()
+    else:
+        with open(source) as f:
+            text = f.read()
+    return parse_changes(text.splitlines())
+
+
+def stale_indexes(cache: Cache, changes: Dict[str, int]) -> List[Tuple[str, bool]]:
+    """
+    Returns (name, use_json) for each cached index document whose serial is
+    older than its change (or unknown, since it was cached before serials
+    were recorded).
+    """
+    stale = []
+    for name, serial in sorted(changes.items()):
+        for use_json in (False, True):
+            if not cache.is_index_cached(name, use_json):
+                continue
+            cached_serial = cache.index_serial(name, use_json)
+            if cached_serial is None or cached_serial < serial:
+                stale.append((name, use_json))
+    return stale
+
+
+async def async_sync(
+    cache: Cache, changes: Dict[str, int], concurrency: int = 8
+) -> List[Tuple[str, bool, Optional[str]]]:
+    """
+    Refetches the stale indexes, returning (name, use_json, error) for each,
+    where error is None if it was refreshed.  A project that's been removed
+    is dropped from the cache (and remembered as missing for a while).
+    """
+    if all(m.index_url.startswith("file:") for m in cache.mirrors):
+        # Local mirrors are read in place; there's nothing cached to refresh.
+        return []
+
+    async def refresh(name: str, use_json: bool) -> Tuple[str, bool, Optional[str]]:
+        try:
+            url = cache.json_url(name) if use_json else None
+            await cache.async_fetch(name, url, fresh=True)
+        except Exception as e:
+            return (name, use_json, str(e) or repr(e))
+        return (name, use_json, None)
+
+    # Reading the serials (and any layout migration) is blocking.
+    stale = await cache.run_io(stale_indexes, cache, changes)
+    return await bounded_gather(
+        (refresh(name, use_json) for name, use_json in stale), concurrency
+    )
@@ -1,3 +1,17 @@
 from .archive import ArchiveTest  # noqa: F401
+from .batch import BatchTest  # noqa: F401
 from .cache import CacheTest  # noqa: F401
+from .catalog import CatalogTest  # noqa: F401
+from .checker import CheckerTest  # noqa: F401
+from .decompress import DecompressTest  # noqa: F401
+from .instrument import InstrumentTest  # noqa: F401
+from .link import LinkTest  # noqa: F401
+from .metadata import MetadataTest  # noqa: F401
+from .metrics import MetricsTest  # noqa: F401
+from .mirrors import MirrorsTest  # noqa: F401
 from .releases import ReleasesTest  # noqa: F401
+from .retry import RetryTest  # noqa: F401
+from .scan import ScanTest  # noqa: F401
+from .server import ServerTest  # noqa: F401
+from .sync import SyncTest  # noqa: F401
+from .wheels import WheelsTest  # noqa: F401
@@ -1,13 +1,19 @@
+import io
 import os
 import os.path
 import shutil
+import tarfile
 import tempfile
+import time
 import unittest
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict
+from typing import Any, Dict, List
 from unittest import mock
 
 from honesty.archive import archive_hashes, extract_and_get_names
+from honesty.digests import DigestStore, open_store, zip_member_keys
 
 
 def create_test_archive(
@@ -99,6 +105,64 @@ class ArchiveTest(unittest.TestCase):
         finally:
             os.remove(archive)
 
+    def test_extract_shared(self) -> None:
+        archive = create_test_archive({"foo-0.1/setup.py": "setup()\n"}, "whl", "zip")
+        unpack_archive = shutil.unpack_archive
+        calls = []
+
+        def slow_unpack(*args: Any) -> None:
+            calls.append(args)
+            time.sleep(0.05)  # long enough for the others to pile up
+            unpack_archive(*args)
+
+        try:
+            with tempfile.TemporaryDirectory() as d:
+                # A partial tree from before, without a .done marker
+                stale = Path(d, archive.name)
+                stale.mkdir()
+                (stale / "half-written.py").write_text("")
+
+                with mock.patch.dict(os.environ, {"HONESTY_EXTDIR": d}), mock.patch(
+                    "honesty.archive.shutil.unpack_archive", slow_unpack
+                ):
+                    with ThreadPoolExecutor(4) as pool:
+                        results = list(
+                            pool.map(
+                                lambda i: extract_and_get_names(archive),
+                                range(4),
+                            )
+                        )
+
+                self.assertEqual(1, len(calls))
+                self.assertEqual(results[:1] * 4, results)
+                self.assertEqual(
+                    [os.path.join("foo-0.1", "setup.py")],
+                    [relname for relname, srckey in results[0][1]],
+                )
+                self.assertEqual(
+                    sorted(
+                        [
+                            archive.name,
+                            f"{archive.name}.done",
+                            f"{archive.name}.lock",
+                        ]
+                    ),
+                    sorted(os.listdir(d)),
+                )
+        finally:
+            os.remove(archive)
+
+    def test_extract_failure(self) -> None:
+        with tempfile.TemporaryDirectory() as d:
+            archive = Path(d, "foo-0.1.tar.gz")
+            archive.write_bytes(b"not a tarball")
+            ext = Path(d, "ext")
+            with mock.patch.dict(os.environ, {"HONESTY_EXTDIR": str(ext)}):
+                with self.assertRaises(Exception):
+                    extract_and_get_names(archive)
+            # Nothing that looks extracted, or done
+            self.assertEqual([f"{archive.name}.lock"], os.listdir(ext))
+
     def test_hashes(self) -> None:
         archive = create_test_archive(
             {
@@ -111,7 +175,13 @@ class ArchiveTest(unittest.TestCase):
         )
         try:
             with tempfile.TemporaryDirectory() as d:
-                with mock.patch("honesty.archive.os.environ.get", return_value=d):
+                with mock.patch.dict(
+                    os.environ,
+                    {
+                        "HONESTY_EXTDIR": d,
+                        "HONESTY_DIGESTS": os.path.join(d, "digests.sqlite3"),
+                    },
+                ):
                     hashes = archive_hashes(archive)
                     self.assertEqual(
                         {
@@ -127,3 +197,98 @@ class ArchiveTest(unittest.TestCase):
 
         finally:
             os.remove(archive)
+
+    def test_hashes_tar(self) -> None:
+        with tempfile.TemporaryDirectory() as d:
+            archive = Path(d, "foo-0.1.tar.gz")
+            with tarfile.open(archive, "w:gz") as tf:
+
+                def add(name: str, data: bytes = b"", **kwargs: Any) -> None:
+                    info = tarfile.TarInfo(name)
+                    info.size = len(data)
+                    for k, v in kwargs.items():
+                        setattr(info, k, v)
+                    tf.addfile(info, io.BytesIO(data))
+
+                add("./foo-0.1/setup.py", b"setup()\r\n")
+                add("foo-0.1/src/proj/__init__.py", b"x")
+                add(
+                    "foo-0.1/src/proj/alias.py",
+                    type=tarfile.SYMTYPE,
+                    linkname="__init__.py",
+                )
+                add("foo-0.1/README.txt", b"not hashed")
+                add(
+                    "foo-0.1/old.py",
+                    type=tarfile.LNKTYPE,
+                    linkname="foo-0.1/src/proj/__init__.py",
+                )
+                add("../evil.py", b"outside")
+                # A later duplicate wins, as when extracting
+                add("foo-0.1/src/proj/__init__.py", b"")
+
+            with mock.patch("honesty.archive.HASH_QUEUE_DEPTH", 1):
+                hashes = archive_hashes(archive, strip_top_level=True)
+            self.assertEqual(
+                {
+                    "setup.py": "f568932ab271783a0234a22ed902131b7dfef0a9",
+                    os.path.join(
+                        "proj", "__init__.py"
+                    ): "da39a3ee5e6b4b0d3255bfef95601890afd80709",
+                    # Links see the final __init__.py
+                    "old.py": "da39a3ee5e6b4b0d3255bfef95601890afd80709",
+                    os.path.join(
+                        "proj", "alias.py"
+                    ): "da39a3ee5e6b4b0d3255bfef95601890afd80709",
+                },
+                hashes,
+            )
+
+    def test_digest_store(self) -> None:
+        with tempfile.TemporaryDirectory() as d:
+            env = {"HONESTY_DIGESTS": os.path.join(d, "digests.sqlite3")}
+            old = Path(d, "foo-0.1-py3-none-any.whl")
+            new = Path(d, "foo-0.2-py3-none-any.whl")
+            with zipfile.ZipFile(old, "w", zipfile.ZIP_DEFLATED) as zf:
+                zf.writestr("foo/__init__.py", "")
+                zf.writestr("foo/a.py", "a = 1\r\n")
+            with zipfile.ZipFile(new, "w", zipfile.ZIP_DEFLATED) as zf:
+                zf.writestr("foo/__init__.py", "")
+                zf.writestr("foo/a.py", "a = 2\n")
+
+            with mock.patch.dict(os.environ, env):
+                first = archive_hashes(old)
+                # \r\n normalized, as without the store
+                self.assertEqual(
+                    "31bd2185b0feac6e0c3da31b83b83819ef32a9a6",
+                    first[os.path.join("foo", "a.py")],
+                )
+                with DigestStore(env["HONESTY_DIGESTS"]) as store:
+                    self.assertEqual(2, len(store.get_many(_keys(old))))
+
+                # Seen members aren't even decompressed
+                with mock.patch.object(
+                    zipfile.ZipFile, "read", side_effect=AssertionError
+                ):
+                    self.assertEqual(first, archive_hashes(old))
+
+                # Changed contents are a different key
+                second = archive_hashes(new)
+                self.assertEqual(
+                    first[os.path.join("foo", "__init__.py")],
+                    second[os.path.join("foo", "__init__.py")],
+                )
+                self.assertNotEqual(
+                    first[os.path.join("foo", "a.py")],
+                    second[os.path.join("foo", "a.py")],
+                )
+
+            # Turned off
+            with mock.patch.dict(os.environ, {"HONESTY_DIGESTS": ""}):
+                self.assertIsNone(open_store())
+                self.assertEqual(second, archive_hashes(new))
+
+
+def _keys(path: Path) -> List[bytes]:
+    with zipfile.ZipFile(path) as zf, open(path, "rb") as f:
+        return [k for k in zip_member_keys(f, zf.infolist()) if k is not None]
@@ -0,0 +1,104 @@
+import asyncio
+import io
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from honesty.batch import async_check_batch, parse_specs
+from honesty.checker import ERROR_RC
+from honesty.tests.archive import create_test_archive
+from honesty.tests.cache import FakeCache
+
+FOO_INDEX_CONTENTS = b"""\
+<a href="https://example.com/foo-0.1.tar.gz#sha256=00">foo-0.1.tar.gz</a>
+<a href="https://example.com/foo-0.1-py3-none-any.whl#sha256=00">foo-0.1-py3-none-any.whl</a>
+"""
+
+
+class BatchTest(unittest.TestCase):
+    def test_parse_specs(self) -> None:
+        lines = [
+            "# a comment\n",
+            "\n",
+            "-r other.txt\n",
+            "foo==1.0 \\\n",
+            "    --hash=sha256:00\n",
+            "Bar[extra] == 2.0  # pinned\n",
+            "baz; python_version < '3.8'\n",
+            "qux==*\n",
+        ]
+        self.assertEqual(
+            [
+                ("foo", "==", "1.0"),
+                ("Bar", "==", "2.0"),
+                ("baz", "", ""),
+                ("qux", "==", "*"),
+            ],
+            parse_specs(lines),
+        )
+
+    def test_check_batch(self) -> None:
+        contents = {"foo-0.1/foo.py": "x = 1\n"}
+        sdist = create_test_archive(contents, "tar.gz", "gztar")
+        wheel = create_test_archive({"foo.py": "x = 2\n"}, "whl", "zip")
+        try:
+            with tempfile.TemporaryDirectory() as d, tempfile.TemporaryDirectory() as e:
+                c = FakeCache(
+                    d,
+                    {
+                        ("foo", None): FOO_INDEX_CONTENTS,
+                        (
+                            "foo",
+                            "https://example.com/foo-0.1.tar.gz",
+                        ): sdist.read_bytes(),
+                        (
+                            "foo",
+                            "https://example.com/foo-0.1-py3-none-any.whl",
+                        ): wheel.read_bytes(),
+                    },
+                )
+                output = io.StringIO()
+                with mock.patch.dict(
+                    os.environ,
+                    {
+                        "HONESTY_EXTDIR": e,
+                        "HONESTY_DIGESTS": os.path.join(e, "digests"),
+                    },
+                ):
+                    rc = asyncio.get_event_loop().run_until_complete(
+                        async_check_batch(
+                            [("foo", "", ""), ("missing", "", "")],
+                            c,  # type: ignore
+                            output,
+                            use_json=False,
+                        )
+                    )
+        finally:
+            os.remove(sdist)
+            os.remove(wheel)
+
+        self.assertEqual(8 | ERROR_RC, rc)
+        results = {
+            r["package"]: r for r in map(json.loads, output.getvalue().splitlines())
+        }
+        self.assertEqual(ERROR_RC, results["missing"]["rc"])
+        self.assertIn("error", results["missing"])
+        self.assertEqual(8, results["foo"]["rc"])
+        self.assertEqual(
+            [
+                {
+                    "version": "0.1",
+                    "rc": 8,
+                    "status": "problems",
+                    "messages": {
+                        "    foo.py differs from sdist "
+                        "9961828de79a863a1eca2edbb20c448cfc26ca47": [
+                            "foo-0.1-py3-none-any.whl"
+                        ]
+                    },
+                }
+            ],
+            results["foo"]["versions"],
+        )
@@ -1,29 +1,62 @@
 import asyncio
+import gzip
+import hashlib
 import os.path
 import posixpath
 import tempfile
+import time
 import unittest
+import zlib
 from pathlib import Path
-from typing import Any, Dict, Optional, Tuple
+from typing import Any, Callable, Dict, Optional, Tuple, TypeVar
 from unittest import mock
 
-from honesty.cache import Cache
+import aiohttp
+
+from honesty.cache import (
+    Cache,
+    ChecksumMismatch,
+    ConnectionOptions,
+    NotFound,
+    cache_dir,
+    canonical_name,
+    read_cached,
+)
+from honesty.mirrors import ranked
+
+T = TypeVar("T")
 
 
 class AiohttpStreamMock:
-    def __init__(self, content: bytes) -> None:
+    def __init__(self, content: bytes, chunks: int = 1, fail: bool = False) -> None:
         self._content = content
+        self._chunks = chunks
+        self._fail = fail
 
     # TODO async iterable[bytes]
     async def iter_any(self) -> Any:
-        yield self._content
+        size = -(-len(self._content) // self._chunks)
+        for i in range(0, len(self._content), size):
+            yield self._content[i : i + size]
+        if self._fail:
+            raise aiohttp.ClientPayloadError("truncated")
 
 
 class AiohttpResponseMock:
-    def __init__(self, content: bytes) -> None:
-        self.content = AiohttpStreamMock(content)
+    def __init__(
+        self,
+        content: bytes,
+        headers: Optional[Dict[str, str]] = None,
+        chunks: int = 1,
+        fail: bool = False,
+        delay: float = 0,
+    ) -> None:
+        self.content = AiohttpStreamMock(content, chunks, fail)
+        self.headers = headers or {}
+        self.delay = delay  # before the headers arrive
 
     async def __aenter__(self) -> "AiohttpResponseMock":
+        await asyncio.sleep(self.delay)
         return self
 
     async def __aexit__(self, *args: Any) -> None:
@@ -38,13 +71,25 @@ class FakeCache:
         self.url_to_contents = url_to_contents
         self.json_index_url = "https://pypi.org/simple/"
 
-    async def async_fetch(self, package_name: str, url: Optional[str] = None) -> Path:
-        basename = posixpath.basename(url) if url else f"{package_name}_index.html"
+    def json_url(self, pkg: str) -> str:
+        return Cache.json_url(self, pkg)  # type: ignore
+
+    async def async_fetch(
+        self,
+        pkg: str,
+        url: Optional[str] = None,
+        fresh: bool = False,
+        checksum: Optional[str] = None,
+    ) -> Path:
+        basename = posixpath.basename(url) if url else f"{pkg}_index.html"
         with open(self.path / basename, "wb") as f:
-            f.write(self.url_to_contents[(package_name, url)])
+            f.write(self.url_to_contents[(pkg, url)])
 
         return self.path / basename
 
+    async def run_io(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        return fn(*args, **kwargs)
+
 
 class CacheTest(unittest.TestCase):
     def test_fetch_caches(self) -> None:
@@ -52,7 +97,10 @@ class CacheTest(unittest.TestCase):
         d = tempfile.mkdtemp()
 
         def get_side_effect(
-            url: str, raise_for_status: bool = False, timeout: Any = None
+            url: str,
+            raise_for_status: bool = False,
+            timeout: Any = None,
+            headers: Any = None,
         ) -> AiohttpResponseMock:
             if url == "https://example.com/other":
                 return AiohttpResponseMock(b"other")
@@ -89,6 +137,327 @@ class CacheTest(unittest.TestCase):
                 with rv.open() as f:
                     self.assertEqual("relpath", f.read())
 
+    def test_local_mirror(self) -> None:
+        with tempfile.TemporaryDirectory() as d:
+            web = Path(d, "web")
+            (web / "simple" / "projectname").mkdir(parents=True)
+            (web / "simple" / "projectname" / "index.html").write_text("index")
+            (web / "pypi" / "projectname").mkdir(parents=True)
+            (web / "pypi" / "projectname" / "json").write_text("{}")
+            (web / "packages" / "ab" / "cd").mkdir(parents=True)
+            (web / "packages" / "ab" / "cd" / "projectname-0.1.tar.gz").write_text("")
+
+            with Cache(index_url=str(web / "simple"), cache_dir=d) as cache:
+                self.assertEqual(
+                    (web / "simple").resolve().as_uri() + "/", cache.index_url
+                )
+                with mock.patch.object(
+                    cache.session, "get", side_effect=NotImplementedError
+                ):
+                    # Everything is read in place, not copied into the cache
+                    rv = cache.fetch("projectname", url=None)
+                    self.assertTrue(rv.samefile(web / "simple/projectname/index.html"))
+                    rv = cache.fetch("projectname", url="../../pypi/projectname/json")
+                    self.assertTrue(rv.samefile(web / "pypi/projectname/json"))
+                    rv = cache.fetch(
+                        "projectname",
+                        url="../../packages/ab/cd/projectname-0.1.tar.gz#sha256=00",
+                    )
+                    self.assertTrue(
+                        rv.samefile(web / "packages/ab/cd/projectname-0.1.tar.gz")
+                    )
+                    with self.assertRaises(NotFound):
+                        cache.fetch("missing", url=None)
+
+    def test_negative_cache(self) -> None:
+        calls = []
+
+        def get_side_effect(url: str, **kwargs: Any) -> AiohttpResponseMock:
+            calls.append(url)
+            if url.endswith("gone-1.0.tar.gz"):
+                raise aiohttp.ClientResponseError(None, (), status=410)  # type: ignore
+            raise aiohttp.ClientResponseError(None, (), status=404)  # type: ignore
+
+        with tempfile.TemporaryDirectory() as d:
+            with Cache(index_url="https://pypi.org/simple/", cache_dir=d) as cache:
+                with mock.patch.object(
+                    cache.session, "get", side_effect=get_side_effect
+                ):
+                    for i in range(2):
+                        with self.assertRaises(NotFound) as cm:
+                            cache.fetch("missing", url=None)
+                        self.assertEqual(404, cm.exception.status)
+                        with self.assertRaises(NotFound) as cm:
+                            cache.fetch("gone", url="https://x/gone-1.0.tar.gz")
+                        self.assertEqual(410, cm.exception.status)
+                    self.assertEqual(2, len(calls))
+
+                    # Fresh index fetches ask again, but archives don't
+                    cache.fresh_index = True
+                    with self.assertRaises(NotFound):
+                        cache.fetch("missing", url=None)
+                    with self.assertRaises(NotFound):
+                        cache.fetch("gone", url="https://x/gone-1.0.tar.gz")
+                    self.assertEqual(3, len(calls))
+
+            # Expired, or opted out
+            with Cache(
+                index_url="https://pypi.org/simple/", cache_dir=d, negative_ttl=0
+            ) as cache:
+                with mock.patch.object(
+                    cache.session, "get", side_effect=get_side_effect
+                ):
+                    with self.assertRaises(NotFound):
+                        cache.fetch("gone", url="https://x/gone-1.0.tar.gz")
+                    self.assertEqual(4, len(calls))
+
+    def test_compress_index(self) -> None:
+        def get_side_effect(url: str, **kwargs: Any) -> AiohttpResponseMock:
+            if url.endswith(".tar.gz"):
+                return AiohttpResponseMock(b"archive")
+            elif url.endswith("/json"):
+                return AiohttpResponseMock(
+                    gzip.compress(b"{}"), {"Content-Encoding": "gzip"}
+                )
+            return AiohttpResponseMock(b"<html>")
+
+        with tempfile.TemporaryDirectory() as d:
+            with Cache(
+                index_url="https://pypi.org/simple/",
+                cache_dir=d,
+                compress_index="gzip",
+                connection_options=ConnectionOptions(auto_decompress=False),
+            ) as cache:
+                with mock.patch.object(
+                    cache.session, "get", side_effect=get_side_effect
+                ):
+                    rv = cache.fetch("projectname", url=None)
+                    self.assertEqual("index.html.gz", rv.name)
+                    self.assertEqual(b"<html>", read_cached(rv))
+                    # Already gzip from the server, stored as-is
+                    rv = cache.fetch("projectname", url="https://x/pypi/p/json")
+                    self.assertEqual("json.gz", rv.name)
+                    self.assertEqual(b"{}", read_cached(rv))
+                    # Archives are never recompressed
+                    rv = cache.fetch("projectname", url="https://x/p-1.0.tar.gz")
+                    self.assertEqual(b"archive", read_cached(rv))
+
+            # Compressed entries are still hits with compression turned off
+            with Cache(index_url="https://pypi.org/simple/", cache_dir=d) as cache:
+                rv = cache.fetch("projectname", url=None)
+                self.assertEqual("index.html.gz", rv.name)
+
+        with self.assertRaises(ValueError):
+            Cache(compress_index="lzma")
+
+    def test_decode_without_auto_decompress(self) -> None:
+        body = b'{"releases": {}}' * 100
+        raw = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+        encoded = {
+            "deflate": zlib.compress(body),
+            "raw": raw.compress(body) + raw.flush(),
+            "gzip": gzip.compress(body),
+            "br": b"?",
+        }
+
+        def get_side_effect(url: str, **kwargs: Any) -> AiohttpResponseMock:
+            self.assertEqual("gzip, deflate", kwargs["headers"]["Accept-Encoding"])
+            name = url.split("/")[-2]
+            header = "deflate" if name == "raw" else name
+            return AiohttpResponseMock(
+                encoded[name], {"Content-Encoding": header}, chunks=3
+            )
+
+        with tempfile.TemporaryDirectory() as d:
+            with Cache(
+                index_url="https://pypi.org/simple/",
+                cache_dir=d,
+                connection_options=ConnectionOptions(auto_decompress=False),
+            ) as cache:
+                with mock.patch.object(
+                    cache.session, "get", side_effect=get_side_effect
+                ):
+                    for name in ("deflate", "raw", "gzip"):
+                        rv = cache.fetch(name, url=f"https://x/pypi/{name}/json")
+                        self.assertEqual("json", rv.name)
+                        self.assertEqual(body, rv.read_bytes())
+                    with self.assertRaises(ValueError):
+                        cache.fetch("br", url="https://x/pypi/br/json")
+
+    def test_buffered_writes(self) -> None:
+        contents = bytes(range(256)) * 10
+
+        def get_side_effect(url: str, **kwargs: Any) -> AiohttpResponseMock:
+            # bad.whl fails after the first chunks have been written
+            return AiohttpResponseMock(
+                contents, chunks=10, fail=url.endswith("bad.whl")
+            )
+
+        with tempfile.TemporaryDirectory() as d:
+            with Cache(index_url="https://pypi.org/simple/", cache_dir=d) as cache:
+                with mock.patch.object(
+                    cache.session, "get", side_effect=get_side_effect
+                ), mock.patch("honesty.cache.BUFFER_SIZE", 300):
+                    rv = cache.fetch("foo", url="https://x/foo.whl")
+                    self.assertEqual(contents, rv.read_bytes())
+
+                    with self.assertRaises(aiohttp.ClientPayloadError):
+                        cache.fetch("foo", url="https://x/bad.whl")
+                    self.assertEqual(["foo.whl"], os.listdir(rv.parent))
+
+            # Usable again after close
+            self.assertIsNone(cache._io_executor)
+            with mock.patch.object(cache.session, "get", side_effect=get_side_effect):
+                cache.fetch("foo", url="https://x/foo2.whl")
+            cache.loop.run_until_complete(cache.close())
+
+    def test_canonical_names(self) -> None:
+        self.assertEqual("zope-interface", canonical_name("Zope_.Interface"))
+        self.assertEqual(Path("dj", "an", "django"), cache_dir("DJANGO"))
+
+        calls = []
+
+        def get_side_effect(url: str, **kwargs: Any) -> AiohttpResponseMock:
+            calls.append(url)
+            return AiohttpResponseMock(b"<html>", chunks=3)
+
+        async def fetch_both(cache: Cache) -> Tuple[Path, Path]:
+            return await asyncio.gather(
+                cache.async_fetch("Zope.Interface", url=None),
+                cache.async_fetch("zope_interface", url=None),
+            )
+
+        with tempfile.TemporaryDirectory() as d:
+            with Cache(index_url="https://pypi.org/simple/", cache_dir=d) as cache:
+                with mock.patch.object(
+                    cache.session, "get", side_effect=get_side_effect
+                ):
+                    a, b = cache.loop.run_until_complete(fetch_both(cache))
+                    self.assertEqual(a, b)
+                    self.assertEqual(["https://pypi.org/simple/zope-interface/"], calls)
+                    self.assertTrue(cache.is_index_cached("ZOPE-INTERFACE"))
+                    self.assertEqual(
+                        "https://pypi.org/pypi/zope-interface/json",
+                        cache.json_url("Zope.Interface"),
+                    )
+
+    def test_migrate_layout(self) -> None:
+        with tempfile.TemporaryDirectory() as d:
+            old = Path(d, "Dj", "an", "Django")
+            old.mkdir(parents=True)
+            (old / "index.html").write_text("old layout")
+            (old / "json").write_text("old layout")
+            new = Path(d, "dj", "an", "django")
+            new.mkdir(parents=True)
+            (new / "json").write_text("new layout")
+
+            with Cache(index_url="https://pypi.org/simple/", cache_dir=d) as cache:
+                self.assertTrue(cache.is_index_cached("django"))
+                self.assertEqual("old layout", (new / "index.html").read_text())
+                # The canonical entry wins
+                self.assertEqual("new layout", (new / "json").read_text())
+                # (Unless the filesystem is case-insensitive)
+                self.assertFalse(old.exists() and not os.path.samefile(old, new))
+                self.assertEqual("2", Path(d, "layout").read_text())
+
+    def test_mirrors(self) -> None:
+        good = f"sha256={hashlib.sha256(b'good').hexdigest()}"
+        calls = []
+
+        def get_side_effect(url: str, **kwargs: Any) -> AiohttpResponseMock:
+            calls.append(url)
+            name = posixpath.basename(url)
+            local = url.startswith("https://local/")
+            if name == "gone.whl" or (local and name == "partial.whl"):
+                raise aiohttp.ClientResponseError(None, (), status=404)  # type: ignore
+            elif local and name == "corrupt.whl":
+                return AiohttpResponseMock(b"bad")
+            elif local and name == "slow.whl":
+                return AiohttpResponseMock(b"good", delay=10)
+            elif name == "slower.whl":
+                return AiohttpResponseMock(b"good", delay=0.5)
+            return AiohttpResponseMock(b"good", {"X-PyPI-Last-Serial": "5"})
+
+        def fetch(cache: Cache, name: str) -> Path:
+            return cache.fetch(
+                "foo", f"https://files.pythonhosted.org/packages/ab/{name}"
+            )
+
+        with tempfile.TemporaryDirectory() as d:
+            with Cache(
+                index_url="https://local/simple/ https://pypi.org/simple/",
+                cache_dir=d,
+                hedge_delay=0.05,
+            ) as cache:
+                local, pypi = cache.mirrors
+                self.assertEqual("https://local/simple/", cache.index_url)
+                self.assertEqual("https://local/packages/", local.files_url)
+
+                with mock.patch.object(
+                    cache.session, "get", side_effect=get_side_effect
+                ):
+                    # The first mirror is asked first
+                    rv = cache.fetch("foo", None)
+                    self.assertEqual(["https://local/simple/foo/"], calls)
+                    self.assertEqual("5", rv.with_name("index.html.serial").read_text())
+
+                    # Missing on one mirror, or wrong there
+                    pypi.latency = 1.0
+                    for name in ("partial.whl", "corrupt.whl"):
+                        del calls[:]
+                        rv = cache.loop.run_until_complete(
+                            cache.async_fetch(
+                                "foo",
+                                f"https://files.pythonhosted.org/packages/ab/{name}",
+                                checksum=good,
+                            )
+                        )
+                        self.assertEqual(b"good", rv.read_bytes())
+                        self.assertEqual(2, len(calls))
+
+                    # Wrong everywhere
+                    with self.assertRaises(ChecksumMismatch):
+                        cache.loop.run_until_complete(
+                            cache.async_fetch(
+                                "foo",
+                                "https://files.pythonhosted.org/packages/ab/x.whl",
+                                checksum="sha256=00",
+                            )
+                        )
+
+                    # Only gone if every mirror says so
+                    with self.assertRaises(NotFound):
+                        fetch(cache, "gone.whl")
+
+                    # Hedged onto pypi, which wins and is preferred from now on
+                    pypi.latency = local.latency = 0.0
+                    t0 = time.monotonic()
+                    rv = fetch(cache, "slow.whl")
+                    self.assertLess(time.monotonic() - t0, 5)
+                    self.assertEqual(b"good", rv.read_bytes())
+                    self.assertEqual([pypi, local], ranked(cache.mirrors))
+
+                    # Slow everywhere; waits without spinning once all started
+                    cpu0 = time.process_time()
+                    fetch(cache, "slower.whl")
+                    self.assertLess(time.process_time() - cpu0, 0.2)
+
+                    self.assertEqual(
+                        [
+                            "corrupt.whl",
+                            "index.html",
+                            "index.html.serial",
+                            "partial.whl",
+                            "slow.whl",
+                            "slower.whl",
+                        ],
+                        sorted(
+                            n
+                            for n in os.listdir(rv.parent)
+                            if not n.endswith(".missing")
+                        ),
+                    )
+
     def test_cache_defaults(self) -> None:
         with Cache() as cache:
             self.assertEqual(
@@ -106,6 +475,15 @@ class CacheTest(unittest.TestCase):
             self.assertEqual(Path("/tmp"), cache.cache_path)
             self.assertEqual("https://example.com/foo/", cache.index_url)
 
+    def test_connection_options(self) -> None:
+        opts = ConnectionOptions(limit=5, limit_per_host=2, auto_decompress=False)
+        with Cache(connection_options=opts) as cache:
+            session = cache.session
+            self.assertIs(session, cache.session)
+            self.assertEqual(5, session.connector.limit)  # type: ignore
+            self.assertEqual(2, session.connector.limit_per_host)  # type: ignore
+        self.assertTrue(session.closed)
+
     def test_cache_invalid(self) -> None:
         with Cache() as cache:
             with self.assertRaises(NotImplementedError):
@@ -125,4 +503,5 @@ class CacheTest(unittest.TestCase):
         with Cache() as cache:
             self.assertTrue(cache._is_index_filename(None))
             self.assertTrue(cache._is_index_filename("json"))
+            self.assertTrue(cache._is_index_filename(""))
             self.assertFalse(cache._is_index_filename("foo-0.1.tar.gz"))
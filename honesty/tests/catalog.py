@@ -0,0 +1,122 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from datetime import datetime, timezone
+
+from honesty.catalog import Catalog
+from honesty.checker import CheckResult
+from honesty.releases import Package, async_parse_index
+from honesty.tests.cache import FakeCache
+from honesty.tests.releases import WOAH_INDEX_CONTENTS, WOAH_JSON_CONTENTS
+
+
+class CatalogTest(unittest.TestCase):
+    def _woah(self, d: str, use_json: bool) -> Package:
+        c = FakeCache(
+            d,
+            {
+                ("woah", None): WOAH_INDEX_CONTENTS,
+                ("woah", "https://pypi.org/pypi/woah/json"): WOAH_JSON_CONTENTS,
+            },
+        )
+        return asyncio.get_event_loop().run_until_complete(
+            async_parse_index("woah", c, use_json=use_json)  # type: ignore
+        )
+
+    def test_catalog(self) -> None:
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "catalog.sqlite3")
+            now = datetime(2020, 1, 1, tzinfo=timezone.utc)
+            with Catalog(path) as catalog:
+                catalog.record_package(self._woah(d, use_json=True))
+                catalog.record("woah", "0.1", native=False, license="MIT")
+                catalog.record("woah", "0.2", native=True, license="Apache-2.0")
+                catalog.record_check(CheckResult("woah", "0.2", 8, "problems"))
+                with self.assertRaises(ValueError):
+                    catalog.record("woah", "0.1", color="blue")
+
+                self.assertEqual([("woah", "0.2", None)], catalog.query("native"))
+                self.assertEqual(
+                    [("woah", "0.1", "MIT")], catalog.query("license", "mi%")
+                )
+                self.assertEqual(
+                    [("woah", "0.2", "problems")], catalog.query("problems")
+                )
+                self.assertEqual([], catalog.query("no-sdist"))
+                self.assertEqual(
+                    ["0.1", "0.2"],
+                    [r[1] for r in catalog.query("older-than", "30", now=now)],
+                )
+                self.assertEqual(
+                    [("woah", "0.1")],
+                    [
+                        r[:2]
+                        for r in catalog.query("unchecked", wanted=[("woah", None)])
+                    ],
+                )
+                self.assertEqual(
+                    [],
+                    catalog.query("native", wanted=[("woah", "0.1"), ("other", None)]),
+                )
+                with self.assertRaises(ValueError):
+                    catalog.query("older-than")
+
+            # Persistent; the simple index has the same files (so verdicts and
+            # upload times are kept) but a changed 0.2 forgets them.
+            with Catalog(path) as catalog:
+                package = self._woah(d, use_json=False)
+                catalog.record_package(package)
+                self.assertEqual([("woah", "0.2", None)], catalog.query("native"))
+                self.assertEqual(2, len(catalog.query("older-than", "30", now=now)))
+
+                package.releases["0.2"].files[0].checksum = "sha256=00"
+                del package.releases["0.1"]
+                catalog.record_package(package)
+                self.assertEqual([], catalog.query("native"))
+                self.assertEqual([("woah", "0.2", None)], catalog.query("unchecked"))
+
+    def test_canonical_names(self) -> None:
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "catalog.sqlite3")
+            with Catalog(path) as catalog:
+                package = self._woah(d, use_json=True)
+                package.name = "Woah"
+                catalog.record_package(package)
+                package.name = "WOAH"
+                catalog.record_package(package)
+                catalog.record("woah", "0.2", native=True)
+                self.assertEqual([("woah", "0.2", None)], catalog.query("native"))
+                self.assertEqual(
+                    [("woah", "0.2", None)],
+                    catalog.query("native", wanted=[("Woah", None)]),
+                )
+                self.assertEqual(
+                    1,
+                    catalog.conn.execute("SELECT COUNT(*) FROM packages").fetchone()[0],
+                )
+
+                # As recorded before names were canonical
+                catalog.conn.execute("PRAGMA user_version = 1")
+                with catalog.conn:
+                    catalog.conn.execute(
+                        "UPDATE releases SET package = 'Woah' WHERE version = '0.1'"
+                    )
+                    catalog.conn.execute(
+                        "INSERT INTO releases SELECT 'WOAH', version, checksums, "
+                        "has_sdist, has_wheel, first_upload, 0, pep517, license, "
+                        "check_rc, check_status FROM releases WHERE version = '0.2'"
+                    )
+                    catalog.conn.execute("INSERT INTO packages VALUES ('Woah', 'then')")
+
+            with Catalog(path) as catalog:
+                self.assertEqual(
+                    [("woah", "0.1"), ("woah", "0.2")],
+                    [r[:2] for r in catalog.query("unchecked")],
+                )
+                # The canonical row won
+                self.assertEqual([("woah", "0.2", None)], catalog.query("native"))
+                self.assertEqual(
+                    [("woah",)],
+                    catalog.conn.execute("SELECT name FROM packages").fetchall(),
+                )
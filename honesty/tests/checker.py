@@ -0,0 +1,139 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from typing import Dict, Optional, Tuple
+from unittest import mock
+
+from honesty.api import bounded_gather
+from honesty.checker import (
+    ERROR_RC,
+    CheckResult,
+    ResultCache,
+    async_has_nativemodules,
+    async_is_pep517,
+    async_run_checker,
+)
+from honesty.releases import async_parse_index
+from honesty.tests.archive import create_test_archive
+from honesty.tests.cache import FakeCache
+from honesty.wheels import WheelSelection
+
+FOO_INDEX_CONTENTS = b"""\
+<a href="https://example.com/foo-0.1.tar.gz#sha256=00">foo-0.1.tar.gz</a>
+<a href="https://example.com/foo-0.1-cp38-cp38-linux_x86_64.whl#sha256=00">foo-0.1-cp38-cp38-linux_x86_64.whl</a>
+<a href="https://example.com/foo-0.2.tar.gz#sha256=00">foo-0.2.tar.gz</a>
+<a href="https://example.com/foo-0.2-py3-none-any.whl#sha256=00">foo-0.2-py3-none-any.whl</a>
+"""
+
+
+class CheckerTest(unittest.TestCase):
+    def test_async_variants(self) -> None:
+        archives = {
+            "foo-0.1.tar.gz": create_test_archive(
+                {"foo-0.1/pyproject.toml": "[build-system]\n"}, "tar.gz", "gztar"
+            ),
+            "foo-0.1-cp38-cp38-linux_x86_64.whl": create_test_archive(
+                {"foo/_speedups.so": ""}, "whl", "zip"
+            ),
+            "foo-0.2.tar.gz": create_test_archive(
+                {"foo-0.2/setup.py": "setup()\n"}, "tar.gz", "gztar"
+            ),
+            "foo-0.2-py3-none-any.whl": create_test_archive(
+                {"foo/__init__.py": ""}, "whl", "zip"
+            ),
+        }
+        contents: Dict[Tuple[str, Optional[str]], bytes] = {
+            ("foo", None): FOO_INDEX_CONTENTS
+        }
+        for name, path in archives.items():
+            contents[("foo", f"https://example.com/{name}")] = path.read_bytes()
+            os.remove(path)
+
+        async def inner() -> None:
+            pkg = await async_parse_index("foo", c)  # type: ignore
+            self.assertEqual(
+                [True, False],
+                await bounded_gather(
+                    (
+                        async_is_pep517(pkg, v, False, c)  # type: ignore
+                        for v in ("0.1", "0.2")
+                    ),
+                    1,
+                ),
+            )
+            self.assertEqual(
+                [True, False],
+                await bounded_gather(
+                    (
+                        async_has_nativemodules(pkg, v, False, c)  # type: ignore
+                        for v in ("0.1", "0.2")
+                    ),
+                    2,
+                ),
+            )
+
+        with tempfile.TemporaryDirectory() as d, tempfile.TemporaryDirectory() as e:
+            c = FakeCache(d, contents)
+            with mock.patch.dict(
+                os.environ,
+                {"HONESTY_EXTDIR": e, "HONESTY_DIGESTS": os.path.join(e, "digests")},
+            ):
+                asyncio.get_event_loop().run_until_complete(inner())
+
+    def test_result_cache(self) -> None:
+        with tempfile.TemporaryDirectory() as d:
+            c = FakeCache(d, {("foo", None): FOO_INDEX_CONTENTS})
+            pkg = asyncio.get_event_loop().run_until_complete(
+                async_parse_index("foo", c)  # type: ignore
+            )
+            results = ResultCache(results_dir=d)
+            self.assertIsNone(results.get(pkg, "0.1"))
+
+            result = CheckResult("foo", "0.1", 4, "problems", {"msg": {"a", "b"}})
+            results.put(pkg, result)
+            self.assertEqual(result, results.get(pkg, "0.1"))
+            self.assertIsNone(results.get(pkg, "0.2"))
+            self.assertIsNone(ResultCache(results_dir=d, fresh=True).get(pkg, "0.1"))
+
+            # A re-uploaded file invalidates the stored verdict
+            pkg.releases["0.1"].files[0].checksum = "sha256=01"
+            self.assertIsNone(results.get(pkg, "0.1"))
+
+    def test_stored_verdict(self) -> None:
+        with tempfile.TemporaryDirectory() as d:
+            c = FakeCache(d, {("foo", None): FOO_INDEX_CONTENTS})
+            results = ResultCache(results_dir=d)
+
+            async def inner() -> CheckResult:
+                pkg = await async_parse_index("foo", c)  # type: ignore
+                results.put(pkg, stored)
+                return await async_run_checker(
+                    pkg, "0.2", False, c, results=results  # type: ignore
+                )
+
+            stored = CheckResult("foo", "0.2", 4, "problems", {"msg": {"a"}})
+            with mock.patch.object(c, "run_io", wraps=c.run_io) as run_io:
+                result = asyncio.get_event_loop().run_until_complete(inner())
+            self.assertEqual(stored, result)
+            # Read off the event loop
+            self.assertEqual(results.get, run_io.call_args[0][0])
+
+    def test_none_selected(self) -> None:
+        with tempfile.TemporaryDirectory() as d:
+            c = FakeCache(d, {("foo", None): FOO_INDEX_CONTENTS})
+            result = asyncio.get_event_loop().run_until_complete(
+                self._check_none_selected(c)
+            )
+        # Comparing nothing isn't a pass
+        self.assertEqual(("none selected", ERROR_RC), (result.status, result.rc))
+
+    async def _check_none_selected(self, c: FakeCache) -> CheckResult:
+        pkg = await async_parse_index("foo", c)  # type: ignore
+        return await async_run_checker(
+            pkg,
+            "0.2",
+            False,
+            c,  # type: ignore
+            selection=WheelSelection.parse("cp311-*-*"),
+        )
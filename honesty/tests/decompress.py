@@ -0,0 +1,91 @@
+import bz2
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from honesty.archive import extract_and_get_names
+from honesty.decompress import (
+    GZIP_EXTENSIONS,
+    STDLIB_BZ2,
+    STDLIB_GZIP,
+    Backend,
+    PipeBackend,
+    choose_backend,
+    open_decompressed,
+)
+
+GZIP_PIPE = PipeBackend("gzip", GZIP_EXTENSIONS, ["gzip", "-dc"])
+needs_gzip = unittest.skipUnless(GZIP_PIPE.available(), "no gzip binary")
+
+
+class DecompressTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.gz = Path(self.tmp.name, "foo-0.1.tar.gz")
+        self.gz.write_bytes(gzip.compress(b"x" * 100000))
+        self.bz2 = Path(self.tmp.name, "foo-0.1.tar.bz2")
+        self.bz2.write_bytes(bz2.compress(b"y" * 100000))
+
+    def test_choose_backend(self) -> None:
+        self.assertIn(".tar.gz", choose_backend(self.gz, "auto").extensions)
+        self.assertIs(STDLIB_GZIP, choose_backend(self.gz, "stdlib"))
+        self.assertIs(STDLIB_BZ2, choose_backend(self.bz2, "stdlib"))
+        with self.assertRaisesRegex(ValueError, "Unknown"):
+            choose_backend(self.gz, "foo")
+        with self.assertRaisesRegex(ValueError, "Not a compressed tarball"):
+            choose_backend(Path("foo-0.1.zip"), "auto")
+
+        with mock.patch("honesty.decompress.shutil.which", return_value=None):
+            with self.assertRaisesRegex(ValueError, "not installed"):
+                choose_backend(self.gz, "pigz")
+        with mock.patch(
+            "honesty.decompress.shutil.which", return_value="/usr/bin/pigz"
+        ):
+            # pigz doesn't do bz2, so that gets the stdlib.
+            self.assertEqual("pigz", choose_backend(self.gz, "pigz").name)
+            self.assertIn(".tar.bz2", choose_backend(self.bz2, "pigz").extensions)
+
+    def test_backend_is_abstract(self) -> None:
+        class Incomplete(Backend):
+            def available(self) -> bool:
+                return True
+
+        with self.assertRaises(TypeError):
+            Incomplete("incomplete", GZIP_EXTENSIONS)  # type: ignore
+
+    def test_stdlib(self) -> None:
+        with open_decompressed(self.gz, "stdlib") as f:
+            self.assertEqual(b"x" * 100000, f.read())
+        with open_decompressed(self.bz2, "stdlib") as f:
+            self.assertEqual(b"y" * 100000, f.read())
+
+    @needs_gzip
+    def test_pipe(self) -> None:
+        with GZIP_PIPE.open(self.gz) as f:
+            self.assertEqual(b"x" * 10, f.read(10))
+        # Stopping early is fine, the rest is drained.
+
+        self.gz.write_bytes(b"not gzip")
+        with self.assertRaisesRegex(OSError, "gzip exited"):
+            with GZIP_PIPE.open(self.gz) as f:
+                f.read()
+
+    @needs_gzip
+    def test_pipe_extract(self) -> None:
+        src = Path(self.tmp.name, "src")
+        (src / "foo-0.1").mkdir(parents=True)
+        (src / "foo-0.1" / "setup.py").write_text("setup()\n")
+        archive = shutil.make_archive(str(Path(self.tmp.name, "foo-0.1")), "gztar", src)
+        ext = Path(self.tmp.name, "ext")
+
+        with mock.patch("honesty.decompress.BACKENDS", [GZIP_PIPE]), mock.patch.dict(
+            os.environ, {"HONESTY_EXTDIR": str(ext)}
+        ):
+            root, names = extract_and_get_names(Path(archive), True)
+        self.assertEqual([("foo-0.1/setup.py", "setup.py")], names)
+        self.assertEqual("setup()\n", Path(root, "foo-0.1", "setup.py").read_text())
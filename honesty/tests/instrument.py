@@ -0,0 +1,83 @@
+import os
+import tempfile
+import unittest
+from typing import List
+from unittest import mock
+
+from honesty.archive import archive_hashes
+from honesty.instrument import (
+    Event,
+    Profile,
+    call_collecting,
+    count,
+    emit,
+    subscribe,
+    timed,
+    unsubscribe,
+)
+from honesty.tests.archive import create_test_archive
+
+
+class InstrumentTest(unittest.TestCase):
+    def test_subscribe(self) -> None:
+        events: List[Event] = []
+        subscribe(events.append)
+        try:
+            count("cache_hit", "foo", "index.html")
+            with timed("download", "foo", "foo-0.1.tar.gz") as event:
+                event.nbytes = 10
+        finally:
+            unsubscribe(events.append)
+        count("cache_miss", "foo")
+
+        self.assertEqual(2, len(events))
+        self.assertEqual(Event("cache_hit", "foo", "index.html"), events[0])
+        self.assertEqual("download", events[1].name)
+        self.assertEqual(10, events[1].nbytes)
+        self.assertGreaterEqual(events[1].seconds, 0)
+
+    def test_call_collecting(self) -> None:
+        archive = create_test_archive({"foo/__init__.py": "x = 1\n"}, "whl", "zip")
+        events: List[Event] = []
+        subscribe(events.append)
+        try:
+            with tempfile.TemporaryDirectory() as d:
+                with mock.patch.dict(
+                    os.environ,
+                    {
+                        "HONESTY_EXTDIR": d,
+                        "HONESTY_DIGESTS": os.path.join(d, "digests"),
+                    },
+                ):
+                    hashes, collected = call_collecting(archive_hashes, archive)
+        finally:
+            unsubscribe(events.append)
+            os.remove(archive)
+
+        self.assertEqual(1, len(hashes))
+        # Nothing was dispatched while collecting
+        self.assertEqual([], events)
+        self.assertEqual(["extract", "hash"], [e.name for e in collected])
+        self.assertEqual(6, collected[1].nbytes)
+
+    def test_profile(self) -> None:
+        profile = Profile()
+        subscribe(profile)
+        try:
+            emit(Event("download", "foo", "a", 1.0, 100))
+            emit(Event("download", "foo", "b", 0.5, 50))
+            emit(Event("cache_hit", "foo", "c"))
+        finally:
+            unsubscribe(profile)
+
+        self.assertEqual(
+            {
+                "download": {"count": 2, "seconds": 1.5, "bytes": 150},
+                "cache_hit": {"count": 1, "seconds": 0.0, "bytes": 0},
+            },
+            profile.as_json(),
+        )
+        lines = profile.table().splitlines()
+        self.assertEqual(3, len(lines))
+        self.assertTrue(lines[1].startswith("download"))
+        self.assertTrue(lines[2].startswith("cache_hit"))
@@ -0,0 +1,49 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from honesty.link import link_file, link_tree
+
+
+class LinkTest(unittest.TestCase):
+    def test_link_file(self) -> None:
+        with tempfile.TemporaryDirectory() as d:
+            src = Path(d, "src")
+            src.write_text("contents")
+
+            for strategy in ("hardlink", "symlink", "copy", "auto"):
+                with self.subTest(strategy):
+                    dst = Path(d, strategy)
+                    # Replaces an existing destination
+                    dst.write_text("old")
+                    used = link_file(src, dst, strategy)
+                    self.assertEqual("contents", dst.read_text())
+                    if strategy == "auto":
+                        self.assertIn(used, ("reflink", "copy"))
+                    else:
+                        self.assertEqual(strategy, used)
+
+            self.assertTrue(Path(d, "hardlink").samefile(src))
+            self.assertTrue(os.path.islink(Path(d, "symlink")))
+            self.assertFalse(Path(d, "copy").samefile(src))
+            # Never shares an inode that writing in place would modify
+            self.assertFalse(Path(d, "auto").samefile(src))
+
+            with self.assertRaises(ValueError):
+                link_file(src, Path(d, "x"), "teleport")
+
+    def test_link_tree(self) -> None:
+        with tempfile.TemporaryDirectory() as d:
+            src = Path(d, "src")
+            (src / "pkg").mkdir(parents=True)
+            (src / "setup.py").write_text("setup()\n")
+            (src / "pkg" / "__init__.py").write_text("")
+
+            link_tree(src, Path(d, "dst"), "hardlink")
+            self.assertTrue(Path(d, "dst", "setup.py").samefile(src / "setup.py"))
+            self.assertTrue(
+                Path(d, "dst", "pkg", "__init__.py").samefile(
+                    src / "pkg" / "__init__.py"
+                )
+            )
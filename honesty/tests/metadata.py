@@ -0,0 +1,120 @@
+import asyncio
+import hashlib
+import tempfile
+import unittest
+from typing import Any, Dict, List, Optional, Tuple
+from unittest import mock
+
+from honesty.cache import Cache
+from honesty.checker import async_guess_license
+from honesty.metadata import MetadataMismatch, async_fetch_metadata, parse_metadata
+from honesty.releases import async_parse_index
+from honesty.tests.cache import AiohttpResponseMock, FakeCache
+
+FOO_METADATA = b"""\
+Metadata-Version: 2.1
+Name: foo
+Version: 0.1
+Summary: A foo
+License: MIT
+Requires-Python: >=3.7
+Requires-Dist: attrs
+Requires-Dist: click (>=7)
+Classifier: License :: OSI Approved :: MIT License
+
+Long description here.
+"""
+
+FOO_SHA256 = hashlib.sha256(FOO_METADATA).hexdigest()
+
+FOO_INDEX_CONTENTS = f"""\
+<a href="https://example.com/foo-0.1.tar.gz#sha256=00">foo-0.1.tar.gz</a>
+<a href="https://example.com/foo-0.1-py3-none-any.whl#sha256=00" \
+data-dist-info-metadata="sha256={FOO_SHA256}">foo-0.1-py3-none-any.whl</a>
+<a href="https://example.com/foo-0.2-py3-none-any.whl#sha256=00" \
+data-core-metadata="sha256=00">foo-0.2-py3-none-any.whl</a>
+""".encode()
+
+
+class MetadataTest(unittest.TestCase):
+    def test_parse_metadata(self) -> None:
+        md = parse_metadata(FOO_METADATA)
+        self.assertEqual("foo", md.name)
+        self.assertEqual(">=3.7", md.requires_python)
+        self.assertEqual(["attrs", "click (>=7)"], md.requires_dist)
+        self.assertEqual("MIT", md.license_hint())
+
+        md.license = "UNKNOWN"
+        self.assertEqual("MIT License", md.license_hint())
+        md.license_expression = "Apache-2.0"
+        self.assertEqual("Apache-2.0", md.license_hint())
+        self.assertEqual(None, parse_metadata(b"Name: x\n").license_hint())
+
+    def test_fetch_metadata(self) -> None:
+        contents: Dict[Tuple[str, Optional[str]], bytes] = {
+            ("foo", None): FOO_INDEX_CONTENTS,
+            (
+                "foo",
+                "https://example.com/foo-0.1-py3-none-any.whl.metadata",
+            ): FOO_METADATA,
+            (
+                "foo",
+                "https://example.com/foo-0.2-py3-none-any.whl.metadata",
+            ): FOO_METADATA,
+        }
+
+        async def inner(d: str) -> None:
+            c = FakeCache(d, contents)
+            pkg = await async_parse_index("foo", c)  # type: ignore
+            sdist, wheel = pkg.releases["0.1"].files
+            self.assertEqual(None, sdist.metadata)
+            self.assertEqual(f"sha256={FOO_SHA256}", wheel.metadata)
+            self.assertEqual(None, wheel.requires_python)
+
+            self.assertEqual(None, await async_fetch_metadata("foo", sdist, c))  # type: ignore
+            md = await async_fetch_metadata("foo", wheel, c)  # type: ignore
+            self.assertIsNotNone(md)
+            self.assertIs(md, wheel.core_metadata)
+            self.assertEqual(">=3.7", wheel.requires_python)
+
+            # Answered without touching the sdist, which FakeCache doesn't have
+            self.assertEqual(
+                "MIT",
+                await async_guess_license(
+                    pkg, "0.1", False, c, use_metadata=True  # type: ignore
+                ),
+            )
+
+            with self.assertRaises(MetadataMismatch):
+                await async_fetch_metadata(
+                    "foo", pkg.releases["0.2"].files[0], c  # type: ignore
+                )
+
+        with tempfile.TemporaryDirectory() as d:
+            asyncio.get_event_loop().run_until_complete(inner(d))
+
+    def test_fetch_metadata_verified(self) -> None:
+        served: List[bytes] = [b"Name: evil\n", FOO_METADATA]
+
+        def get_side_effect(url: str, **kwargs: Any) -> AiohttpResponseMock:
+            if url.endswith(".metadata"):
+                return AiohttpResponseMock(served.pop(0))
+            return AiohttpResponseMock(FOO_INDEX_CONTENTS)
+
+        async def inner(cache: Cache) -> None:
+            pkg = await async_parse_index("foo", cache, use_json=False)
+            wheel = pkg.releases["0.1"].files[1]
+            with self.assertRaises(MetadataMismatch):
+                await async_fetch_metadata("foo", wheel, cache)
+            # The bad one wasn't kept, so asking again fetches it again.
+            md = await async_fetch_metadata("foo", wheel, cache)
+            assert md is not None
+            self.assertEqual("foo", md.name)
+
+        with tempfile.TemporaryDirectory() as d:
+            with Cache(index_url="https://pypi.org/simple/", cache_dir=d) as cache:
+                with mock.patch.object(
+                    cache.session, "get", side_effect=get_side_effect
+                ):
+                    cache.loop.run_until_complete(inner(cache))
+            self.assertEqual([], served)
@@ -0,0 +1,133 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from typing import Dict, Optional, Tuple
+from unittest import mock
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from honesty.checker import async_run_checker
+from honesty.instrument import Event, subscribe, unsubscribe
+from honesty.metrics import Metrics, dumping
+from honesty.releases import async_parse_index
+from honesty.server import Server
+from honesty.tests.archive import create_test_archive
+from honesty.tests.cache import FakeCache
+from honesty.tests.checker import FOO_INDEX_CONTENTS
+
+
+def _samples(text: str) -> Dict[str, str]:
+    return dict(
+        line.rsplit(" ", 1) for line in text.splitlines() if not line.startswith("#")
+    )
+
+
+class MetricsTest(unittest.TestCase):
+    def test_render(self) -> None:
+        metrics = Metrics(buckets=(0.1, 1.0))
+        self.assertIsNone(metrics.hit_ratio())
+        metrics(Event("cache_hit", "foo"))
+        metrics(Event("cache_hit", "foo"))
+        metrics(Event("cache_miss", "foo"))
+        metrics(Event("download", "foo", seconds=0.05, nbytes=100))
+        metrics(Event("download", "foo", seconds=0.1, nbytes=200))
+        metrics(Event("download", "foo", seconds=2.0, nbytes=300))
+        metrics(Event("check", "foo", "0.1", rc=0))
+        metrics(Event("check", "foo", "0.2", rc=12))
+
+        samples = _samples(metrics.render())
+        self.assertEqual("2", samples['honesty_cache_requests_total{result="hit"}'])
+        self.assertEqual("1", samples['honesty_cache_requests_total{result="miss"}'])
+        self.assertAlmostEqual(2 / 3, float(samples["honesty_cache_hit_ratio"]))
+        # Cumulative, and le is inclusive
+        self.assertEqual(
+            ["2", "2", "3"],
+            [
+                samples[f'honesty_phase_seconds_bucket{{phase="download",le="{le}"}}']
+                for le in ("0.1", "1.0", "+Inf")
+            ],
+        )
+        self.assertEqual("3", samples['honesty_phase_seconds_count{phase="download"}'])
+        self.assertAlmostEqual(
+            2.15, float(samples['honesty_phase_seconds_sum{phase="download"}'])
+        )
+        self.assertEqual("600", samples['honesty_phase_bytes_total{phase="download"}'])
+        self.assertNotIn('honesty_phase_bytes_total{phase="hash"}', samples)
+        self.assertEqual("2", samples["honesty_checks_total"])
+        self.assertEqual(
+            ["0", "1", "1"],
+            [
+                samples[f'honesty_check_rc_bits_total{{bit="{bit}"}}']
+                for bit in (1, 4, 8)
+            ],
+        )
+
+    def test_check(self) -> None:
+        contents: Dict[Tuple[str, Optional[str]], bytes] = {
+            ("foo", None): FOO_INDEX_CONTENTS
+        }
+        for name, files, ext, fmt in (
+            ("foo-0.2.tar.gz", {"foo-0.2/setup.py": ""}, "tar.gz", "gztar"),
+            ("foo-0.2-py3-none-any.whl", {"foo/__init__.py": ""}, "whl", "zip"),
+        ):
+            path = create_test_archive(files, ext, fmt)
+            contents[("foo", f"https://example.com/{name}")] = path.read_bytes()
+            os.remove(path)
+
+        async def inner() -> None:
+            pkg = await async_parse_index("foo", c)  # type: ignore
+            result = await async_run_checker(pkg, "0.2", False, c)  # type: ignore
+            self.assertEqual(4, result.rc)
+
+        metrics = Metrics()
+        subscribe(metrics)
+        try:
+            with tempfile.TemporaryDirectory() as d:
+                c = FakeCache(d, contents)
+                with mock.patch.dict(
+                    os.environ,
+                    {
+                        "HONESTY_EXTDIR": d + "/ext",
+                        "HONESTY_DIGESTS": d + "/digests",
+                    },
+                ):
+                    asyncio.get_event_loop().run_until_complete(inner())
+        finally:
+            unsubscribe(metrics)
+
+        samples = _samples(metrics.render())
+        self.assertEqual("1", samples["honesty_checks_total"])
+        self.assertEqual("1", samples['honesty_check_rc_bits_total{bit="4"}'])
+        for phase in ("index_parse", "hash", "compare", "check"):
+            self.assertNotEqual(
+                "0", samples[f'honesty_phase_seconds_count{{phase="{phase}"}}']
+            )
+
+    def test_dump_and_serve(self) -> None:
+        metrics = Metrics()
+        metrics(Event("index_fetch", "foo", seconds=0.2, nbytes=1000))
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "honesty.prom")
+            with dumping(metrics, path, interval=0.01):
+                metrics(Event("cache_miss", "foo"))
+            with open(path) as f:
+                dumped = f.read()
+            self.assertEqual(metrics.render(), dumped)
+            self.assertIn('honesty_cache_requests_total{result="miss"} 1', dumped)
+            self.assertEqual(["honesty.prom"], os.listdir(d))
+
+            async def inner() -> None:
+                server = Server(FakeCache(d, {}), metrics=metrics)  # type: ignore
+                async with TestClient(TestServer(server.app())) as client:
+                    resp = await client.get("/metrics")
+                    self.assertEqual(200, resp.status)
+                    self.assertEqual("text/plain", resp.content_type)
+                    self.assertEqual(dumped, await resp.text())
+
+                server = Server(FakeCache(d, {}))  # type: ignore
+                async with TestClient(TestServer(server.app())) as client:
+                    resp = await client.get("/metrics")
+                    self.assertEqual(404, resp.status)
+
+            asyncio.get_event_loop().run_until_complete(inner())
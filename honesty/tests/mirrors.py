@@ -0,0 +1,70 @@
+import unittest
+from typing import List
+
+from honesty.mirrors import Mirror, alternatives, find, ranked
+
+
+def _mirrors() -> List[Mirror]:
+    return [
+        Mirror.from_urls("http://local/simple/", "http://local/simple/"),
+        Mirror.from_urls("https://pypi.org/simple/", "https://pypi.org/simple/"),
+    ]
+
+
+class MirrorsTest(unittest.TestCase):
+    def test_roots(self) -> None:
+        local, pypi = _mirrors()
+        self.assertEqual(
+            (
+                "http://local/simple/",
+                "http://local/pypi/",
+                "http://local/packages/",
+            ),
+            local.roots,
+        )
+        self.assertEqual("https://files.pythonhosted.org/packages/", pypi.files_url)
+
+    def test_alternatives(self) -> None:
+        mirrors = _mirrors()
+        self.assertEqual(
+            [
+                "http://local/packages/ab/cd/foo-1.0.tar.gz",
+                "https://files.pythonhosted.org/packages/ab/cd/foo-1.0.tar.gz",
+            ],
+            alternatives(
+                "https://files.pythonhosted.org/packages/ab/cd/foo-1.0.tar.gz",
+                mirrors,
+            ),
+        )
+        self.assertEqual(
+            ["http://local/pypi/foo/json", "https://pypi.org/pypi/foo/json"],
+            alternatives("http://local/pypi/foo/json", mirrors),
+        )
+        # Hosted somewhere else entirely
+        self.assertEqual(
+            ["https://example.com/foo.whl"],
+            alternatives("https://example.com/foo.whl", mirrors),
+        )
+        # Or only one mirror
+        self.assertEqual(
+            ["http://local/simple/foo/"],
+            alternatives("http://local/simple/foo/", mirrors[:1]),
+        )
+        self.assertIsNone(find("https://example.com/foo.whl", mirrors))
+
+    def test_ranking(self) -> None:
+        local, pypi = _mirrors()
+        # Untried keep their order
+        self.assertEqual([local, pypi], ranked([local, pypi]))
+
+        local.record(0.2, 1000, 0.01)
+        self.assertIsNone(local.throughput)
+        # Optimistic about the untried one
+        self.assertEqual([pypi, local], ranked([local, pypi]))
+
+        pypi.record(0.05, 2**20, 1.0)
+        self.assertEqual([local, pypi], ranked([local, pypi]))
+
+        local.record_failure()
+        self.assertEqual(1, local.failures)
+        self.assertEqual([pypi, local], ranked([local, pypi]))
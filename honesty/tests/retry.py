@@ -0,0 +1,123 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from typing import Any, List
+from unittest import mock
+
+import aiohttp
+
+from honesty.cache import Cache, NotFound
+from honesty.retry import AdaptiveLimiter, RetryPolicy, parse_retry_after
+from honesty.tests.cache import AiohttpResponseMock
+
+
+class RetryTest(unittest.TestCase):
+    def test_delay(self) -> None:
+        policy = RetryPolicy(backoff=1.0, max_backoff=5.0, max_retry_after=60.0)
+        for attempt in range(6):
+            self.assertLessEqual(policy.delay(attempt), min(5.0, 2**attempt))
+        self.assertEqual(10.0, policy.delay(0, retry_after=10.0))
+        self.assertEqual(60.0, policy.delay(0, retry_after=1000.0))
+
+    def test_parse_retry_after(self) -> None:
+        self.assertEqual(None, parse_retry_after(None))
+        self.assertEqual(None, parse_retry_after("soon"))
+        self.assertEqual(120.0, parse_retry_after("120"))
+        self.assertEqual(0.0, parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT"))
+
+    def test_limiter(self) -> None:
+        limiter = AdaptiveLimiter(initial=4, minimum=1, maximum=5)
+        limiter.failure()
+        self.assertEqual(2, limiter.limit)
+        limiter.failure()
+        limiter.failure()
+        self.assertEqual(1, limiter.limit)
+        for i in range(100):
+            limiter.success()
+        self.assertEqual(5, limiter.limit)
+
+        async def inner() -> List[int]:
+            limiter = AdaptiveLimiter(initial=2)
+            seen: List[int] = []
+
+            async def task() -> None:
+                async with limiter:
+                    seen.append(limiter.active)
+                    await asyncio.sleep(0.001)
+
+            await asyncio.gather(*[task() for i in range(6)])
+            return seen
+
+        seen = asyncio.get_event_loop().run_until_complete(inner())
+        self.assertEqual(2, max(seen))
+
+    def test_fetch_retries(self) -> None:
+        calls: List[str] = []
+
+        def get_side_effect(url: str, **kwargs: Any) -> AiohttpResponseMock:
+            calls.append(url)
+            if len(calls) == 1 or url == "https://example.com/other":
+                raise aiohttp.ClientResponseError(
+                    None, (), status=503, headers={"Retry-After": "0"}  # type: ignore
+                )
+            elif len(calls) == 2:
+                raise aiohttp.ClientConnectionError()
+            return AiohttpResponseMock(b"foo")
+
+        with tempfile.TemporaryDirectory() as d:
+            with Cache(
+                index_url="https://pypi.org/simple/",
+                cache_dir=d,
+                retry=RetryPolicy(retries=2, backoff=0.001),
+            ) as cache:
+                with mock.patch.object(
+                    cache.session, "get", side_effect=get_side_effect
+                ):
+                    rv = cache.fetch("projectname", url=None)
+                    self.assertEqual("foo", rv.read_text())
+                    self.assertEqual(3, len(calls))
+                    self.assertLess(cache.limiter.limit, 16)
+
+                    calls.clear()
+                    with self.assertRaises(aiohttp.ClientResponseError):
+                        cache.fetch("projectname", url="https://example.com/other")
+                    self.assertEqual(3, len(calls))
+
+    def test_retry_truncated_body(self) -> None:
+        calls: List[str] = []
+
+        def get_side_effect(url: str, **kwargs: Any) -> AiohttpResponseMock:
+            calls.append(url)
+            return AiohttpResponseMock(b"foo", chunks=3, fail=len(calls) == 1)
+
+        with tempfile.TemporaryDirectory() as d:
+            with Cache(
+                index_url="https://pypi.org/simple/",
+                cache_dir=d,
+                retry=RetryPolicy(retries=3, backoff=0.001),
+            ) as cache:
+                with mock.patch.object(
+                    cache.session, "get", side_effect=get_side_effect
+                ):
+                    rv = cache.fetch("projectname", url="https://x/foo-1.0.tar.gz")
+                    self.assertEqual("foo", rv.read_text())
+                    self.assertEqual(2, len(calls))
+                    self.assertLess(cache.limiter.limit, 16)
+                    self.assertEqual(["foo-1.0.tar.gz"], os.listdir(rv.parent))
+
+    def test_no_retry_on_404(self) -> None:
+        calls: List[str] = []
+
+        def get_side_effect(url: str, **kwargs: Any) -> AiohttpResponseMock:
+            calls.append(url)
+            raise aiohttp.ClientResponseError(None, (), status=404)  # type: ignore
+
+        with tempfile.TemporaryDirectory() as d:
+            with Cache(index_url="https://pypi.org/simple/", cache_dir=d) as cache:
+                with mock.patch.object(
+                    cache.session, "get", side_effect=get_side_effect
+                ):
+                    with self.assertRaises(NotFound):
+                        cache.fetch("projectname", url=None)
+        self.assertEqual(1, len(calls))
@@ -0,0 +1,157 @@
+import asyncio
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+from typing import List
+from unittest import mock
+
+from honesty.checker import ERROR_RC
+from honesty.scan import (
+    MAX_ATTEMPTS,
+    ResultRow,
+    Shard,
+    WorkQueue,
+    async_work,
+    shard_runner,
+)
+from honesty.tests.cache import FakeCache
+
+
+async def _fake_run(shard: Shard) -> List[ResultRow]:
+    await asyncio.sleep(0.1)
+    return [
+        (spec, task, 0, {"pid": os.getpid()})
+        for spec in shard.specs
+        for task in shard.tasks
+    ]
+
+
+def _worker(path: str) -> int:
+    loop = asyncio.new_event_loop()
+    try:
+        with WorkQueue(path) as queue:
+            return loop.run_until_complete(
+                async_work(queue, _fake_run, lease=1.0, poll_interval=0.05)
+            )
+    finally:
+        loop.close()
+
+
+class ScanTest(unittest.TestCase):
+    def test_leases(self) -> None:
+        with tempfile.TemporaryDirectory() as d:
+            with WorkQueue(os.path.join(d, "q.sqlite3")) as queue:
+                self.assertEqual(2, queue.add(["a", "b==1.0", "c"], ["check"], 2))
+                with self.assertRaises(ValueError):
+                    queue.add(["a"], ["frobnicate"])
+
+                now = time.time()
+                first = queue.claim("w1", 10, now)
+                assert first is not None
+                self.assertEqual(["a", "b==1.0"], first.specs)
+                second = queue.claim("w2", 10, now)
+                assert second is not None
+                self.assertEqual(["c"], second.specs)
+                self.assertIsNone(queue.claim("w3", 10, now))
+                self.assertEqual(
+                    {"pending": 0, "running": 2, "done": 0, "failed": 0},
+                    queue.status(),
+                )
+
+                # w1 stalls; after its lease, w3 gets the shard and w1 can't
+                # record (or renew) it any more.
+                again = queue.claim("w3", 10, now + 11)
+                assert again is not None
+                self.assertEqual(first.id, again.id)
+                self.assertFalse(queue.renew(first, "w1", 10))
+                self.assertFalse(queue.complete(first, "w1", []))
+                self.assertTrue(
+                    queue.complete(again, "w3", [("a", "check", 0, {"x": 1})])
+                )
+                self.assertEqual([("a", "check", 0, {"x": 1})], list(queue.results()))
+
+                # Released after errors until it's out of attempts
+                self.assertTrue(queue.renew(second, "w2", 10))
+                for i in range(MAX_ATTEMPTS - 1):
+                    queue.release(second, "w2", "boom")
+                    retry = queue.claim("w2", 10)
+                    assert retry is not None
+                    self.assertEqual(second.id, retry.id)
+                queue.release(second, "w2", "boom")
+                self.assertEqual(
+                    {"pending": 0, "running": 0, "done": 1, "failed": 1},
+                    queue.status(),
+                )
+                self.assertEqual(
+                    [(second.id, "boom")], [(s.id, e) for s, e in queue.failures()]
+                )
+                self.assertEqual(0, queue.unfinished())
+
+    def test_renew_fails(self) -> None:
+        async def stall(shard: Shard) -> List[ResultRow]:
+            await asyncio.sleep(60)
+            return []
+
+        with tempfile.TemporaryDirectory() as d:
+            with WorkQueue(os.path.join(d, "q.sqlite3")) as queue:
+                queue.add(["a"])
+                with mock.patch.object(
+                    queue,
+                    "renew",
+                    side_effect=sqlite3.OperationalError("database is locked"),
+                ):
+                    completed = asyncio.get_event_loop().run_until_complete(
+                        asyncio.wait_for(async_work(queue, stall, lease=0.3), 10)
+                    )
+                # The work was stopped and the shard given back each time
+                self.assertEqual(0, completed)
+                self.assertEqual(
+                    ["renewing lease: " "OperationalError('database is locked')"],
+                    [e for s, e in queue.failures()],
+                )
+
+    def test_workers(self) -> None:
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "q.sqlite3")
+            specs = [f"pkg{i}" for i in range(30)]
+            with WorkQueue(path) as queue:
+                self.assertEqual(15, queue.add(specs, ["check", "native"], 2))
+                # A worker that died holding a shard
+                self.assertIsNotNone(queue.claim("dead", 0.5))
+
+            ctx = multiprocessing.get_context("spawn")
+            with ctx.Pool(3) as pool:
+                completed = pool.map(_worker, [path] * 3)
+
+            self.assertEqual(15, sum(completed))
+            # Work was spread around
+            self.assertGreater(sum(1 for c in completed if c), 1)
+            with WorkQueue(path) as queue:
+                self.assertEqual(
+                    {"pending": 0, "running": 0, "done": 15, "failed": 0},
+                    queue.status(),
+                )
+                rows = list(queue.results())
+            self.assertEqual(
+                sorted((s, t) for s in specs for t in ("check", "native")),
+                sorted((spec, task) for spec, task, rc, result in rows),
+            )
+
+    def test_shard_runner(self) -> None:
+        with tempfile.TemporaryDirectory() as d:
+            # Nothing in the cache, so the index can't be fetched.
+            run = shard_runner(FakeCache(d, {}))  # type: ignore
+            rows = asyncio.get_event_loop().run_until_complete(
+                run(Shard(1, ["missing==1.0"], ["check", "license"]))
+            )
+        self.assertEqual(
+            [
+                ("missing==1.0", "check", ERROR_RC),
+                ("missing==1.0", "license", ERROR_RC),
+            ],
+            [(spec, task, rc) for spec, task, rc, result in rows],
+        )
+        self.assertEqual("missing", rows[0][3]["package"])
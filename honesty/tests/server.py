@@ -0,0 +1,105 @@
+import asyncio
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from typing import Optional
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer, unused_port
+
+from honesty.cache import Cache
+from honesty.server import Server
+from honesty.tests.cache import FakeCache
+from honesty.tests.releases import WOAH_JSON_CONTENTS
+
+
+class CountingFakeCache(FakeCache):
+    fetches = 0
+
+    async def async_fetch(
+        self,
+        pkg: str,
+        url: Optional[str] = None,
+        fresh: bool = False,
+        checksum: Optional[str] = None,
+    ) -> Path:
+        self.fetches += 1
+        # Give concurrent requests a chance to pile up
+        await asyncio.sleep(0.01)
+        return await super().async_fetch(pkg, url)
+
+
+class ServerTest(unittest.TestCase):
+    def test_list_and_age(self) -> None:
+        async def inner(d: str) -> None:
+            cache = CountingFakeCache(
+                d,
+                {
+                    ("woah", "https://pypi.org/pypi/woah/json"): WOAH_JSON_CONTENTS,
+                    ("empty", "https://pypi.org/pypi/empty/json"): json.dumps(
+                        {"info": {"name": "empty"}, "releases": {"1.0": []}}
+                    ).encode(),
+                },
+            )
+            server = Server(cache)  # type: ignore
+            async with TestClient(TestServer(server.app())) as client:
+                responses = await asyncio.gather(
+                    client.get("/list/woah"), client.get("/age/woah==*")
+                )
+                self.assertEqual([200, 200], [r.status for r in responses])
+                listing = await responses[0].json()
+                self.assertEqual(["0.1", "0.2"], sorted(listing["releases"]))
+                self.assertEqual(
+                    "woah-0.1-py3-none-any.whl",
+                    listing["releases"]["0.1"]["files"][0]["basename"],
+                )
+                ages = await responses[1].json()
+                self.assertEqual("2019-09-19", ages["versions"]["0.1"]["upload_time"])
+
+                # Coalesced, then served from memory
+                self.assertEqual(1, cache.fetches)
+                resp = await client.get("/list/woah")
+                self.assertEqual(200, resp.status)
+                self.assertEqual(1, cache.fetches)
+
+                # A release with no files has no age
+                resp = await client.get("/age/empty==*")
+                self.assertEqual(200, resp.status)
+                self.assertEqual({"1.0": None}, (await resp.json())["versions"])
+
+                resp = await client.get("/age/woah==9.9")
+                self.assertEqual(404, resp.status)
+                self.assertIn("9.9", (await resp.json())["error"])
+
+        with tempfile.TemporaryDirectory() as d:
+            asyncio.get_event_loop().run_until_complete(inner(d))
+
+    def test_real_cache(self) -> None:
+        async def index(request: web.Request) -> web.Response:
+            return web.Response(
+                body=WOAH_JSON_CONTENTS, content_type="application/json"
+            )
+
+        index_app = web.Application()
+        index_app.add_routes([web.get("/pypi/woah/json", index)])
+        port = unused_port()
+
+        async def inner(cache: Cache) -> None:
+            async with TestServer(index_app, port=port):
+                server = Server(cache)
+                async with TestClient(TestServer(server.app())) as client:
+                    resp = await client.get("/list/woah")
+                    self.assertEqual(200, resp.status, await resp.text())
+                    listing = await resp.json()
+                    self.assertEqual(["0.1", "0.2"], sorted(listing["releases"]))
+            await cache.close()
+
+        with tempfile.TemporaryDirectory() as d:
+            # Made outside the loop that serves, like `serve` used to.
+            cache = Cache(cache_dir=d, index_url=f"http://127.0.0.1:{port}/simple/")
+            loop = asyncio.new_event_loop()
+            try:
+                loop.run_until_complete(inner(cache))
+            finally:
+                loop.close()
@@ -0,0 +1,102 @@
+import asyncio
+import tempfile
+import unittest
+from typing import Dict, List
+from unittest import mock
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from honesty.cache import Cache
+from honesty.sync import async_sync, parse_changes, stale_indexes
+from honesty.tests.releases import WOAH_INDEX_CONTENTS
+
+
+class SyncTest(unittest.TestCase):
+    def test_parse_changes(self) -> None:
+        lines = [
+            "# serial-ordered\n",
+            "foo 10\n",
+            "bar\t1.0\t1577836800\tnew release\t12\n",
+            "foo 11\n",
+            "\n",
+        ]
+        self.assertEqual({"foo": 11, "bar": 12}, parse_changes(lines))
+
+    def test_sync(self) -> None:
+        serials = {"a": 1, "b": 2, "c": 3}
+        hits: List[str] = []
+
+        async def simple(request: web.Request) -> web.Response:
+            pkg = request.match_info["pkg"]
+            hits.append(f"simple/{pkg}")
+            if pkg not in serials:
+                raise web.HTTPNotFound()
+            return web.Response(
+                text=f"<html>{pkg} {serials[pkg]}</html>",
+                headers={"X-PyPI-Last-Serial": str(serials[pkg])},
+            )
+
+        async def json(request: web.Request) -> web.Response:
+            pkg = request.match_info["pkg"]
+            hits.append(f"json/{pkg}")
+            return web.json_response(
+                {"releases": {}}, headers={"X-PyPI-Last-Serial": str(serials[pkg])}
+            )
+
+        app = web.Application()
+        app.router.add_get("/simple/{pkg}/", simple)
+        app.router.add_get("/pypi/{pkg}/json", json)
+
+        async def inner(d: str) -> None:
+            async with TestServer(app) as server:
+                async with Cache(
+                    cache_dir=d, index_url=str(server.make_url("/simple/"))
+                ) as cache:
+                    for pkg in ("a", "b", "c"):
+                        await cache.async_fetch(pkg, None)
+                    await cache.async_fetch("a", cache.json_url("a"))
+                    self.assertEqual(2, cache.index_serial("b"))
+                    self.assertEqual(1, cache.index_serial("a", use_json=True))
+                    self.assertEqual(None, cache.index_serial("zzz"))
+
+                    serials["a"] = 10
+                    del serials["c"]
+                    changes: Dict[str, int] = {"a": 10, "b": 2, "c": 11, "zzz": 99}
+                    self.assertEqual(
+                        [("a", False), ("a", True), ("c", False)],
+                        stale_indexes(cache, changes),
+                    )
+                    hits.clear()
+                    with mock.patch.object(
+                        cache, "run_io", wraps=cache.run_io
+                    ) as run_io:
+                        results = await async_sync(cache, changes)
+                    # Serials are read off the event loop
+                    self.assertIn(
+                        stale_indexes, [c[0][0] for c in run_io.call_args_list]
+                    )
+                    self.assertEqual(["json/a", "simple/a", "simple/c"], sorted(hits))
+                    self.assertEqual([None, None], [r[2] for r in results[:2]])
+                    self.assertIn("404", results[2][2] or "")
+
+                    self.assertEqual(10, cache.index_serial("a"))
+                    path = await cache.async_fetch("a", None)
+                    self.assertEqual("<html>a 10</html>", path.read_text())
+                    # Removed upstream, so no longer served from the cache
+                    with self.assertRaises(Exception):
+                        await cache.async_fetch("c", None)
+                    self.assertEqual([], stale_indexes(cache, changes))
+
+        with tempfile.TemporaryDirectory() as d:
+            asyncio.get_event_loop().run_until_complete(inner(d))
+
+    def test_serial_comment(self) -> None:
+        with tempfile.TemporaryDirectory() as d:
+            with Cache(cache_dir=d) as cache:
+                index_file = cache._index_file("woah", use_json=False)
+                index_file.parent.mkdir(parents=True)
+                index_file.write_bytes(WOAH_INDEX_CONTENTS)
+                self.assertEqual(5860225, cache.index_serial("woah"))
+                self.assertTrue(cache.is_index_cached("woah"))
+                self.assertFalse(cache.is_index_cached("woah", use_json=True))
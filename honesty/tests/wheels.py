@@ -0,0 +1,108 @@
+import unittest
+from typing import List
+
+from honesty.checker import ResultCache
+from honesty.releases import FileEntry, Package, PackageRelease, guess_file_type
+from honesty.wheels import EXHAUSTIVE, REPRESENTATIVE, WheelSelection, WheelTags
+
+PLATFORMS = [
+    "manylinux_2_17_x86_64.manylinux2014_x86_64",
+    "manylinux_2_17_aarch64.manylinux2014_aarch64",
+    "musllinux_1_1_x86_64",
+    "macosx_10_9_x86_64",
+    "macosx_11_0_arm64",
+    "win32",
+    "win_amd64",
+]
+
+
+def _entry(basename: str, requires_python: str = ">=3.8") -> FileEntry:
+    return FileEntry(
+        url=f"https://example.com/{basename}",
+        basename=basename,
+        checksum="sha256=00",
+        file_type=guess_file_type(basename),
+        version="1.0",
+        requires_python=requires_python,
+    )
+
+
+def _files() -> List[FileEntry]:
+    files = [_entry("foo-1.0.tar.gz"), _entry("foo-1.0-py2.7.egg")]
+    for py in ("cp38", "cp39", "cp310", "cp311", "cp312"):
+        for plat in PLATFORMS:
+            files.append(_entry(f"foo-1.0-{py}-{py}-{plat}.whl"))
+    files.append(_entry("foo-1.0-py3-none-any.whl"))
+    return files
+
+
+class WheelsTest(unittest.TestCase):
+    def test_tags(self) -> None:
+        tags = WheelTags.from_filename(
+            "foo-1.0-1-cp311-cp311-manylinux1_x86_64.manylinux2010_x86_64.whl"
+        )
+        assert tags is not None
+        self.assertEqual(
+            [
+                "cp311-cp311-manylinux1_x86_64",
+                "cp311-cp311-manylinux2010_x86_64",
+            ],
+            tags.expand(),
+        )
+        self.assertEqual(("linux",), tags.families())
+        self.assertEqual((3, 11), tags.newest_python())
+        self.assertFalse(tags.pure)
+        self.assertIsNone(WheelTags.from_filename("foo-1.0.tar.gz"))
+        self.assertIsNone(WheelTags.from_filename("foo-1.0-any.whl"))
+
+    def test_select(self) -> None:
+        files = _files()
+        self.assertEqual(files, EXHAUSTIVE.select(files))
+
+        self.assertEqual(
+            [
+                "foo-1.0.tar.gz",
+                "foo-1.0-py2.7.egg",
+                "foo-1.0-cp312-cp312-manylinux_2_17_x86_64.manylinux2014_x86_64.whl",
+                "foo-1.0-cp312-cp312-macosx_10_9_x86_64.whl",
+                "foo-1.0-cp312-cp312-win_amd64.whl",
+                "foo-1.0-py3-none-any.whl",
+            ],
+            [fe.basename for fe in REPRESENTATIVE.select(files)],
+        )
+
+        # Different requires_python is presumed a different payload
+        files[-2].requires_python = ">=3.12"
+        self.assertIn(files[-2], REPRESENTATIVE.select(files))
+
+        selection = WheelSelection.parse("cp311-*-manylinux*, py3-none-any")
+        self.assertEqual(("cp311-*-manylinux*", "py3-none-any"), selection.tags)
+        self.assertEqual(
+            [
+                "foo-1.0.tar.gz",
+                "foo-1.0-py2.7.egg",
+                "foo-1.0-cp311-cp311-manylinux_2_17_x86_64.manylinux2014_x86_64.whl",
+                "foo-1.0-cp311-cp311-manylinux_2_17_aarch64.manylinux2014_aarch64.whl",
+                "foo-1.0-py3-none-any.whl",
+            ],
+            [fe.basename for fe in selection.select(files)],
+        )
+
+        self.assertEqual(REPRESENTATIVE, WheelSelection.parse("representative"))
+        with self.assertRaises(ValueError):
+            WheelSelection("sometimes")
+        # A misspelled mode isn't taken for a tag
+        for value in ("exhaustve", "cp311-*", "py3-none-any,representative"):
+            with self.assertRaises(ValueError):
+                WheelSelection.parse(value)
+
+    def test_result_key(self) -> None:
+        pkg = Package("foo", {"1.0": PackageRelease("1.0", _files())})
+        results = ResultCache(results_dir="/nonexistent")
+        keys = {
+            results.key(pkg, "1.0"),
+            results.key(pkg, "1.0", REPRESENTATIVE),
+            results.key(pkg, "1.0", WheelSelection.parse("py3-none-any")),
+        }
+        self.assertEqual(3, len(keys))
+        self.assertEqual(results.key(pkg, "1.0"), results.key(pkg, "1.0", EXHAUSTIVE))
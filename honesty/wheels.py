@@ -0,0 +1,175 @@
+"""
+Choosing which wheels of a release are worth fetching.
+
+Releases with compiled extensions commonly have dozens of platform wheels
+(every python version times manylinux, musllinux, macos and windows variants)
+whose .py files are identical.  `check` compares one representative per
+likely-distinct payload rather than downloading them all.
+"""
+
+import fnmatch
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from .releases import FileEntry, FileType
+
+MODES = ("exhaustive", "representative", "tags")
+
+PYTHON_TAG_RE = re.compile(r"^[a-z]+(\d)(\d*)$")
+# python-abi-platform, each part made of tag characters and fnmatch wildcards
+TAG_PATTERN_RE = re.compile(r"^[\w.*?\[\]!]+-[\w.*?\[\]!]+-[\w.*?\[\]!]+$")
+
+
+@dataclass(frozen=True)
+class WheelTags:
+    python: Tuple[str, ...]  # ('cp38',) or ('py2', 'py3')
+    abi: Tuple[str, ...]  # ('cp38',) or ('none',)
+    platform: Tuple[str, ...]  # ('manylinux1_x86_64', 'manylinux2010_x86_64')
+
+    @classmethod
+    def from_filename(cls, basename: str) -> Optional["WheelTags"]:
+        """
+        Parses foo-1.0(-build)-py3-none-any.whl, or returns None if it isn't
+        a well-formed wheel name.
+        """
+        if not basename.endswith(".whl"):
+            return None
+        parts = basename[: -len(".whl")].split("-")
+        if len(parts) not in (5, 6):
+            return None
+        return cls(*(tuple(p.split(".")) for p in parts[-3:]))
+
+    def expand(self) -> List[str]:
+        """
+        The individual tags ("cp38-cp38-manylinux1_x86_64") in a compressed
+        tag set.
+        """
+        return [
+            f"{p}-{a}-{pl}"
+            for p in self.python
+            for a in self.abi
+            for pl in self.platform
+        ]
+
+    @property
+    def pure(self) -> bool:
+        return self.abi == ("none",) and self.platform == ("any",)
+
+    @property
+    def mainstream(self) -> bool:
+        return any(p.endswith(("x86_64", "amd64")) for p in self.platform)
+
+    def families(self) -> Tuple[str, ...]:
+        return tuple(sorted({_platform_family(p) for p in self.platform}))
+
+    def newest_python(self) -> Tuple[int, ...]:
+        versions = [_python_version(p) for p in self.python]
+        return max(versions) if versions else ()
+
+
+def _platform_family(platform: str) -> str:
+    if platform.startswith(("manylinux", "musllinux", "linux")):
+        return "linux"
+    elif platform.startswith("macosx"):
+        return "macos"
+    elif platform.startswith("win"):
+        return "windows"
+    return platform.split("_")[0]
+
+
+def _python_version(tag: str) -> Tuple[int, ...]:
+    """
+    "cp311" -> (3, 11), "py3" -> (3,), anything else -> ()
+    """
+    m = PYTHON_TAG_RE.match(tag)
+    if not m:
+        return ()
+    return (int(m.group(1)), int(m.group(2))) if m.group(2) else (int(m.group(1)),)
+
+
+@dataclass(frozen=True)
+class WheelSelection:
+    """
+    Which wheels of a release to fetch; sdists and other kinds of files are
+    always kept.
+
+    exhaustive: every wheel.
+    representative: one per presumed payload, that is per platform family
+        (linux, macos, windows, ...) and requires_python, plus each distinct
+        pure-python wheel, preferring the newest python.
+    tags: wheels with a tag matching one of `tags` (fnmatch patterns like
+        "cp311-*-manylinux*" or "py3-none-any").
+    """
+
+    mode: str = "exhaustive"
+    tags: Tuple[str, ...] = ()
+
+    def __post_init__(self) -> None:
+        if self.mode not in MODES:
+            raise ValueError(f"Unknown wheel selection {self.mode!r}")
+        if (self.mode == "tags") != bool(self.tags):
+            raise ValueError("tags go with (only) mode='tags'")
+
+    @classmethod
+    def parse(cls, value: str) -> "WheelSelection":
+        """
+        "exhaustive", "representative", or comma-separated tag patterns.
+        """
+        if value in ("exhaustive", "representative"):
+            return cls(value)
+        tags = tuple(t.strip() for t in value.split(",") if t.strip())
+        if not tags:
+            raise ValueError("Expected exhaustive, representative or some tags")
+        for t in tags:
+            # Catches a misspelled mode, which would otherwise select nothing.
+            if not TAG_PATTERN_RE.match(t):
+                raise ValueError(
+                    f"Expected exhaustive, representative or tag patterns like "
+                    f"'cp311-*-manylinux*', not {t!r}"
+                )
+        return cls("tags", tags)
+
+    def __str__(self) -> str:
+        return ",".join(self.tags) if self.mode == "tags" else self.mode
+
+    def select(self, files: List[FileEntry]) -> List[FileEntry]:
+        """
+        The subset of files to fetch, in their original order.
+        """
+        if self.mode == "exhaustive":
+            return list(files)
+
+        wheels: List[Tuple[FileEntry, WheelTags]] = []
+        for fe in files:
+            tags = WheelTags.from_filename(fe.basename)
+            if fe.file_type == FileType.BDIST_WHEEL and tags is not None:
+                wheels.append((fe, tags))
+
+        if self.mode == "tags":
+            chosen = [
+                fe
+                for fe, tags in wheels
+                if any(fnmatch.fnmatch(t, p) for t in tags.expand() for p in self.tags)
+            ]
+        else:
+            groups: Dict[Tuple[object, ...], List[Tuple[FileEntry, WheelTags]]] = {}
+            for fe, tags in sorted(wheels, key=lambda x: x[0].basename):
+                if tags.pure:
+                    key: Tuple[object, ...] = ("any", tags.python, fe.requires_python)
+                else:
+                    key = (tags.families(), fe.requires_python)
+                groups.setdefault(key, []).append((fe, tags))
+            # The newest python, on the most common architecture; ties go to
+            # the first by name.
+            chosen = [
+                max(group, key=lambda x: (x[1].newest_python(), x[1].mainstream))[0]
+                for group in groups.values()
+            ]
+
+        skipped = {id(fe) for fe, tags in wheels} - {id(fe) for fe in chosen}
+        return [fe for fe in files if id(fe) not in skipped]
+
+
+EXHAUSTIVE = WheelSelection("exhaustive")
+REPRESENTATIVE = WheelSelection("representative")
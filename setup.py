@@ -21,4 +21,5 @@ setup(
         "dataclasses >= 0.7; python_version < '3.7'",
         "infer-license >= 0.0.6",
     ],
+    extras_require={"fast": ["isal"], "zstd": ["zstandard"]},
 )